@@ -0,0 +1,248 @@
+"""
+Command line entry point for the benchmark suite.
+
+    python -m benchmarks run --games 20000 --keys 100000 --output results.json
+    python -m benchmarks compare baseline.json results.json
+    python -m benchmarks load --commands 2000 --concurrency 20 --output load.json
+    python -m benchmarks check
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import checks, datagen, load, suite
+from discord_key_bot.common import defaults
+from discord_key_bot.db import connection
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser: argparse.ArgumentParser = commands.add_parser("run", help="seed a database and time the queries")
+    _add_data_arguments(run_parser)
+    run_parser.add_argument("--repeat", type=int, default=20, help="timed runs per benchmark")
+    run_parser.add_argument("--page-size", type=int, default=defaults.PAGE_SIZE)
+    run_parser.add_argument("--output", help="write JSON results to this file")
+
+    compare_parser: argparse.ArgumentParser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument(
+        "--stat", default="median", choices=["min", "median", "mean", "p95", "max", "vm_steps"]
+    )
+
+    load_parser: argparse.ArgumentParser = commands.add_parser(
+        "load", help="replay a command mix through the cogs with a fake discord context"
+    )
+    _add_data_arguments(load_parser)
+    load_parser.add_argument("--commands", type=int, default=1000, help="number of synthetic commands to run")
+    load_parser.add_argument("--concurrency", type=int, default=10)
+    load_parser.add_argument(
+        "--mix",
+        default=",".join(f"{command}={weight}" for command, weight in load.DEFAULT_MIX.items()),
+        help="comma separated command=weight pairs for the synthetic workload",
+    )
+    load_parser.add_argument("--workload", help="replay a recorded JSON lines workload instead")
+    load_parser.add_argument("--send-latency", type=float, default=0.0, help="simulated discord send latency in ms")
+    load_parser.add_argument("--page-size", type=int, default=defaults.PAGE_SIZE)
+    load_parser.add_argument(
+        "--snapshot", action="store_true", help="serve every guild from the in-memory inventory snapshot"
+    )
+    load_parser.add_argument("--output", help="write JSON results to this file")
+
+    check_parser: argparse.ArgumentParser = commands.add_parser(
+        "check", help="run the offline checks of output formats and concurrent behaviour"
+    )
+    check_parser.add_argument("checks", nargs="*", help=f"any of {', '.join(checks.CHECKS)}, defaults to every check")
+
+    args: argparse.Namespace = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "run":
+        return run(args)
+    if args.command == "load":
+        return asyncio.run(run_load(args))
+    if args.command == "check":
+        unknown: List[str] = [name for name in args.checks if name not in checks.CHECKS]
+        if unknown:
+            check_parser.error(f"unknown checks: {', '.join(unknown)}")
+        return 1 if checks.run_checks(args.checks) else 0
+
+    return compare(args)
+
+
+def run(args: argparse.Namespace) -> int:
+    config: datagen.SyntheticDataConfig = _data_config(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri: str = args.db or f"sqlite:///{os.path.join(tmp, 'benchmark.sqlite')}"
+        db_sessionmaker: sessionmaker = connection.new(uri)
+
+        started: float = time.perf_counter()
+        data: datagen.SeededData = datagen.seed_database(db_sessionmaker, config)
+        seed_time: float = time.perf_counter() - started
+        print(f"Seeded {config.keys} keys for {config.games} games in {seed_time:.2f}s", file=sys.stderr)
+
+        benchmarks: List[suite.Benchmark] = suite.build_benchmarks(data, args.page_size, config.seed, db_sessionmaker)
+        results: Dict[str, Dict[str, float]] = suite.run_benchmarks(db_sessionmaker, benchmarks, args.repeat)
+        db_sessionmaker.kw["bind"].dispose()
+
+    report: Dict[str, typing.Any] = {
+        "meta": _metadata(),
+        "config": config._asdict(),
+        "seed_seconds": seed_time,
+        "results": results,
+    }
+
+    for name, stats in results.items():
+        print(
+            f"{name:45} median {stats['median'] * 1000:9.3f} ms   p95 {stats['p95'] * 1000:9.3f} ms"
+            f"   vm steps {stats['vm_steps']:>12,}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+async def run_load(args: argparse.Namespace) -> int:
+    config: datagen.SyntheticDataConfig = _data_config(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri: str = args.db or f"sqlite:///{os.path.join(tmp, 'load.sqlite')}"
+        db_sessionmaker: sessionmaker = connection.new(uri)
+        data: datagen.SeededData = datagen.seed_database(db_sessionmaker, config)
+
+        if args.workload:
+            with open(args.workload) as f:
+                invocations: List[load.Invocation] = load.load_workload(f)
+        else:
+            mix: Dict[str, int] = {
+                command: int(weight) for command, weight in (pair.split("=") for pair in args.mix.split(","))
+            }
+            invocations: List[load.Invocation] = load.synthetic_workload(data, args.commands, mix, config.seed)
+
+        bot = await load.build_bot(db_sessionmaker, args.page_size, snapshot=args.snapshot)
+        async with bot:
+            results, wall_time, _ = await load.replay(
+                bot, invocations, args.concurrency, send_latency=args.send_latency / 1000
+            )
+
+        db_sessionmaker.kw["bind"].dispose()
+
+    summary: Dict[str, Dict[str, float]] = load.report(results, wall_time)
+    for command, stats in summary.items():
+        print(
+            f"{command:10} n={stats['runs']:<6} p50 {stats['p50'] * 1000:9.3f} ms   p99 {stats['p99'] * 1000:9.3f} ms"
+            f"   {stats['throughput']:8.1f}/s   failures {stats['failures']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": _metadata(),
+                "config": config._asdict(),
+                "concurrency": args.concurrency,
+                "wall_seconds": wall_time,
+                "results": summary,
+            }, f, indent=2)
+
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as f:
+        baseline: Dict[str, typing.Any] = json.load(f)
+    with open(args.candidate) as f:
+        candidate: Dict[str, typing.Any] = json.load(f)
+
+    if baseline["config"] != candidate["config"]:
+        print("warning: results were produced with different data configurations", file=sys.stderr)
+
+    # the timings are in seconds, vm_steps is a count
+    unit: Callable[[float], str] = (
+        (lambda value: f"{value:12,.0f}") if args.stat == "vm_steps" else (lambda value: f"{value * 1000:10.3f}ms")
+    )
+
+    print(f"{'benchmark':45} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for name, stats in candidate["results"].items():
+        new: Optional[float] = stats.get(args.stat)
+        if new is None:
+            continue
+
+        old: Optional[float] = baseline["results"].get(name, {}).get(args.stat)
+        if old is None:
+            print(f"{name:45} {'-':>12} {unit(new)} {'new':>9}")
+            continue
+
+        change: float = (new - old) / old * 100 if old else 0.0
+        print(f"{name:45} {unit(old)} {unit(new)} {change:+8.1f}%")
+
+    return 0
+
+
+def _add_data_arguments(parser: argparse.ArgumentParser) -> None:
+    config: datagen.SyntheticDataConfig = datagen.SyntheticDataConfig()
+
+    parser.add_argument("--db", help="SQLAlchemy URI to seed (defaults to a temporary SQLite file)")
+    parser.add_argument("--guilds", type=int, default=config.guilds)
+    parser.add_argument("--members", type=int, default=config.members)
+    parser.add_argument("--games", type=int, default=config.games)
+    parser.add_argument("--keys", type=int, default=config.keys)
+    parser.add_argument("--expired-ratio", type=float, default=config.expired_ratio)
+    parser.add_argument("--expiring-ratio", type=float, default=config.expiring_ratio)
+    parser.add_argument("--share-ratio", type=float, default=config.share_ratio)
+    parser.add_argument("--seed", type=int, default=config.seed)
+
+
+def _data_config(args: argparse.Namespace) -> datagen.SyntheticDataConfig:
+    return datagen.SyntheticDataConfig(
+        guilds=args.guilds,
+        members=args.members,
+        games=args.games,
+        keys=args.keys,
+        expired_ratio=args.expired_ratio,
+        expiring_ratio=args.expiring_ratio,
+        share_ratio=args.share_ratio,
+        seed=args.seed,
+    )
+
+
+def _metadata() -> Dict[str, typing.Any]:
+    try:
+        commit: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+    }
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1119 @@
+"""
+Offline checks of behaviour the timings can't show: exact output formats and what concurrent callers observe.
+
+Each check raises an AssertionError describing the first mismatch, none needs a Discord connection.
+"""
+
+import asyncio
+import collections
+import datetime
+import difflib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import typing
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from unittest import mock
+
+import discord
+from discord.ext import commands
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, sessionmaker
+
+from benchmarks import datagen, load
+from benchmarks.fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser, SentMessage, build_context
+from discord_key_bot.command.guild import GuildCommands
+from discord_key_bot.command.pagination import PageView
+from discord_key_bot.common import metrics
+from discord_key_bot.common.dispatcher import MessageDispatcher
+from discord_key_bot.common.ratelimit import CommandRateLimiter, RateLimited
+from discord_key_bot.common.util import GameKeyCount
+from discord_key_bot.db import archive, claims, connection, search
+from discord_key_bot.db.changes import ChangeSet, ChangeWatcher
+from discord_key_bot.db.expirations import ExpirationSchedule, ExpiringKey
+from discord_key_bot.db.models import (
+    ArchivedKey, Change, Claim, ClaimDay, ClaimDonor, Game, GamePlatformCount, Guild, Key, Member,
+)
+from discord_key_bot.db.queries import SortOrder
+from discord_key_bot.db.shares import ShareIndex
+
+# identical inventory reads started together by the single flight check
+_CONCURRENT_READS: int = 20
+
+
+def check_metrics_exposition() -> None:
+    """The registry renders the Prometheus text format, and /metrics serves it"""
+
+    registry: metrics.Registry = metrics.Registry()
+    commands: metrics.Counter = registry.counter("test_commands", "Commands run\nby name", ["command"])
+    depth: metrics.Gauge = registry.gauge("test_queue_depth", "Queued messages")
+    latency: metrics.Histogram = registry.histogram("test_latency_seconds", "Latency", ["path"], buckets=[0.1, 1])
+
+    commands.inc(command="browse")
+    commands.inc(2, command='say "hi"\\\n')
+    depth.set(3.5)
+    latency.observe(0.05, path="/a")
+    latency.observe(0.5, path="/a")
+    latency.observe(5, path="/a")
+
+    _expect_text(registry.render(), (
+        '# HELP test_commands Commands run\\nby name\n'
+        '# TYPE test_commands counter\n'
+        'test_commands_total{command="browse"} 1\n'
+        'test_commands_total{command="say \\"hi\\"\\\\\\n"} 2\n'
+        '# HELP test_queue_depth Queued messages\n'
+        '# TYPE test_queue_depth gauge\n'
+        'test_queue_depth 3.5\n'
+        '# HELP test_latency_seconds Latency\n'
+        '# TYPE test_latency_seconds histogram\n'
+        'test_latency_seconds_bucket{path="/a",le="0.1"} 1\n'
+        'test_latency_seconds_bucket{path="/a",le="1"} 2\n'
+        'test_latency_seconds_bucket{path="/a",le="+Inf"} 3\n'
+        'test_latency_seconds_sum{path="/a"} 5.55\n'
+        'test_latency_seconds_count{path="/a"} 3\n'
+    ), "rendered registry")
+
+    async def scrape(path: str) -> str:
+        server: asyncio.AbstractServer = await metrics.serve("127.0.0.1", 0, registry)
+        try:
+            port: int = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            response: bytes = await reader.read()
+            writer.close()
+            return response.decode("utf-8")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    headers, _, body = asyncio.run(scrape("/metrics?format=text")).partition("\r\n\r\n")
+    _expect(headers.split("\r\n")[0], "HTTP/1.1 200 OK", "/metrics status line")
+    _expect("Content-Type: text/plain; version=0.0.4; charset=utf-8" in headers, True, "/metrics content type")
+    _expect(f"Content-Length: {len(body.encode('utf-8'))}" in headers, True, "/metrics content length")
+    _expect_text(body, registry.render(), "/metrics body")
+
+    _expect(asyncio.run(scrape("/other")).split("\r\n")[0], "HTTP/1.1 404 Not Found", "unknown path status line")
+
+
+def check_change_log() -> None:
+    """Two processes sharing one SQLite file see each other's writes, across a prune and a late commit"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri: str = f"sqlite:///{os.path.join(tmp, 'changes.sqlite')}"
+        db_sessionmaker: sessionmaker = connection.new(uri)
+        watcher: ChangeWatcher = ChangeWatcher(db_sessionmaker, 0)
+        watcher.install()
+
+        def game_ids_after(*writer_args: typing.Any) -> Set[int]:
+            _in_other_process(_write_changes, uri, *writer_args)
+            changes: ChangeSet = watcher.poll()
+            return changes.game_ids
+
+        game_id: int = _game_id(db_sessionmaker, "Alpha")
+        _expect(game_ids_after("keys", "Alpha", 5), {game_id}, "games changed by another process")
+
+        with db_sessionmaker() as session:
+            watcher.prune(session, datetime.timedelta(0))
+            session.commit()
+            _expect(session.query(Change).count(), 0, "changes left after pruning everything")
+
+        # the ids of the pruned rows must not be handed out again, they are below the high-water mark
+        game_id = _game_id(db_sessionmaker, "Beta")
+        _expect(game_ids_after("keys", "Beta", 1), {game_id}, "games changed after a prune")
+
+        # an id skipped by one transaction and committed by another after the next poll, as PostgreSQL can
+        mark: int = watcher.high_water_mark
+        _expect(game_ids_after("change", mark + 2, 1001), {1001}, "games changed past a gap")
+        _expect(game_ids_after("change", mark + 1, 1002), {1002}, "games changed by a late commit")
+        _expect(game_ids_after("change", mark + 3, 1003), {1003}, "games changed after a late commit")
+
+        db_sessionmaker.kw["bind"].dispose()
+
+
+def check_single_flight() -> None:
+    """Identical concurrent inventory reads run one statement batch and share its result or exception, but a read
+    asked for after a write doesn't join one started before it"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # a file, an in-memory database keeps the reads on the event loop where nothing can join them
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'single_flight.sqlite')}")
+        data: datagen.SeededData = datagen.seed_database(
+            db_sessionmaker, datagen.SyntheticDataConfig(guilds=1, members=5, games=50, keys=200, share_ratio=1.0)
+        )
+
+        statements: List[str] = []
+        event.listen(
+            db_sessionmaker.kw["bind"], "before_cursor_execute", lambda *args: statements.append(args[2])
+        )
+
+        asyncio.run(_single_flight_reads(db_sessionmaker, data, statements))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _single_flight_reads(
+    db_sessionmaker: sessionmaker, data: datagen.SeededData, statements: List[str]
+) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        cog: GuildCommands = typing.cast(GuildCommands, bot.get_cog("Channel Commands"))
+        guild_id: int = data.guild_ids[0]
+        ctx: commands.Context = build_context(
+            bot, "browse", "", FakeUser(data.member_ids[0], "checks"), FakeChannel(load.BOT_CHANNEL_ID),
+            FakeGuild(guild_id),
+        )
+
+        def reads() -> typing.Awaitable[List[typing.Any]]:
+            return asyncio.gather(
+                *(cog._inventory(ctx, SortOrder.TITLE) for _ in range(_CONCURRENT_READS)), return_exceptions=True
+            )
+
+        statements.clear()
+        await cog._inventory(ctx, SortOrder.TITLE)
+        batch: int = len(statements)
+
+        statements.clear()
+        results: List[typing.Any] = await reads()
+        _expect(len(statements), batch, f"statements run by {_CONCURRENT_READS} identical reads")
+        _expect(all(result is results[0] for result in results), True, "every identical read shares one result")
+
+        failure: RuntimeError = RuntimeError("read failed")
+        with mock.patch.object(search, "get_paginated_games", side_effect=failure) as failing:
+            results = await reads()
+        _expect(failing.call_count, 1, "failing reads run")
+        _expect(all(result is failure for result in results), True, "every identical read shares one exception")
+
+        # the first read holds on to its page until the write has committed and a second read has finished
+        page_read: threading.Event = threading.Event()
+        release: threading.Event = threading.Event()
+        get_paginated_games: Callable[..., List[GameKeyCount]] = search.get_paginated_games
+
+        def held(**kwargs: typing.Any) -> List[GameKeyCount]:
+            games: List[GameKeyCount] = get_paginated_games(**kwargs)
+            if not page_read.is_set():
+                page_read.set()
+                release.wait(timeout=10)
+            return games
+
+        with mock.patch.object(search, "get_paginated_games", side_effect=held):
+            before: asyncio.Task = asyncio.create_task(cog._inventory(ctx, SortOrder.TITLE))
+            await asyncio.to_thread(page_read.wait, 10)
+
+            with db_sessionmaker() as session:
+                game: Game = Game.get(session, "0 Single Flight")
+                session.add(Key(game_id=game.id, key="SINGLE-FLIGHT", platform="steam", creator_id=data.member_ids[0]))
+                session.commit()
+
+            # joining the held read would wait for it, so this times out
+            try:
+                after: Optional[Tuple[List[GameKeyCount], int]] = await asyncio.wait_for(
+                    cog._inventory(ctx, SortOrder.TITLE), timeout=5
+                )
+            except asyncio.TimeoutError:
+                after = None
+            finally:
+                release.set()
+            stale: Tuple[List[GameKeyCount], int] = await before
+
+        _expect(after is not None, True, "a read asked for after the write finished without the read started before")
+        _expect("0 Single Flight" in [game.name for game in stale[0]], False, "the title in a read started before")
+        _expect("0 Single Flight" in [game.name for game in after[0]], True, "the title in a read asked for after")
+
+
+def check_dispatcher() -> None:
+    """Messages to one destination go out back to back, the worker only waits after discord refused one, a retried
+    upload is sent from the start of its file, and the export command's file goes through the dispatcher"""
+
+    asyncio.run(_dispatcher_sends())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'dispatcher.sqlite')}")
+        data: datagen.SeededData = datagen.seed_database(
+            db_sessionmaker, datagen.SyntheticDataConfig(guilds=1, members=3, games=5, keys=10, share_ratio=1.0)
+        )
+        asyncio.run(_export(db_sessionmaker, data))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+class _RefusingChannel(FakeChannel):
+    """Reads every upload, as discord.py does, and refuses the first sends with the given errors"""
+
+    def __init__(self, errors: List[Exception]) -> None:
+        super().__init__(load.BOT_CHANNEL_ID)
+        self.errors: List[Exception] = errors
+        self.uploads: List[bytes] = []
+
+    async def send(
+        self, content: Optional[str] = None, *, embed: typing.Any = None, file: typing.Any = None, **kwargs
+    ) -> FakeMessage:
+        if file is not None:
+            self.uploads.append(file.fp.read())
+        if self.errors:
+            raise self.errors.pop(0)
+
+        return await super().send(content, embed=embed, file=file, **kwargs)
+
+
+async def _dispatcher_sends() -> None:
+    delays: List[float] = []
+
+    async def sleep(delay: float) -> None:
+        delays.append(delay)
+
+    dispatcher: MessageDispatcher = MessageDispatcher(queue_size=10, announcement_window=0, retry_delay=1.0)
+    with mock.patch.object(asyncio, "sleep", sleep):
+        channel: _RefusingChannel = _RefusingChannel([])
+        deliveries: List[asyncio.Future] = [await dispatcher.send_to_channel(channel, text) for text in "abc"]
+        await asyncio.gather(*deliveries)
+        _expect([message.content for message in channel.outbox], ["a", "b", "c"], "messages sent")
+        _expect(delays, [], "waits between accepted messages")
+
+        channel = _RefusingChannel([
+            discord.HTTPException(mock.Mock(status=500, reason="Internal Server Error"), "try again"),
+            discord.RateLimited(2.5),
+        ])
+        upload: discord.File = discord.File(io.BytesIO(b"Title,Platform,Count\r\n"), filename="export.csv")
+        delivery: asyncio.Future = await dispatcher.send_to_channel(channel, "export", file=upload)
+        _expect(await delivery is not None, True, "upload delivered on the third attempt")
+        _expect(channel.uploads, [b"Title,Platform,Count\r\n"] * 3, "file read by each attempt")
+        _expect(delays, [1.0, 2.5], "waits after a server error and after a rate limit")
+
+
+async def _export(db_sessionmaker: sessionmaker, data: datagen.SeededData) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        outbox: List[SentMessage] = []
+        channel: FakeChannel = FakeChannel(load.BOT_CHANNEL_ID, outbox=outbox)
+        ctx: commands.Context = build_context(
+            bot, "export", "", FakeUser(data.member_ids[0], "checks"), channel, FakeGuild(data.guild_ids[0])
+        )
+        with mock.patch.object(type(ctx), "send", side_effect=AssertionError("sent around the dispatcher")):
+            await bot.invoke(ctx)
+        _expect(ctx.command_failed, False, "export failed")
+
+        # the dispatcher's worker sends it after the command returns
+        for _ in range(100):
+            if outbox:
+                break
+            await asyncio.sleep(0)
+        _expect([message.file.filename for message in outbox], ["key_count_export.csv"], "files sent by export")
+
+
+def check_claim_outbox() -> None:
+    """!claim returns with the key reserved. The outbox completes a delivered claim even when completing fails at first,
+    releases an undelivered key and gives the cooldown back, and its sweep only releases abandoned reservations"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'outbox.sqlite')}")
+        with db_sessionmaker() as session:
+            Member.get(session, 100, "donor")
+            session.add(Guild(guild_id=1, member_id=100))
+            for title in ("Alpha", "Beta", "Gamma", "Delta"):
+                game: Game = Game.get(session, title)
+                session.add(Key(game_id=game.id, key=f"{title.upper()}-KEY", platform="steam", creator_id=100))
+            session.commit()
+
+        # the refused delivery and the failed completion are logged with their tracebacks, as they should be
+        logging.disable(logging.CRITICAL)
+        try:
+            asyncio.run(_claim_deliveries(db_sessionmaker))
+        finally:
+            logging.disable(logging.NOTSET)
+        db_sessionmaker.kw["bind"].dispose()
+
+
+class _Claimant(FakeUser):
+    """A member whose direct messages wait for the gate, and are refused if `refuse` is set"""
+
+    def __init__(self, id: int, outbox: List[SentMessage], refuse: bool = False) -> None:
+        super().__init__(id, f"claimant{id}", outbox=outbox)
+        self.refuse: bool = refuse
+        self.gate: asyncio.Event = asyncio.Event()
+        self.gate.set()
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await self.gate.wait()
+        if self.refuse:
+            raise discord.Forbidden(mock.Mock(status=403, reason="Forbidden"), "Cannot send messages to this user")
+
+        return await super().send(content, **kwargs)
+
+
+async def _claim_deliveries(db_sessionmaker: sessionmaker) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        bot.claim_outbox.retry_delay = 0
+        outbox: List[SentMessage] = []
+        channel: FakeChannel = FakeChannel(load.BOT_CHANNEL_ID, outbox=outbox)
+
+        async def claim(claimant: _Claimant, title: str) -> None:
+            ctx: commands.Context = build_context(bot, "claim", f"steam {title}", claimant, channel, FakeGuild(1))
+            await bot.invoke(ctx)
+            _expect(ctx.command_failed, False, f"claim of {title} failed")
+
+        def key(title: str) -> Optional[Tuple[Optional[int], Optional[datetime.datetime]]]:
+            with db_sessionmaker() as session:
+                row = session.query(Key.reserved_by, Key.reserved_at).filter(Key.key == f"{title.upper()}-KEY").first()
+                return tuple(row) if row else None
+
+        def reserve_since(title: str, minutes: int, member_id: Optional[int] = None) -> None:
+            with db_sessionmaker() as session:
+                session.execute(
+                    text(
+                        "UPDATE keys SET reserved_by = COALESCE(:member_id, reserved_by), reserved_at = :at "
+                        "WHERE key = :key"
+                    ),
+                    {
+                        "member_id": member_id,
+                        "at": datetime.datetime.now(datetime.UTC) - datetime.timedelta(minutes=minutes),
+                        "key": f"{title.upper()}-KEY",
+                    },
+                )
+                session.commit()
+
+        def sent(claimant: _Claimant) -> List[str]:
+            return [message.embed.fields[0].name for message in claimant.outbox if message.embed]
+
+        async def channel_texts() -> List[str]:
+            for _ in range(100):
+                if not bot.message_dispatcher.stats().queued:
+                    break
+                await asyncio.sleep(0)
+            texts: List[str] = [message.embed.description for message in outbox]
+            outbox.clear()
+            return texts
+
+        # delivered while its reservation is old enough to be swept
+        first: _Claimant = _Claimant(1, [])
+        first.gate.clear()
+        await claim(first, "Alpha")
+        _expect(key("Alpha")[0], 1, "Alpha reserved for the claimant when !claim returns")
+        _expect(bot.claim_outbox.pending, 1, "deliveries pending when !claim returns")
+
+        reserve_since("Alpha", 10)
+        _expect(bot.claim_outbox.release_stale(), 0, "reservations released while Alpha is being delivered")
+        reserved_at: datetime.datetime = key("Alpha")[1]
+        _expect(
+            datetime.datetime.now() - reserved_at < datetime.timedelta(minutes=1), True, "Alpha's reservation renewed"
+        )
+
+        first.gate.set()
+        await bot.claim_outbox.join()
+        _expect(key("Alpha"), None, "Alpha's key after its delivery")
+        _expect(sent(first), ["Alpha"], "keys sent to the first claimant")
+        _expect(
+            await channel_texts(), ['"Alpha" claimed by claimant1. Check your PMs for more info. Enjoy!'], "replies"
+        )
+
+        # refused direct messages
+        second: _Claimant = _Claimant(2, [], refuse=True)
+        await claim(second, "Beta")
+        await bot.claim_outbox.join()
+        _expect(key("Beta"), (None, None), "Beta's reservation after a refused delivery")
+        with db_sessionmaker() as session:
+            _expect(session.get(Member, 2).last_claim, None, "cooldown of the claimant who got nothing")
+        _expect(
+            await channel_texts(),
+            ["I couldn't send you a direct message, claimant2. Check your privacy settings and try again."],
+            "replies",
+        )
+
+        # completing fails once after the key was sent
+        complete_claim: Callable[..., None] = claims.complete_claim
+        failures: List[Exception] = [RuntimeError("database is locked")]
+
+        def flaky_complete_claim(*args: typing.Any) -> None:
+            if failures:
+                raise failures.pop()
+            complete_claim(*args)
+
+        third: _Claimant = _Claimant(3, [])
+        with mock.patch.object(claims, "complete_claim", side_effect=flaky_complete_claim), \
+                mock.patch.object(claims, "release_key", wraps=claims.release_key) as release_key:
+            await claim(third, "Gamma")
+            await bot.claim_outbox.join()
+        _expect(release_key.call_count, 0, "keys released after a delivered claim failed to complete")
+        _expect(key("Gamma"), None, "Gamma's key after completing was retried")
+        with db_sessionmaker() as session:
+            _expect(
+                [(claim.member_id, claim.game_name) for claim in session.query(Claim).order_by(Claim.id)],
+                [(1, "Alpha"), (3, "Gamma")],
+                "claims in the ledger",
+            )
+
+        # left reserved by a process that stopped before delivering
+        reserve_since("Delta", 10, member_id=999)
+        _expect(bot.claim_outbox.release_stale(), 1, "abandoned reservations released")
+        _expect(key("Delta"), (None, None), "Delta's reservation after the sweep")
+
+
+def check_title_completion() -> None:
+    """Autocomplete offers the titles claimable on the guild that start with what was typed, in search name order, and
+    follows keys being added and removed and members no longer sharing"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'titles.sqlite')}")
+        _share(db_sessionmaker, {100: [1], 200: [2]})
+        _add_keys(db_sessionmaker, 100, ["Portal", "Portal 2", "Half-Life", "Hades"])
+        _add_keys(db_sessionmaker, 100, ["Pony Island"], expiration=datetime.datetime(2000, 1, 1))
+        _add_keys(db_sessionmaker, 100, ["Inside"], reserved_by=300, reserved_at=datetime.datetime.now(datetime.UTC))
+        _add_keys(db_sessionmaker, 200, ["Portal Knights"])
+
+        asyncio.run(_title_completions(db_sessionmaker))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _title_completions(db_sessionmaker: sessionmaker) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        cog: GuildCommands = typing.cast(GuildCommands, bot.get_cog("Channel Commands"))
+
+        async def complete(guild_id: int, current: str) -> List[str]:
+            choices: List[discord.app_commands.Choice[str]] = await cog.complete_game_name(
+                mock.Mock(guild_id=guild_id), current
+            )
+            return [choice.value for choice in choices]
+
+        _expect(await complete(1, ""), ["Hades", "Half-Life", "Portal", "Portal 2"], "titles claimable on guild 1")
+        _expect(await complete(1, "POR"), ["Portal", "Portal 2"], "guild 1 titles starting with POR")
+        _expect(await complete(1, "portal "), ["Portal 2"], "guild 1 titles starting with 'portal '")
+        _expect(await complete(1, "half life"), ["Half-Life"], "guild 1 titles starting with 'half life'")
+        _expect(await complete(1, "pony"), [], "guild 1 titles starting with pony, whose only key expired")
+        _expect(await complete(2, "por"), ["Portal Knights"], "guild 2 titles starting with por")
+        _expect(bot.title_index.for_member(100).complete("p"), ["Pony Island", "Portal", "Portal 2"], "donor's titles")
+
+        # the index is patched as the writes commit
+        _add_keys(db_sessionmaker, 100, ["Portal Stories: Mel"])
+        _expect(
+            await complete(1, "portal"), ["Portal", "Portal 2", "Portal Stories: Mel"], "guild 1 titles after an add"
+        )
+
+        with db_sessionmaker() as session:
+            session.delete(session.query(Key).join(Game).filter(Game.pretty_name == "Hades").one())
+            session.commit()
+        _expect(await complete(1, "ha"), ["Half-Life"], "guild 1 titles after a key was removed")
+
+        _share(db_sessionmaker, {200: [1]})
+        with db_sessionmaker() as session:
+            session.query(Guild).filter(Guild.member_id == 100).delete()
+            session.commit()
+        _expect(await complete(1, "por"), ["Portal Knights"], "guild 1 titles once only the other donor shares")
+
+
+def check_spelling_suggestions() -> None:
+    """A game name matching no title is answered with the nearest titles the member could have meant, only ever ones
+    they can see, and the suggestions follow games being added and deleted"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'spelling.sqlite')}")
+        _share(db_sessionmaker, {100: [1], 200: [2]})
+        _add_keys(db_sessionmaker, 100, ["Portal", "Portal 2", "Half-Life", "Half-Life 2", "The Witcher 3: Wild Hunt"])
+        _add_keys(db_sessionmaker, 200, ["Hollow Knight"])
+
+        asyncio.run(_spelling_suggestions(db_sessionmaker))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _spelling_suggestions(db_sessionmaker: sessionmaker) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        async def claim(guild_id: int, game_name: str) -> List[str]:
+            return await _replies(bot, "claim", f"steam {game_name}", 100, guild_id)
+
+        _expect(
+            await claim(1, "portal 3"), ['Game not found. Did you mean "Portal 2" or "Portal"?'], "claiming portal 3"
+        )
+        _expect(
+            await _replies(bot, "search", "hlaf-life", 100, 1),
+            ['No matching games found. Did you mean "Half-Life"?'],
+            "searching for hlaf-life",
+        )
+        _expect(
+            await claim(1, "teh witcher 3 wild hnut"),
+            ['Game not found. Did you mean "The Witcher 3: Wild Hunt"?'],
+            "claiming teh witcher 3 wild hnut",
+        )
+        _expect(await claim(1, "hollow night"), ["Game not found"], "claiming a title only shared on another guild")
+        _expect(
+            await claim(2, "hollow night"), ['Game not found. Did you mean "Hollow Knight"?'], "claiming hollow night"
+        )
+        _expect(await claim(1, "zelda"), ["Game not found"], "claiming a title nothing is close to")
+        _expect(
+            await _replies(bot, "remove", "steam portl", 100),
+            ['Game not found. Did you mean "Portal"?'],
+            "removing one of the donor's own keys by a misspelt title",
+        )
+
+        # the spelling index is patched as the writes commit
+        _add_keys(db_sessionmaker, 100, ["Portal 3"])
+        _expect(
+            await claim(1, "portal 4"),
+            ['Game not found. Did you mean "Portal 2" or "Portal 3" or "Portal"?'],
+            "claiming portal 4 after Portal 3 was added",
+        )
+
+        with db_sessionmaker() as session:
+            game: Game = session.query(Game).filter(Game.pretty_name == "Portal 2").one()
+            for key in game.keys:
+                session.delete(key)
+            session.flush()
+            session.delete(game)
+            session.commit()
+        _expect(
+            await claim(1, "portal 4"),
+            ['Game not found. Did you mean "Portal 3" or "Portal"?'],
+            "claiming portal 4 after Portal 2 was deleted",
+        )
+
+
+def check_page_windows() -> None:
+    """Paging buttons show the right games on every page, and only fetch when leaving the window of pages held"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'pages.sqlite')}")
+        _share(db_sessionmaker, {100: [1]})
+        _add_keys(db_sessionmaker, 100, [f"Game {i:02d}" for i in range(1, 24)])
+
+        asyncio.run(_page_windows(db_sessionmaker))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _page_windows(db_sessionmaker: sessionmaker) -> None:
+    # 23 games, 2 a page, 12 pages in windows of 5
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=2)
+    async with bot:
+        cog: GuildCommands = typing.cast(GuildCommands, bot.get_cog("Channel Commands"))
+        ctx: commands.Context = build_context(
+            bot, "browse", "", FakeUser(100, "checks"), FakeChannel(load.BOT_CHANNEL_ID), FakeGuild(1)
+        )
+        rendered: List[Tuple[int, int, List[str]]] = []
+
+        def render(page: int, total: int, games: List[GameKeyCount]) -> discord.Embed:
+            rendered.append((page, total, [game.name for game in games]))
+            return discord.Embed()
+
+        view: PageView = cog._page_view(ctx, render, sort=SortOrder.TITLE)
+        with mock.patch.object(search, "get_paginated_games", wraps=search.get_paginated_games) as fetch:
+            for page in (1, 2, 5, 6, 10, 0, 12, 11):
+                await view.show(page)
+                rendered[-1] += (view.previous_page.disabled, view.next_page.disabled)
+
+        _expect(rendered, [
+            (1, 23, ["Game 01", "Game 02"], True, False),
+            (2, 23, ["Game 03", "Game 04"], False, False),
+            (5, 23, ["Game 09", "Game 10"], False, False),
+            (6, 23, ["Game 11", "Game 12"], False, False),
+            (10, 23, ["Game 19", "Game 20"], False, False),
+            (1, 23, ["Game 01", "Game 02"], True, False),
+            (12, 23, ["Game 23"], False, True),
+            (11, 23, ["Game 21", "Game 22"], False, False),
+        ], "pages shown, with whether the previous and next buttons are disabled")
+        _expect(
+            [(call.kwargs["page"], call.kwargs["per_page"]) for call in fetch.call_args_list],
+            [(1, 10), (2, 10), (1, 10), (3, 10)],
+            "windows fetched",
+        )
+
+
+def check_rate_limiter() -> None:
+    """Each member's bucket per cog holds `capacity` tokens refilled over time, a command is turned away while its cost
+    can't be covered and only the first refusal of a run is answered, and the bot charges each command once"""
+
+    now: List[float] = [0.0]
+    limiter: CommandRateLimiter = CommandRateLimiter(
+        capacity=3, refill_rate=0.5, costs={"random": 2, "export": 5}, clock=lambda: now[0]
+    )
+
+    def acquire(member_id: int, cog: str, command: str) -> Optional[Tuple[float, bool]]:
+        try:
+            limiter.acquire(member_id, cog, command)
+        except RateLimited as e:
+            return e.retry_after, e.notify
+        return None
+
+    outcomes: List[Optional[Tuple[float, bool]]] = [acquire(1, "Channel Commands", "browse") for _ in range(5)]
+    outcomes.append(acquire(1, "Direct Message Commands", "browse"))
+    outcomes.append(acquire(2, "Channel Commands", "browse"))
+    now[0] += 1
+    outcomes.append(acquire(1, "Channel Commands", "browse"))
+    now[0] += 1
+    outcomes += [acquire(1, "Channel Commands", "browse"), acquire(1, "Channel Commands", "random")]
+    now[0] += 6
+    outcomes += [acquire(1, "Channel Commands", "export"), acquire(1, "Channel Commands", "browse")]
+    _expect(outcomes, [
+        None, None, None, (2.0, True), (2.0, False),
+        # other cogs and members have buckets of their own
+        None, None,
+        # half a token back, not enough yet, and the run hasn't ended
+        (1.0, False),
+        None, (4.0, True),
+        # a cost above the capacity takes the whole bucket
+        None, (2.0, True),
+    ], "refusals, as (retry after, answered), of a sequence of commands")
+
+    now[0] += 61
+    _expect(limiter.acquire(3, "Channel Commands", "browse"), None, "a command after a minute")
+    _expect(sorted(limiter.buckets), [(3, "Channel Commands")], "buckets kept after the full ones were pruned")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'rate_limit.sqlite')}")
+        asyncio.run(_rate_limited_commands(db_sessionmaker))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _rate_limited_commands(db_sessionmaker: sessionmaker) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10, rate_limit_capacity=2)
+    async with bot:
+        refusal: str = "You're sending commands too quickly, please wait a moment before trying again."
+        platforms: str = "Showing valid platforms and example key formats"
+
+        _expect(
+            [await _replies(bot, "platforms", "", 100, 1) for _ in range(4)],
+            [[platforms], [platforms], [refusal], []],
+            "replies to a member's commands past the capacity",
+        )
+        _expect(await _replies(bot, "platforms", "", 200, 1), [platforms], "reply to another member")
+
+        # the help command runs every command's checks to list them, they mustn't be charged. It mentions the bot user,
+        # which only exists once logged in
+        with mock.patch.object(type(bot), "user", new_callable=mock.PropertyMock, return_value=FakeUser(1, "keybot")):
+            help_replies: List[List[str]] = [await _replies(bot, "help", "", 300) for _ in range(3)]
+        _expect(
+            [replies == [refusal] for replies in help_replies], [False, False, True], "help commands refused"
+        )
+
+        # a command outside the bot channel is ignored without costing anything
+        outside: FakeChannel = FakeChannel(load.BOT_CHANNEL_ID + 1)
+        for _ in range(3):
+            await bot.invoke(build_context(bot, "platforms", "", FakeUser(400, "member400"), outside, FakeGuild(1)))
+        _expect(await _replies(bot, "platforms", "", 400, 1), [platforms], "reply after commands in another channel")
+
+
+def check_expiration_schedule() -> None:
+    """Keys are announced once per guild, game and platform when they enter the waiver period, in the order they do,
+    and the schedule follows expirations being set and moved, but not reservations"""
+
+    now: datetime.datetime = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'expirations.sqlite')}")
+        _share(db_sessionmaker, {100: [1, 2], 102: [1], 200: [3]})
+        _add_keys(db_sessionmaker, 100, ["Alpha"], expiration=now + datetime.timedelta(days=10))
+        _add_keys(db_sessionmaker, 102, ["Alpha"], expiration=now + datetime.timedelta(days=10.01))
+        _add_keys(db_sessionmaker, 100, ["Beta"], expiration=now + datetime.timedelta(days=20))
+        _add_keys(db_sessionmaker, 100, ["Zeta"], expiration=now + datetime.timedelta(days=30))
+        # already inside the waiver period, announced before the restart
+        _add_keys(db_sessionmaker, 100, ["Gamma"], expiration=now + datetime.timedelta(days=3))
+        _add_keys(db_sessionmaker, 100, ["Delta"])
+        _add_keys(db_sessionmaker, 200, ["Epsilon"], expiration=now + datetime.timedelta(days=10.1))
+        # shares with no guild, nowhere to announce its keys
+        _add_keys(db_sessionmaker, 101, ["Eta"], expiration=now + datetime.timedelta(days=10))
+
+        asyncio.run(_expiration_announcements(db_sessionmaker, now))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _expiration_announcements(db_sessionmaker: sessionmaker, now: datetime.datetime) -> None:
+    def days(count: float) -> datetime.datetime:
+        return now + datetime.timedelta(days=count)
+
+    announced: List[Tuple[int, str]] = []
+
+    async def announce(guild_id: int, key: ExpiringKey) -> None:
+        announced.append((guild_id, key.title))
+
+    async def fire(at: datetime.datetime) -> List[Tuple[int, str]]:
+        announced.clear()
+        count: int = await schedule.fire(at)
+        _expect(count, len(announced), "announcements counted")
+        return sorted(announced)
+
+    def update_key(title: str, **values: typing.Any) -> None:
+        with db_sessionmaker() as session:
+            key: Key = session.query(Key).join(Game).filter(Game.pretty_name == title).one()
+            for name, value in values.items():
+                setattr(key, name, value)
+            session.commit()
+
+    share_index: ShareIndex = ShareIndex(db_sessionmaker)
+    share_index.load()
+    schedule: ExpirationSchedule = ExpirationSchedule(
+        db_sessionmaker, share_index, datetime.timedelta(days=7), announce
+    )
+    schedule.load()
+    watcher: ChangeWatcher = ChangeWatcher(db_sessionmaker, 0)
+    watcher.install()
+    watcher.register(share_index.on_changes)
+    watcher.register(schedule.on_changes)
+
+    _expect(schedule.next_due(), days(3), "first key entering the waiver period")
+    _expect(await fire(days(3) - datetime.timedelta(minutes=1)), [], "announced just before")
+    _expect(
+        await fire(days(3.2)), [(1, "Alpha"), (2, "Alpha"), (3, "Epsilon")], "announced once Alpha and Epsilon are due"
+    )
+    _expect(schedule.next_due(), days(13), "next key entering the waiver period")
+
+    # moved closer, the old entry is skipped
+    update_key("Beta", expiration=days(9))
+    _expect(schedule.next_due(), days(2), "Beta entering the waiver period after it was moved")
+    _expect(await fire(days(2.1)), [(1, "Beta"), (2, "Beta")], "announced once Beta is due")
+    _expect(await fire(days(13.1)), [], "announced at Beta's old due time")
+
+    # set inside the waiver period, announced straight away
+    update_key("Delta", expiration=days(1))
+    _expect(await fire(days(0.001)), [(1, "Delta"), (2, "Delta")], "announced once Delta got an expiration")
+
+    # a key being delivered isn't announced, and releasing it doesn't schedule it again
+    with db_sessionmaker() as session:
+        zeta: Key = session.query(Key).join(Game).filter(Game.pretty_name == "Zeta").one()
+        zeta_id: int = zeta.id
+        _expect(claims.reserve_key(session, zeta, session.get(Member, 200)), True, "Zeta reserved")
+        session.commit()
+    _expect(await fire(days(23.1)), [], "announced once the reserved Zeta is due")
+    with db_sessionmaker() as session:
+        claims.release_key(session, zeta_id)
+        session.commit()
+    _expect(schedule.next_due(), None, "keys left to enter the waiver period")
+
+
+def check_claim_ledger() -> None:
+    """Completed claims are recorded in the ledger with their titles, and the daily and donor rollups count the same
+    claims the ledger holds"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'ledger.sqlite')}")
+        _share(db_sessionmaker, {100: [1], 200: [1, 2], 300: [], 301: []})
+        _add_keys(db_sessionmaker, 100, ["Alpha", "Beta", "Gamma"])
+        _add_keys(db_sessionmaker, 200, ["Delta", "Epsilon", "Zeta"])
+
+        claimed: List[Tuple[str, int, int]] = [
+            ("Alpha", 300, 1), ("Beta", 300, 1), ("Gamma", 301, 1), ("Delta", 301, 1), ("Epsilon", 300, 2),
+            ("Zeta", 301, 2),
+        ]
+        with db_sessionmaker() as session:
+            for title, member_id, guild_id in claimed:
+                key: Key = session.query(Key).join(Game).filter(Game.pretty_name == title).one()
+                claims.reserve_key(session, key, session.get(Member, member_id))
+                claims.complete_claim(session, key.id, guild_id)
+            session.commit()
+
+        today: datetime.date = datetime.datetime.now(datetime.UTC).date()
+        with db_sessionmaker() as session:
+            ledger: List[Claim] = session.query(Claim).order_by(Claim.id).all()
+            _expect(
+                [(claim.game_name, claim.member_id, claim.guild_id) for claim in ledger],
+                claimed,
+                "ledger, whose games were deleted with their last key",
+            )
+            _expect(session.query(Game).count(), 0, "games left")
+
+            _expect(
+                [
+                    claims.guild_stats(session, 1, today + datetime.timedelta(days=days))
+                    for days in (0, 1, 6, 7, 29, 30)
+                ],
+                [(4, 4, 4, 4), (0, 4, 4, 4), (0, 4, 4, 4), (0, 0, 4, 4), (0, 0, 4, 4), (0, 0, 0, 4)],
+                "guild 1 stats today, then 1, 6, 7, 29 and 30 days later",
+            )
+            _expect(claims.guild_stats(session, 2, today), (2, 2, 2, 2), "guild 2 stats")
+            _expect(claims.guild_stats(session, 3, today), (0, 0, 0, 0), "stats of a guild without claims")
+
+            _expect(
+                [claims.donor_claims(session, guild_id, member_id) for guild_id, member_id in
+                 ((1, 100), (1, 200), (2, 100), (2, 200))],
+                [3, 1, 0, 2],
+                "claims of each donor's keys per guild",
+            )
+            _expect(
+                claims.top_donors(session, 1, 10), [(100, "donor100", 3), (200, "donor200", 1)], "guild 1 top donors"
+            )
+
+            # the rollups, counted up one claim at a time, against the ledger
+            _expect(
+                {
+                    (guild_id, day): count for guild_id, day, count in
+                    session.query(ClaimDay.guild_id, ClaimDay.day, ClaimDay.claims)
+                },
+                dict(collections.Counter((claim.guild_id, claim.claimed_at.date()) for claim in ledger)),
+                "daily rollup",
+            )
+            _expect(
+                {
+                    (guild_id, creator_id): count for guild_id, creator_id, count in
+                    session.query(ClaimDonor.guild_id, ClaimDonor.creator_id, ClaimDonor.claims)
+                },
+                dict(collections.Counter((claim.guild_id, claim.creator_id) for claim in ledger)),
+                "donor rollup",
+            )
+
+        asyncio.run(_leaderboard(db_sessionmaker))
+        db_sessionmaker.kw["bind"].dispose()
+
+
+async def _leaderboard(db_sessionmaker: sessionmaker) -> None:
+    bot: commands.Bot = await load.build_bot(db_sessionmaker, page_size=10)
+    async with bot:
+        _expect(
+            await _replies(bot, "leaderboard", "", 300, 1),
+            ["1. donor100: 3 claimed\n2. donor200: 1 claimed"],
+            "guild 1 leaderboard",
+        )
+        _expect(
+            await _replies(bot, "leaderboard", "", 300, 3),
+            ["No keys have been claimed here yet"],
+            "guild 3 leaderboard",
+        )
+
+
+def check_archive_round_trip() -> None:
+    """Archiving moves out old keys and the unshared keys past the grace period, restoring brings them back as they
+    were except for duplicates and expired keys, and the key counters stay in step throughout"""
+
+    now: datetime.datetime = datetime.datetime.now(datetime.UTC)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_sessionmaker: sessionmaker = connection.new(f"sqlite:///{os.path.join(tmp, 'archive.sqlite')}")
+        # 200 stopped sharing, 201 added keys yesterday and hasn't shared yet
+        _share(db_sessionmaker, {100: [1], 200: [], 201: []})
+        _add_keys(db_sessionmaker, 100, ["Portal"])
+        _add_keys(
+            db_sessionmaker, 100, ["Old Shared"],
+            created_at=now - datetime.timedelta(days=400), expiration=datetime.datetime(2100, 1, 1),
+        )
+        _add_keys(
+            db_sessionmaker, 100, ["Old Reserved"],
+            created_at=now - datetime.timedelta(days=400), reserved_by=300, reserved_at=now,
+        )
+        _add_keys(
+            db_sessionmaker, 200, ["Portal", "Unshared", "Expiring"], created_at=now - datetime.timedelta(days=40)
+        )
+        _add_keys(db_sessionmaker, 201, ["Unshared New"], created_at=now - datetime.timedelta(days=1))
+
+        def archive_old_keys() -> Tuple[int, int]:
+            with db_sessionmaker() as session:
+                archived: Tuple[int, int] = archive.archive_keys(
+                    session, now - datetime.timedelta(days=365), now - datetime.timedelta(days=30)
+                )
+                session.commit()
+            return archived
+
+        def restore_archived_keys(creator_id: int = 0) -> Tuple[int, int]:
+            with db_sessionmaker() as session:
+                restored: Tuple[int, int] = archive.restore_keys(session, creator_id)
+                session.commit()
+            return restored
+
+        def live_keys() -> List[Tuple[str, str, int]]:
+            with db_sessionmaker() as session:
+                _expect_counters(session)
+                return sorted(session.query(Game.pretty_name, Key.key, Key.creator_id).join(Key.game).all())
+
+        def archived_keys() -> List[Tuple[str, str, int]]:
+            with db_sessionmaker() as session:
+                return sorted(session.query(ArchivedKey.game_name, ArchivedKey.key, ArchivedKey.creator_id).all())
+
+        before: List[Tuple[str, str, int]] = live_keys()
+        _expect(archive_old_keys(), (3, 4), "games deleted and keys archived")
+        _expect(live_keys(), [
+            ("Old Reserved", "OLD RESERVED-100", 100),
+            ("Portal", "PORTAL-100", 100),
+            ("Unshared New", "UNSHARED NEW-201", 201),
+        ], "keys left")
+        _expect(archived_keys(), [
+            ("Expiring", "EXPIRING-200", 200),
+            ("Old Shared", "OLD SHARED-100", 100),
+            ("Portal", "PORTAL-200", 200),
+            ("Unshared", "UNSHARED-200", 200),
+        ], "keys archived")
+        with db_sessionmaker() as session:
+            _expect(
+                session.query(ArchivedKey.expiration).filter(ArchivedKey.key == "OLD SHARED-100").scalar(),
+                datetime.datetime(2100, 1, 1),
+                "expiration of an archived key",
+            )
+            _expect(session.query(Game).count(), 3, "games left")
+
+        # while archived, one key expires and another is added again by someone else
+        with db_sessionmaker() as session:
+            session.query(ArchivedKey).filter(ArchivedKey.key == "EXPIRING-200").update(
+                {ArchivedKey.expiration: datetime.datetime(2000, 1, 1)}
+            )
+            game: Game = Game.get(session, "Unshared")
+            session.add(Key(game_id=game.id, key="UNSHARED-200", platform="steam", creator_id=201))
+            session.commit()
+
+        _expect(restore_archived_keys(200), (1, 2), "200's keys restored and left in the archive")
+        _expect(restore_archived_keys(), (1, 2), "every key restored and left in the archive")
+        _expect(
+            archived_keys(),
+            [("Expiring", "EXPIRING-200", 200), ("Unshared", "UNSHARED-200", 200)],
+            "keys still archived",
+        )
+        _expect(
+            live_keys(),
+            sorted(
+                [key for key in before if key[1] not in ("EXPIRING-200", "UNSHARED-200")]
+                + [("Unshared", "UNSHARED-200", 201)]
+            ),
+            "keys after restoring",
+        )
+        with db_sessionmaker() as session:
+            _expect(
+                session.query(Key.expiration).filter(Key.key == "OLD SHARED-100").scalar(),
+                datetime.datetime(2100, 1, 1),
+                "expiration of a restored key",
+            )
+
+        # restored keys are dated to the restore
+        _expect(archive_old_keys(), (0, 0), "games deleted and keys archived again straight after restoring")
+        db_sessionmaker.kw["bind"].dispose()
+
+
+CHECKS: Dict[str, Callable[[], None]] = {
+    "metrics": check_metrics_exposition,
+    "changes": check_change_log,
+    "single_flight": check_single_flight,
+    "dispatcher": check_dispatcher,
+    "claim_outbox": check_claim_outbox,
+    "titles": check_title_completion,
+    "spelling": check_spelling_suggestions,
+    "pagination": check_page_windows,
+    "rate_limiter": check_rate_limiter,
+    "expirations": check_expiration_schedule,
+    "claim_ledger": check_claim_ledger,
+    "archive": check_archive_round_trip,
+}
+
+
+def run_checks(names: List[str]) -> List[str]:
+    """Run the named checks, or every check, and return the names of the ones that failed"""
+
+    failed: List[str] = []
+    for name in names or CHECKS:
+        try:
+            CHECKS[name]()
+        except AssertionError as e:
+            print(f"{name:20} FAILED\n{e}")
+            failed.append(name)
+        else:
+            print(f"{name:20} ok")
+
+    return failed
+
+
+def _in_other_process(target: Callable[..., None], *args: typing.Any) -> None:
+    process = multiprocessing.get_context("spawn").Process(target=target, args=args)
+    process.start()
+    process.join()
+    _expect(process.exitcode, 0, f"exit code of {target.__name__}{args}")
+
+
+def _write_changes(uri: str, kind: str, *args: typing.Any) -> None:
+    db_sessionmaker: sessionmaker = connection.new(uri)
+    ChangeWatcher(db_sessionmaker, 0).install()
+
+    with db_sessionmaker() as session:
+        if kind == "keys":
+            game_name, count = args
+            game: Game = Game.get(session, game_name)
+            member: Member = Member.get(session, 1, "checks")
+            for i in range(count):
+                session.add(Key(game_id=game.id, key=f"{game_name}-{i}", platform="steam", creator_id=member.id))
+        else:
+            change_id, game_id = args
+            session.execute(
+                text("INSERT INTO changes (id, kind, game_id, created_at) VALUES (:id, 'game', :game_id, :created_at)"),
+                {"id": change_id, "game_id": game_id, "created_at": datetime.datetime.now(datetime.UTC)},
+            )
+        session.commit()
+
+    db_sessionmaker.kw["bind"].dispose()
+
+
+def _game_id(db_sessionmaker: sessionmaker, game_name: str) -> int:
+    # created up front, so the other process's writes are keys only
+    with db_sessionmaker() as session:
+        game_id: int = Game.get(session, game_name).id
+        session.commit()
+
+    return game_id
+
+
+def _share(db_sessionmaker: sessionmaker, guild_ids: Dict[int, List[int]]) -> None:
+    """Make each member share with its guilds"""
+
+    with db_sessionmaker() as session:
+        for member_id, member_guild_ids in guild_ids.items():
+            Member.get(session, member_id, f"donor{member_id}")
+            for guild_id in member_guild_ids:
+                session.add(Guild(guild_id=guild_id, member_id=member_id))
+        session.commit()
+
+
+def _add_keys(db_sessionmaker: sessionmaker, creator_id: int, titles: List[str], **columns: typing.Any) -> None:
+    """Add a steam key of each title by `creator_id`, its key made from the title"""
+
+    with db_sessionmaker() as session:
+        for title in titles:
+            game: Game = Game.get(session, title)
+            session.add(Key(
+                game_id=game.id, key=f"{title.upper()}-{creator_id}", platform="steam", creator_id=creator_id, **columns
+            ))
+        session.commit()
+
+
+async def _replies(
+    bot: commands.Bot, command: str, args: str, author_id: int, guild_id: Optional[int] = None
+) -> List[str]:
+    """The text of every message the command sends, in the bot channel when `guild_id` is given, else in a direct
+    message"""
+
+    outbox: List[SentMessage] = []
+    author: FakeUser = FakeUser(author_id, f"member{author_id}", outbox=outbox)
+    guild: Optional[FakeGuild] = FakeGuild(guild_id) if guild_id else None
+    ctx: commands.Context = build_context(
+        bot, command, args, author, FakeChannel(load.BOT_CHANNEL_ID, outbox=outbox) if guild else author, guild
+    )
+    await bot.invoke(ctx)
+
+    # replies go through the dispatcher, whose workers send them after the command returns
+    for _ in range(100):
+        await asyncio.sleep(0)
+
+    return [message.embed.description if message.embed else message.content for message in outbox]
+
+
+def _expect_counters(session: Session) -> None:
+    """The key counters of every game and platform match the keys"""
+
+    keys: typing.Counter[Tuple[int, str]] = collections.Counter(session.query(Key.game_id, Key.platform).all())
+    _expect(
+        {
+            (game_id, platform): count for game_id, platform, count in
+            session.query(GamePlatformCount.game_id, GamePlatformCount.platform, GamePlatformCount.key_count)
+            if count
+        },
+        dict(keys),
+        "key counts per game and platform",
+    )
+    _expect(
+        {game_id: count for game_id, count in session.query(Game.id, Game.key_count) if count},
+        dict(collections.Counter(game_id for game_id, _ in keys.elements())),
+        "key counts per game",
+    )
+
+
+def _expect(actual: typing.Any, expected: typing.Any, what: str) -> None:
+    if actual != expected:
+        raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+
+def _expect_text(actual: str, expected: str, what: str) -> None:
+    if actual != expected:
+        diff: str = "".join(difflib.unified_diff(
+            expected.splitlines(keepends=True), actual.splitlines(keepends=True), "expected", "actual"
+        ))
+        raise AssertionError(f"{what} differs:\n{diff}")
@@ -0,0 +1,109 @@
+"""
+Synthetic data generator for seeding a benchmark database through the ORM models.
+"""
+
+import datetime
+import random
+import typing
+from typing import Dict, List, Set
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.db.models import Game, Guild, Key, Member
+from discord_key_bot.platform import Platform, all_platforms
+
+_ADJECTIVES: List[str] = [
+    "Ancient", "Broken", "Crimson", "Dark", "Eternal", "Forgotten", "Galactic", "Hidden", "Iron", "Jade",
+    "Lost", "Mighty", "Neon", "Obsidian", "Pixel", "Quantum", "Rogue", "Silent", "Twisted", "Ultimate",
+]
+_NOUNS: List[str] = [
+    "Legends", "Empire", "Frontier", "Odyssey", "Dungeon", "Kingdom", "Protocol", "Horizon", "Tactics", "Outpost",
+    "Chronicles", "Warfare", "Drift", "Arena", "Saga", "Harvest", "Voyage", "Siege", "Signal", "Station",
+]
+_ARTICLES: List[str] = ["", "", "", "The ", "A "]
+
+_BATCH_SIZE: int = 5000
+
+
+class SyntheticDataConfig(typing.NamedTuple):
+    guilds: int = 5
+    members: int = 200
+    games: int = 2000
+    keys: int = 10000
+    expired_ratio: float = 0.05
+    expiring_ratio: float = 0.15
+    share_ratio: float = 0.5
+    seed: int = 1
+
+
+class SeededData(typing.NamedTuple):
+    guild_ids: List[int]
+    member_ids: List[int]
+    game_names: List[str]
+    keys: List[str]
+    # what the bot's share index holds for these guilds
+    guild_members: Dict[int, Set[int]]
+
+
+def game_title(index: int, rng: random.Random) -> str:
+    return f"{rng.choice(_ARTICLES)}{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {index}"
+
+
+def seed_database(db_sessionmaker: sessionmaker, config: SyntheticDataConfig) -> SeededData:
+    rng: random.Random = random.Random(config.seed)
+    platforms: List[Platform] = list(all_platforms())
+    now: datetime.datetime = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+
+    guild_ids: List[int] = [1000 + i for i in range(config.guilds)]
+    member_ids: List[int] = [10_000 + i for i in range(config.members)]
+    game_names: List[str] = [game_title(i, rng) for i in range(config.games)]
+    keys: List[str] = []
+    guild_members: Dict[int, Set[int]] = {guild_id: set() for guild_id in guild_ids}
+
+    with db_sessionmaker() as session:
+        for member_id in member_ids:
+            member: Member = Member(id=member_id, name=f"member{member_id}", is_admin=False)
+            session.add(member)
+            for guild_id in guild_ids:
+                if rng.random() < config.share_ratio:
+                    session.add(Guild(guild_id=guild_id, member_id=member_id))
+                    guild_members[guild_id].add(member_id)
+        session.flush()
+
+        games: List[Game] = [Game.get(session, name) for name in game_names]
+        session.flush()
+        game_ids: List[int] = [game.id for game in games]
+
+        for i in range(config.keys):
+            platform: Platform = rng.choice(platforms)
+            key: str = f"BENCH{i:020d}"
+            keys.append(key)
+
+            session.add(Key(
+                game_id=rng.choice(game_ids),
+                key=key,
+                platform=platform.search_name,
+                creator_id=rng.choice(member_ids),
+                expiration=_expiration(rng, config, now),
+            ))
+
+            if i % _BATCH_SIZE == 0:
+                session.flush()
+
+        session.commit()
+
+    return SeededData(
+        guild_ids=guild_ids, member_ids=member_ids, game_names=game_names, keys=keys, guild_members=guild_members
+    )
+
+
+def _expiration(
+    rng: random.Random, config: SyntheticDataConfig, now: datetime.datetime
+) -> typing.Optional[datetime.datetime]:
+    roll: float = rng.random()
+    if roll < config.expired_ratio:
+        return now - datetime.timedelta(days=rng.randint(1, 365))
+    if roll < config.expired_ratio + config.expiring_ratio:
+        return now + datetime.timedelta(days=rng.randint(1, 90))
+
+    return None
@@ -0,0 +1,117 @@
+"""
+Stand-ins for the discord objects a command touches, so cogs can run without a gateway connection.
+"""
+
+import asyncio
+import itertools
+import typing
+from typing import Any, List, Optional
+
+from discord.ext import commands
+from discord.ext.commands import Bot
+from discord.ext.commands.view import StringView
+
+_message_ids: typing.Iterator[int] = itertools.count(1)
+
+
+class SentMessage(typing.NamedTuple):
+    destination: int
+    content: Optional[str]
+    embed: Any
+    file: Any
+
+
+class _Recipient(object):
+    def __init__(self, id: int, send_latency: float, outbox: List[SentMessage]) -> None:
+        self.id: int = id
+        self.send_latency: float = send_latency
+        self.outbox: List[SentMessage] = outbox
+
+    async def send(self, content: Optional[str] = None, *, embed: Any = None, file: Any = None, **kwargs) -> "FakeMessage":
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.outbox.append(SentMessage(self.id, content, embed, file))
+
+        return FakeMessage(content=content or "")
+
+
+class FakeUser(_Recipient):
+    def __init__(self, id: int, name: str, send_latency: float = 0.0, outbox: Optional[List[SentMessage]] = None):
+        super().__init__(id, send_latency, outbox if outbox is not None else [])
+        self.name: str = name
+        self.display_name: str = name
+        self.global_name: str = name
+        self.mention: str = f"<@{id}>"
+        self.bot: bool = False
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeChannel(_Recipient):
+    def __init__(self, id: int, send_latency: float = 0.0, outbox: Optional[List[SentMessage]] = None):
+        super().__init__(id, send_latency, outbox if outbox is not None else [])
+        self.name: str = f"channel-{id}"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeGuild(object):
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.name: str = f"guild-{id}"
+
+
+class FakeMessage(object):
+    def __init__(
+        self,
+        content: str,
+        author: Optional[FakeUser] = None,
+        channel: Optional[FakeChannel] = None,
+        guild: Optional[FakeGuild] = None,
+    ) -> None:
+        self.id: int = next(_message_ids)
+        self.content: str = content
+        self.author: Optional[FakeUser] = author
+        self.channel: Optional[FakeChannel] = channel
+        self.guild: Optional[FakeGuild] = guild
+        self.attachments: List[Any] = []
+        # commands.Context copies this, nothing reads it for the fake
+        self._state: Any = None
+
+    async def delete(self) -> None:
+        pass
+
+
+class FakeContext(commands.Context):
+    """A command context whose replies go to the fake channel instead of the discord API"""
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+
+def build_context(
+    bot: Bot,
+    command_name: str,
+    args: str,
+    author: FakeUser,
+    channel: FakeChannel,
+    guild: Optional[FakeGuild] = None,
+) -> FakeContext:
+    prefix: str = bot.command_prefix if isinstance(bot.command_prefix, str) else "!"
+    message: FakeMessage = FakeMessage(
+        content=f"{prefix}{command_name} {args}".strip(),
+        author=author,
+        channel=channel,
+        guild=guild,
+    )
+
+    return FakeContext(
+        message=message,
+        bot=bot,
+        view=StringView(args),
+        prefix=prefix,
+        command=bot.get_command(command_name),
+        invoked_with=command_name,
+    )
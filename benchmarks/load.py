@@ -0,0 +1,183 @@
+"""
+Command-level load harness: replays a mix of commands through the real cogs built by bot.new.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import random
+import string
+import time
+import typing
+from typing import Dict, Iterable, List, Optional
+
+from discord.ext.commands import Bot
+from sqlalchemy.orm import sessionmaker
+
+import discord_key_bot.bot
+from benchmarks import datagen
+from benchmarks.fakes import FakeChannel, FakeGuild, FakeUser, SentMessage, build_context
+from benchmarks.suite import summarize
+from discord_key_bot.platform import Platform, all_platforms
+
+BOT_CHANNEL_ID: int = 1
+
+DEFAULT_MIX: Dict[str, int] = {
+    "browse": 40,
+    "search": 25,
+    "add": 15,
+    "claim": 10,
+    "share": 10,
+}
+
+
+class Invocation(typing.NamedTuple):
+    command: str
+    args: str
+    author_id: int
+    guild_id: Optional[int] = None
+
+
+class LoadResult(typing.NamedTuple):
+    command: str
+    elapsed: float
+    failed: bool
+
+
+def synthetic_workload(
+    data: datagen.SeededData,
+    count: int,
+    mix: Dict[str, int],
+    seed: int,
+) -> List[Invocation]:
+    rng: random.Random = random.Random(seed)
+    platforms: List[Platform] = list(all_platforms())
+    commands: List[str] = list(mix)
+    weights: List[int] = [mix[command] for command in commands]
+
+    invocations: List[Invocation] = []
+    for i in range(count):
+        command: str = rng.choices(commands, weights)[0]
+        author_id: int = rng.choice(data.member_ids)
+        guild_id: int = rng.choice(data.guild_ids)
+
+        if command in ("browse", "latest", "mykeys"):
+            args: str = str(rng.randint(1, 5))
+        elif command == "search":
+            args: str = rng.choice(data.game_names).split()[-2]
+        elif command == "claim":
+            args: str = f"{rng.choice(platforms).search_name} {rng.choice(data.game_names)}"
+        elif command == "add":
+            key: str = "-".join("".join(rng.choices(string.ascii_uppercase + string.digits, k=5)) for _ in range(3))
+            args: str = f"steam {key} {rng.choice(data.game_names)}"
+            guild_id = None
+        else:
+            args: str = ""
+
+        invocations.append(Invocation(command, args, author_id, guild_id))
+
+    return invocations
+
+
+def load_workload(lines: Iterable[str]) -> List[Invocation]:
+    """Read a recorded workload, one JSON object per line with command, args, author_id and guild_id"""
+
+    invocations: List[Invocation] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record: Dict[str, typing.Any] = json.loads(line)
+        invocations.append(Invocation(
+            command=record["command"],
+            args=record.get("args", ""),
+            author_id=int(record["author_id"]),
+            guild_id=int(record["guild_id"]) if record.get("guild_id") else None,
+        ))
+
+    return invocations
+
+
+async def build_bot(
+    db_sessionmaker: sessionmaker, page_size: int, snapshot: bool = False, rate_limit_capacity: float = 0
+) -> Bot:
+    bot: Bot = await discord_key_bot.bot.new(
+        connect_database=lambda: db_sessionmaker,
+        bot_channel_id=BOT_CHANNEL_ID,
+        command_prefix="!",
+        wait_time=datetime.timedelta(0),
+        page_size=page_size,
+        expiration_waiver_period=datetime.timedelta(days=7),
+        log_level=logging.WARNING,
+        log_handler=logging.NullHandler(),
+        announcement_window=0,
+        snapshot_all_guilds=snapshot,
+        # a replay sends many commands per member, the limiter would measure itself, so it is off unless asked for
+        rate_limit_capacity=rate_limit_capacity,
+    )
+    # the cogs are built by setup_hook, which discord.py runs when logging in
+    await bot.setup_hook()
+
+    return bot
+
+
+async def replay(
+    bot: Bot,
+    invocations: List[Invocation],
+    concurrency: int,
+    send_latency: float = 0.0,
+) -> typing.Tuple[List[LoadResult], float, List[SentMessage]]:
+    outbox: List[SentMessage] = []
+    channel: FakeChannel = FakeChannel(BOT_CHANNEL_ID, send_latency, outbox)
+    users: Dict[int, FakeUser] = {}
+    guilds: Dict[int, FakeGuild] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for invocation in invocations:
+        queue.put_nowait(invocation)
+
+    results: List[LoadResult] = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            invocation: Invocation = queue.get_nowait()
+            author: FakeUser = users.setdefault(
+                invocation.author_id,
+                FakeUser(invocation.author_id, f"member{invocation.author_id}", send_latency, outbox),
+            )
+            guild: Optional[FakeGuild] = (
+                guilds.setdefault(invocation.guild_id, FakeGuild(invocation.guild_id)) if invocation.guild_id else None
+            )
+            ctx = build_context(
+                bot, invocation.command, invocation.args, author, channel if guild else author, guild
+            )
+
+            started: float = time.perf_counter()
+            await bot.invoke(ctx)
+            results.append(LoadResult(invocation.command, time.perf_counter() - started, ctx.command_failed))
+
+    started: float = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    # claims return once their key is reserved, the deliveries finish after them
+    await bot.claim_outbox.join()
+    wall_time: float = time.perf_counter() - started
+
+    return results, wall_time, outbox
+
+
+def report(results: List[LoadResult], wall_time: float) -> Dict[str, Dict[str, float]]:
+    by_command: Dict[str, List[LoadResult]] = {}
+    for result in results:
+        by_command.setdefault(result.command, []).append(result)
+    by_command["all"] = results
+
+    summary: Dict[str, Dict[str, float]] = {}
+    for command, command_results in sorted(by_command.items()):
+        durations: List[float] = sorted(result.elapsed for result in command_results)
+        stats: Dict[str, float] = summarize(durations)
+        stats["p50"] = durations[len(durations) // 2]
+        stats["p99"] = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        stats["throughput"] = len(command_results) / wall_time
+        stats["failures"] = sum(result.failed for result in command_results)
+        summary[command] = stats
+
+    return summary
@@ -0,0 +1,322 @@
+"""
+Timed benchmarks for the inventory queries and the claim path.
+
+Besides wall time every benchmark records `vm_steps`, the SQLite virtual machine instructions one run executed. It
+follows the rows the queries scanned and doesn't vary between runs.
+"""
+
+import random
+import statistics
+import time
+import typing
+from typing import Callable, Dict, List, Set
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.elements import TextClause
+
+from benchmarks.datagen import SeededData
+from discord_key_bot.db import claims, search
+from discord_key_bot.db.models import Game, Key, Member
+from discord_key_bot.db.queries import SortOrder
+from discord_key_bot.db.snapshot import GuildInventory, InventorySnapshot
+from discord_key_bot.db.titles import TitleIndex
+from discord_key_bot.platform import all_platforms, Platform
+
+# the progress handler runs every this many instructions, counting each one is too slow
+_STEP_GRANULARITY: int = 100
+
+# A guild's claimable keys filtered once into a temp table that the page and the total then read, instead of both
+# filtering keys again. Kept here to compare against the plain queries, the bot doesn't use it.
+_create_visible_keys: List[TextClause] = [
+    text("CREATE TEMP TABLE IF NOT EXISTS visible_keys (key_id INTEGER PRIMARY KEY, game_id INTEGER NOT NULL)"),
+    text("CREATE INDEX IF NOT EXISTS temp.ix_visible_keys_game_id ON visible_keys (game_id)"),
+    # the benchmark's session is rolled back, which can keep the table around on the pooled connection
+    text("DELETE FROM temp.visible_keys"),
+]
+
+_fill_visible_keys: TextClause = text("""
+    INSERT INTO temp.visible_keys (key_id, game_id)
+    SELECT
+        keys.id, keys.game_id
+    FROM
+        keys
+    WHERE
+        (keys.expiration IS NULL OR keys.expiration > CURRENT_DATE)
+        AND keys.reserved_at IS NULL
+        AND keys.creator_id IN :creator_ids
+""").bindparams(bindparam("creator_ids", expanding=True))
+
+_visible_keys_page: TextClause = text("""
+WITH platform_games AS (
+    SELECT
+        games.id AS game_id,
+        games.pretty_name AS game_name,
+        keys.platform AS platform,
+        count(keys.id) AS key_count
+    FROM
+        temp.visible_keys
+        JOIN keys
+            ON keys.id = visible_keys.key_id
+        JOIN games
+            ON games.id = visible_keys.game_id
+    WHERE
+        (:platform = '' OR keys.platform = :platform)
+    GROUP BY
+        games.id, keys.platform
+),
+page AS (
+    SELECT
+        DISTINCT game_id
+    FROM
+        platform_games
+    ORDER BY
+        LOWER(game_name) ASC
+    LIMIT :per_page
+)
+
+SELECT
+    game_name, platform, key_count
+FROM
+    platform_games
+    JOIN page
+        ON platform_games.game_id = page.game_id
+    ORDER BY
+        LOWER(game_name) ASC
+""")
+
+_visible_keys_count: TextClause = text("""
+    SELECT
+        COUNT(DISTINCT visible_keys.game_id)
+    FROM
+        temp.visible_keys
+        JOIN keys
+            ON keys.id = visible_keys.key_id
+    WHERE
+        :platform = '' OR keys.platform = :platform
+""")
+
+
+class Benchmark(typing.NamedTuple):
+    name: str
+    func: Callable[[Session], None]
+    # destructive benchmarks roll back their session after every run
+    rollback: bool = False
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    ordered: List[float] = sorted(durations)
+
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def build_benchmarks(
+    data: SeededData, page_size: int, seed: int, db_sessionmaker: sessionmaker
+) -> List[Benchmark]:
+    rng: random.Random = random.Random(seed)
+    guild_id: int = rng.choice(data.guild_ids)
+    # the guild commands take the visible creators from the share index
+    creator_ids: Set[int] = data.guild_members[guild_id]
+    member_id: int = rng.choice(data.member_ids)
+    game_name: str = rng.choice(data.game_names)
+    key: str = rng.choice(data.keys)
+    platform: Platform = rng.choice(list(all_platforms()))
+
+    snapshot: InventorySnapshot = InventorySnapshot(db_sessionmaker, guild_ids=[guild_id])
+    snapshot.load([guild_id])
+
+    title_index: TitleIndex = TitleIndex(db_sessionmaker)
+    title_index.load([guild_id])
+    title_index.spelling.load()
+    # two letters swapped in the middle of the title
+    middle: int = len(game_name) // 2
+    misspelt_name: str = game_name[:middle - 1] + game_name[middle] + game_name[middle - 1] + game_name[middle + 1:]
+
+    benchmarks: List[Benchmark] = []
+    for sort in SortOrder:
+        benchmarks.append(Benchmark(
+            f"get_paginated_games[{sort.name}]",
+            lambda session, sort=sort: search.get_paginated_games(
+                session=session,
+                guild_id=guild_id,
+                creator_ids=creator_ids,
+                per_page=page_size,
+                sort=sort,
+                expiring_only=sort == SortOrder.EXPIRATION,
+            ),
+        ))
+
+    benchmarks.extend([
+        Benchmark(
+            "get_paginated_games[TITLE,deep_page]",
+            lambda session: search.get_paginated_games(
+                session=session,
+                guild_id=guild_id,
+                creator_ids=creator_ids,
+                per_page=page_size,
+                page=max(1, len(data.game_names) // page_size // 2),
+            ),
+        ),
+        Benchmark(
+            "get_paginated_games[mykeys]",
+            lambda session: search.get_paginated_games(session=session, member_id=member_id, per_page=page_size),
+        ),
+        Benchmark(
+            "count_games[guild]",
+            lambda session: search.count_games(session=session, guild_id=guild_id, creator_ids=creator_ids),
+        ),
+        Benchmark(
+            "count_games[guild,subquery]",
+            lambda session: search.count_games(session=session, guild_id=guild_id),
+        ),
+        Benchmark("count_games[member]", lambda session: search.count_games(session=session, member_id=member_id)),
+        Benchmark(
+            "count_games[expiring]",
+            lambda session: search.count_games(
+                session=session, guild_id=guild_id, creator_ids=creator_ids, expiring_only=True
+            ),
+        ),
+        Benchmark(
+            "get_game",
+            lambda session: search.get_game(session, game_name, guild_id, creator_ids=creator_ids),
+        ),
+        Benchmark(
+            "platform[page+count]",
+            lambda session: _page_and_count(session, guild_id, creator_ids, platform, page_size),
+        ),
+        Benchmark(
+            "platform[page+count,visible_keys]",
+            lambda session: _visible_keys_page_and_count(session, creator_ids, platform, page_size),
+        ),
+        Benchmark(
+            "platform[page+count,snapshot]",
+            lambda session: _snapshot_page_and_count(snapshot, guild_id, platform, page_size),
+        ),
+        Benchmark("snapshot[load_guild]", lambda session: snapshot.load([guild_id])),
+        Benchmark("titles[complete]", lambda session: title_index.for_guild(guild_id).complete(game_name[:3])),
+        Benchmark("titles[load_guild]", lambda session: title_index.load([guild_id])),
+        Benchmark("titles[suggest]", lambda session: title_index.suggest_for_guild(guild_id, misspelt_name)),
+        Benchmark("spelling[load]", lambda session: title_index.spelling.load()),
+        Benchmark("key_exists[hit]", lambda session: search.key_exists(session, key)),
+        Benchmark("key_exists[miss]", lambda session: search.key_exists(session, "MISSING-KEY-00000")),
+        Benchmark("delete_expired", search.delete_expired, rollback=True),
+        Benchmark("claim", lambda session: _claim(session, data, rng), rollback=True),
+    ])
+
+    return benchmarks
+
+
+def run_benchmarks(
+    db_sessionmaker: sessionmaker, benchmarks: List[Benchmark], repeat: int, warmup: int = 1
+) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+
+    for benchmark in benchmarks:
+        durations: List[float] = []
+        for run in range(warmup + repeat):
+            with db_sessionmaker() as session:
+                started: float = time.perf_counter()
+                benchmark.func(session)
+                elapsed: float = time.perf_counter() - started
+
+                if benchmark.rollback:
+                    session.rollback()
+
+            if run >= warmup:
+                durations.append(elapsed)
+
+        results[benchmark.name] = summarize(durations)
+        with db_sessionmaker() as session:
+            results[benchmark.name]["vm_steps"] = count_vm_steps(session, benchmark.func)
+            session.rollback()
+
+    return results
+
+
+def count_vm_steps(session: Session, func: Callable[[Session], None]) -> int:
+    """SQLite virtual machine instructions executed by `func`, to the nearest `_STEP_GRANULARITY`"""
+
+    driver_connection = session.connection().connection.driver_connection
+    if not hasattr(driver_connection, "set_progress_handler"):
+        return 0
+
+    steps: int = 0
+
+    def count() -> int:
+        nonlocal steps
+        steps += _STEP_GRANULARITY
+        return 0
+
+    driver_connection.set_progress_handler(count, _STEP_GRANULARITY)
+    try:
+        func(session)
+    finally:
+        driver_connection.set_progress_handler(None, _STEP_GRANULARITY)
+
+    return steps
+
+
+def _page_and_count(
+    session: Session,
+    guild_id: int,
+    creator_ids: Set[int],
+    platform: Platform,
+    page_size: int,
+) -> None:
+    """The database side of GuildCommands.platform: a page of games and the total"""
+
+    search.get_paginated_games(
+        session=session, guild_id=guild_id, creator_ids=creator_ids, platform=platform, per_page=page_size
+    )
+    search.count_games(session=session, guild_id=guild_id, creator_ids=creator_ids, platform=platform)
+
+
+def _snapshot_page_and_count(snapshot: InventorySnapshot, guild_id: int, platform: Platform, page_size: int) -> None:
+    """GuildCommands.platform served from the inventory snapshot"""
+
+    inventory: GuildInventory = snapshot.get(guild_id)
+    inventory.get_paginated_games(platform=platform, per_page=page_size)
+    inventory.count_games(platform=platform)
+
+
+def _visible_keys_page_and_count(session: Session, creator_ids: Set[int], platform: Platform, page_size: int) -> None:
+    """_page_and_count reading the guild's keys from a temp table filled once"""
+
+    for statement in _create_visible_keys:
+        session.execute(statement)
+
+    session.execute(_fill_visible_keys, {"creator_ids": list(creator_ids)})
+    parameters: Dict[str, typing.Any] = {"platform": platform.search_name, "per_page": page_size}
+    session.execute(_visible_keys_page, parameters).all()
+    session.execute(_visible_keys_count, parameters).first()
+
+
+def _claim(session: Session, data: SeededData, rng: random.Random) -> None:
+    """The database side of GuildCommands.claim: look up, reserve and complete"""
+
+    guild_id: int = rng.choice(data.guild_ids)
+    for _ in range(20):
+        game: typing.Optional[Game] = search.get_game(
+            session, rng.choice(data.game_names), guild_id, creator_ids=data.guild_members[guild_id]
+        )
+        if not game:
+            continue
+
+        for platform in all_platforms():
+            try:
+                key: Key = game.find_key(platform)
+            except ValueError:
+                continue
+
+            member: Member = Member.get(session, rng.choice(data.member_ids), "benchmark")
+            claims.reserve_key(session, key, member)
+            claims.complete_claim(session, key.id, guild_id)
+            session.flush()
+            return
@@ -1,17 +1,31 @@
+"""
+Builds the bot. Only discord.py is loaded up front: the database, the caches read from it and the cogs, along with
+SQLAlchemy and the command modules, are set up by the bot's setup_hook, which discord.py runs once it has logged in
+and before it connects to the gateway.
+"""
+
 import datetime
 import logging
+import time
+import typing
+from typing import Callable, Dict, List, Mapping, Optional
 
 import discord
 from discord.ext import commands
 from discord.ext.commands import Bot, CommandError
-from sqlalchemy.orm import sessionmaker
 
-from discord_key_bot.command import guild, direct, admin
-from discord_key_bot.common import util
+from discord_key_bot.common import util, defaults, metrics
+from discord_key_bot.common.colours import Colours
+from discord_key_bot.common.dispatcher import MessageDispatcher
+from discord_key_bot.common.ratelimit import CommandRateLimiter, RateLimited, parse_costs
+from discord_key_bot.db.slow_queries import SlowQueryLog
+
+if typing.TYPE_CHECKING:
+    from sqlalchemy.orm import sessionmaker
 
 
 async def new(
-    db_sessionmaker: sessionmaker,
+    connect_database: Callable[[], "sessionmaker"],
     bot_channel_id: int,
     command_prefix: str,
     wait_time: datetime.timedelta,
@@ -19,21 +33,105 @@ async def new(
     expiration_waiver_period: datetime.timedelta,
     log_level: int = logging.INFO,
     log_handler: logging.Handler = logging.StreamHandler(),
+    message_queue_size: int = defaults.MESSAGE_QUEUE_SIZE,
+    announcement_window: float = defaults.ANNOUNCEMENT_WINDOW,
+    slow_query_log: Optional[SlowQueryLog] = None,
+    startup_started: Optional[float] = None,
+    shard_count: int = defaults.SHARD_COUNT,
+    shard_ids: Optional[List[int]] = None,
+    cache_sync_interval: float = defaults.CACHE_SYNC_INTERVAL,
+    snapshot_guild_ids: Optional[List[int]] = None,
+    snapshot_all_guilds: bool = False,
+    page_timeout: float = defaults.PAGE_TIMEOUT,
+    rate_limit_capacity: float = defaults.RATE_LIMIT_CAPACITY,
+    rate_limit_refill_rate: float = defaults.RATE_LIMIT_REFILL_RATE,
+    rate_limit_costs: Optional[Mapping[str, float]] = None,
+    expiry_announcements: bool = defaults.EXPIRY_ANNOUNCEMENTS,
+    archive_after: datetime.timedelta = datetime.timedelta(days=defaults.ARCHIVE_AFTER_DAYS),
+    archive_unshared_after: datetime.timedelta = datetime.timedelta(days=defaults.ARCHIVE_UNSHARED_AFTER_DAYS),
 ) -> Bot:
     discord.utils.setup_logging(handler=log_handler, level=log_level)
     logger = logging.getLogger("discord_key_bot.bot")
 
-    bot = commands.Bot(
+    bot_options: dict = dict(
         command_prefix=command_prefix,
         intents=discord.Intents(messages=True, message_content=True, guilds=True),
         help_command=commands.DefaultHelpCommand(dm_help=False),
     )
 
+    if shard_ids and not shard_count:
+        # discord.py can't tell which shards the ids are out of
+        raise ValueError("shard_ids needs shard_count, the total number of shards across every process")
+
+    if shard_count:
+        # several processes can share one database, each running its own subset of the shards
+        bot = commands.AutoShardedBot(shard_count=shard_count, shard_ids=shard_ids, **bot_options)
+        logger.info(f"Running shards {shard_ids or 'all'} of {shard_count}")
+    else:
+        bot = commands.Bot(**bot_options)
+
+    bot.message_dispatcher = MessageDispatcher(
+        queue_size=message_queue_size,
+        announcement_window=announcement_window,
+    )
+
+    @bot.listen()
+    async def on_ready() -> None:
+        # on_ready fires again after a reconnect, only the first one measures startup
+        if startup_started is not None and not metrics.STARTUP_DURATION.value(phase="ready"):
+            elapsed: float = time.perf_counter() - startup_started
+            metrics.STARTUP_DURATION.set(elapsed, phase="ready")
+            logger.info(f"Ready in {elapsed:.2f}s")
+
+    # a capacity of 0 turns the limiter off
+    bot.rate_limiter = None
+    if rate_limit_capacity > 0:
+        bot.rate_limiter = CommandRateLimiter(
+            rate_limit_capacity,
+            rate_limit_refill_rate,
+            parse_costs(defaults.RATE_LIMIT_COSTS) if rate_limit_costs is None else rate_limit_costs,
+        )
+
+    # the same reply every time, built once
+    rate_limited_message: discord.Embed = util.embed(
+        "You're sending commands too quickly, please wait a moment before trying again.", Colours.GOLD
+    )
+
+    command_started: Dict[commands.Context, float] = {}
+
+    @bot.before_invoke
+    async def start_command_timer(ctx: commands.Context) -> None:
+        command_started[ctx] = time.perf_counter()
+        await util.acknowledge_interaction(ctx)
+
+    @bot.after_invoke
+    async def record_command_duration(ctx: commands.Context) -> None:
+        started: float = command_started.pop(ctx, None)
+        if started is not None:
+            metrics.COMMAND_DURATION.observe(
+                time.perf_counter() - started,
+                cog=type(ctx.cog).__name__,
+                command=ctx.command.qualified_name,
+            )
+
+        await util.close_interaction(ctx)
+
     @bot.event
     async def on_command_error(ctx: commands.Context, error: CommandError):
+        metrics.COMMAND_ERRORS.inc(
+            command=ctx.command.qualified_name if ctx.command else "",
+            error=type(error).__name__,
+        )
+        await util.close_interaction(ctx)
+
         if not await is_bot_channel(ctx):
             return
 
+        if isinstance(error, RateLimited):
+            if error.notify:
+                await util.send_message(ctx=ctx, msg=rate_limited_message)
+            return
+
         message: str = ""
         if isinstance(error, commands.CommandNotFound):
             message = f"**Invalid command. Use** `{command_prefix}help` **for a list of valid commands.**"
@@ -43,7 +141,10 @@ async def new(
         else:
             logger.critical(f"{type(ctx.cog).__name__}.{ctx.invoked_with}: {error}")
 
-        if isinstance(ctx.cog, direct.DirectCommands) and bool(ctx.guild):
+        # loaded by setup_hook before any command could run
+        from discord_key_bot.command import direct
+
+        if isinstance(ctx.cog, direct.DirectCommands) and bool(ctx.guild) and not ctx.interaction:
             await ctx.message.delete()
 
         if message:
@@ -56,9 +157,103 @@ async def new(
     async def is_bot_channel(ctx: commands.Context) -> bool:
         return not bool(ctx.guild) or ctx.channel.id == bot_channel_id
 
-    # register cogs
-    await bot.add_cog(guild.GuildCommands(bot, db_sessionmaker, wait_time, page_size, expiration_waiver_period))
-    await bot.add_cog(direct.DirectCommands(bot, db_sessionmaker, page_size))
-    await bot.add_cog(admin.AdminCommands(bot, db_sessionmaker))
+    if bot.rate_limiter:
+        # a call_once check runs once per invocation, not for every command the help command lists
+        @bot.check_once
+        async def charge_rate_limit(ctx: commands.Context) -> bool:
+            # it runs before the regular checks, commands ignored outside the bot channel don't cost any tokens
+            return not await is_bot_channel(ctx) or await bot.rate_limiter.check(ctx)
+
+    async def setup_hook() -> None:
+        # imported here so that none of it is loaded before logging in
+        from discord_key_bot.command import guild, direct, admin
+        from discord_key_bot.common.outbox import ClaimOutbox
+        from discord_key_bot.common.singleflight import SingleFlight
+        from discord_key_bot.db import connection, search
+        from discord_key_bot.db.changes import ChangeWatcher
+        from discord_key_bot.db.expirations import ExpirationSchedule, ExpiringKey
+        from discord_key_bot.db.shares import ShareIndex
+        from discord_key_bot.db.snapshot import InventorySnapshot
+        from discord_key_bot.db.titles import TitleIndex
+
+        db_sessionmaker: sessionmaker = connect_database()
+        bot.db_sessionmaker = db_sessionmaker
+
+        bot.change_watcher = ChangeWatcher(db_sessionmaker, interval=cache_sync_interval)
+        bot.change_watcher.install()
+
+        bot.share_index = ShareIndex(db_sessionmaker)
+        bot.share_index.load()
+        bot.change_watcher.register(bot.share_index.on_changes)
+
+        bot.inventory_snapshot = None
+        if snapshot_all_guilds or snapshot_guild_ids:
+            bot.inventory_snapshot = InventorySnapshot(
+                db_sessionmaker, guild_ids=None if snapshot_all_guilds else snapshot_guild_ids
+            )
+            bot.inventory_snapshot.load(list(bot.share_index.guilds) if snapshot_all_guilds else snapshot_guild_ids)
+            bot.change_watcher.register(bot.inventory_snapshot.on_changes)
+            logger.info(
+                f"Inventory snapshot of {len(bot.inventory_snapshot.guilds)} guilds uses "
+                f"{sum(bot.inventory_snapshot.memory_usage().values()) / 1024:.0f} KiB"
+            )
+
+        bot.title_index = TitleIndex(db_sessionmaker)
+        bot.change_watcher.register(bot.title_index.on_changes)
+
+        async def announce_expiring_key(guild_id: int, key: ExpiringKey) -> None:
+            channel: Optional[discord.abc.GuildChannel] = bot.get_channel(bot_channel_id)
+            # a process only sees the channel when it runs that guild's shard
+            if channel is None or channel.guild.id != guild_id:
+                return
+
+            await bot.message_dispatcher.announce(
+                channel,
+                "keys expiring soon",
+                f'"{key.title}" on {search.key_count_label(key.platform, key.expiration)} is about to expire. '
+                f'Claim it with `{command_prefix}claim {key.title}` before then, no cooldown applies.',
+            )
+
+        bot.expiration_schedule = None
+        if expiry_announcements and expiration_waiver_period > datetime.timedelta(0):
+            bot.expiration_schedule = ExpirationSchedule(
+                db_sessionmaker, bot.share_index, expiration_waiver_period, announce_expiring_key
+            )
+            bot.expiration_schedule.load()
+            bot.change_watcher.register(bot.expiration_schedule.on_changes)
+
+        # identical reads running at the same time share one query
+        bot.single_flight = SingleFlight(use_threads=not connection.is_in_memory(db_sessionmaker))
+        bot.change_watcher.register(bot.single_flight.on_changes)
+
+        bot.claim_outbox = ClaimOutbox(db_sessionmaker, bot.message_dispatcher)
+
+        # register cogs
+        await bot.add_cog(guild.GuildCommands(
+            bot,
+            db_sessionmaker,
+            wait_time,
+            page_size,
+            expiration_waiver_period,
+            bot.share_index,
+            bot.inventory_snapshot,
+            bot.title_index,
+            page_timeout,
+            bot.single_flight,
+            bot.claim_outbox,
+        ))
+        await bot.add_cog(direct.DirectCommands(
+            bot, db_sessionmaker, page_size, bot.title_index, page_timeout, bot.single_flight
+        ))
+        await bot.add_cog(admin.AdminCommands(
+            bot,
+            db_sessionmaker,
+            slow_query_log=slow_query_log,
+            inventory_snapshot=bot.inventory_snapshot,
+            archive_after=archive_after,
+            archive_unshared_after=archive_unshared_after,
+        ))
+
+    bot.setup_hook = setup_hook
 
     return bot
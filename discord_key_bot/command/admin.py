@@ -2,7 +2,7 @@ import datetime
 import inspect
 import logging
 import re
-from typing import Sequence, Optional
+from typing import List, Sequence, Optional, Tuple
 
 import discord
 from discord import User
@@ -11,19 +11,42 @@ from discord.ext.commands import Bot
 from sqlalchemy.orm import sessionmaker
 
 from discord_key_bot.command.util import is_admin, is_owner
+from discord_key_bot.common import defaults
 from discord_key_bot.common.colours import Colours
-from discord_key_bot.common.util import get_search_name, embed, send_message, get_expiration_eod
-from discord_key_bot.db import search
+from discord_key_bot.common.util import (
+    get_search_name, get_sort_name, embed, send_message, send_direct_message, get_expiration_eod
+)
+from discord_key_bot.db import archive, search
 from discord_key_bot.db.models import Game, Member
+from discord_key_bot.db.slow_queries import SlowQuery, SlowQueryLog
+from discord_key_bot.db.snapshot import InventorySnapshot
 from discord_key_bot.platform import Platform, get_platform
 
+# statements one !slowqueries reply holds, each field takes up to ~900 of an embed's 6000 characters
+_MAX_SLOW_QUERIES: int = 5
+
 
 class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidden=True)):
-    def __init__(self, bot: Bot, db_sessionmaker: sessionmaker, admin_role_id: int = 0):
+    def __init__(
+        self,
+        bot: Bot,
+        db_sessionmaker: sessionmaker,
+        admin_role_id: int = 0,
+        slow_query_log: Optional[SlowQueryLog] = None,
+        inventory_snapshot: Optional[InventorySnapshot] = None,
+        archive_after: datetime.timedelta = datetime.timedelta(days=defaults.ARCHIVE_AFTER_DAYS),
+        archive_unshared_after: datetime.timedelta = datetime.timedelta(days=defaults.ARCHIVE_UNSHARED_AFTER_DAYS),
+    ):
         self.bot: Bot = bot
         self.db_sessionmaker: sessionmaker = db_sessionmaker
         self.logger = logging.getLogger(__name__)
         self.admin_role_id = admin_role_id
+        self.slow_query_log: Optional[SlowQueryLog] = slow_query_log
+        self.inventory_snapshot: Optional[InventorySnapshot] = inventory_snapshot
+        # keys older than this are archived, 0 only archives unshared keys
+        self.archive_after: datetime.timedelta = archive_after
+        # keys of members who share with no guild are archived once older than this, 0 archives them right away
+        self.archive_unshared_after: datetime.timedelta = archive_unshared_after
 
         self._member_patt = re.compile(r"<@(\d+)>")
 
@@ -59,7 +82,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(embed=embed(f"Successfully added {user.name} as admin", colour=Colours.GREEN))
+        await send_direct_message(ctx, embed(f"Successfully added {user.name} as admin", colour=Colours.GREEN))
 
     @commands.command()
     @commands.is_owner()
@@ -89,7 +112,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(embed=embed(f"Successfully added {user.name} as owner", colour=Colours.GREEN))
+        await send_direct_message(ctx, embed(f"Successfully added {user.name} as owner", colour=Colours.GREEN))
 
     @commands.command()
     async def rmadmin(
@@ -122,7 +145,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(embed=embed(f"Successfully removed {user.name} as admin", colour=Colours.GREEN))
+        await send_direct_message(ctx, embed(f"Successfully removed {user.name} as admin", colour=Colours.GREEN))
 
     @commands.command()
     @commands.is_owner()
@@ -153,7 +176,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(embed=embed(f"Successfully removed {user.name} as admin", colour=Colours.GREEN))
+        await send_direct_message(ctx, embed(f"Successfully removed {user.name} as admin", colour=Colours.GREEN))
 
     @commands.command()
     async def lsadmin(self, ctx: commands.Context):
@@ -169,7 +192,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             admin_users: Sequence[Member] = search.get_admin_members(session)
 
         if not admin_users:
-            await ctx.author.send(embed=embed("No admin users found", colour=Colours.RED))
+            await send_direct_message(ctx, embed("No admin users found", colour=Colours.RED))
             return
 
         msg = embed(
@@ -182,7 +205,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             msg.add_field(name=admin.name,
                           value=f"**id:** {admin.id}")
 
-        await ctx.author.send(embed=msg)
+        await send_direct_message(ctx, msg)
 
     @commands.command()
     @commands.is_owner()
@@ -195,7 +218,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             owners: Sequence[Member] = search.get_owner_members(session)
 
         if not owners:
-            await ctx.author.send(embed=embed("No owners found", colour=Colours.RED))
+            await send_direct_message(ctx, embed("No owners found", colour=Colours.RED))
             return
 
         msg = embed(
@@ -208,7 +231,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             msg.add_field(name=owner.name,
                           value=f"**id:** {owner.id}")
 
-        await ctx.author.send(embed=msg)
+        await send_direct_message(ctx, msg)
 
     @commands.command()
     async def gameid(
@@ -236,7 +259,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             )
 
         if not games:
-            await ctx.author.send(embed=embed("Game not found", colour=Colours.RED))
+            await send_direct_message(ctx, embed("Game not found", colour=Colours.RED))
             return
 
         msg = embed(
@@ -249,7 +272,7 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             msg.add_field(name=game.pretty_name,
                           value=f"**id:** {game.id}")
 
-        await ctx.author.send(embed=msg)
+        await send_direct_message(ctx, msg)
 
     @commands.command()
     async def rename(
@@ -283,17 +306,18 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             game: Optional[Game] = session.get(Game, game_id)
 
             if not game:
-                await ctx.author.send(embed=embed("Game not found", colour=Colours.RED))
+                await send_direct_message(ctx, embed("Game not found", colour=Colours.RED))
                 return
 
             if game.name == get_search_name(new_name):
                 game.pretty_name = new_name
+                game.sort_name = get_sort_name(new_name)
                 session.flush()
                 session.commit()
 
                 text: str = f"Renamed display name of existing game from '{game.pretty_name}' to '{new_name}'"
                 self.logger.debug(text)
-                await ctx.author.send(embed=embed(title="Renamed game", text=text))
+                await send_direct_message(ctx, embed(title="Renamed game", text=text))
                 return
 
             existing_game = search.get_game(session=session, game_name=new_name)
@@ -301,13 +325,14 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
                 text: str = f"Renaming names of existing game from '{game.pretty_name}' to '{new_name}'"
                 game.pretty_name = new_name
                 game.name = get_search_name(new_name)
+                game.sort_name = get_sort_name(new_name)
 
                 self.logger.debug(text)
-                await ctx.author.send(embed=embed(title="Renamed game", text=text))
+                await send_direct_message(ctx, embed(title="Renamed game", text=text))
             else:
                 text: str = f"Moving keys from game ID {game.id} to game ID {existing_game.id}"
                 self.logger.debug(text)
-                await ctx.author.send(embed=embed(title="Renaming game", text=text))
+                await send_direct_message(ctx, embed(title="Renaming game", text=text))
 
                 while game.keys:
                     key = game.keys.pop()
@@ -358,15 +383,16 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             try:
                 platform: Platform = get_platform(platform_name)
             except ValueError:
-                await ctx.author.send(
-                    embed=embed(f'"{platform_name}" is not valid platform', Colours.RED),
+                await send_direct_message(
+                    ctx,
+                    embed(f'"{platform_name}" is not valid platform', Colours.RED),
                 )
                 return
 
             game = session.get(Game, game_id)
 
             if not game:
-                await ctx.author.send(embed=embed("Game not found", colour=Colours.RED))
+                await send_direct_message(ctx, embed("Game not found", colour=Colours.RED))
                 return
 
             plat: platform = get_platform(platform_name)
@@ -417,12 +443,77 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(
-            embed=embed(
+        await send_direct_message(
+            ctx,
+            embed(
                 title="Deleting Expired Keys",
                 text=f"{game_count} games, {key_count} keys deleted", colour=Colours.GREEN)
             )
 
+    @commands.command()
+    async def archive(self, ctx: commands.Context):
+        """Move old and unshared keys to the archive"""
+
+        self.logger.info(f"archive request from user {ctx.author.display_name}")
+
+        with self.db_sessionmaker() as session:
+            if not await is_owner(session, ctx):
+                self.logger.info(f"{ctx.author.display_name} is not an authorized owner")
+                return
+
+            now: datetime.datetime = datetime.datetime.now(datetime.UTC)
+            added_before: Optional[datetime.datetime] = now - self.archive_after if self.archive_after else None
+            game_count, key_count = archive.archive_keys(session, added_before, now - self.archive_unshared_after)
+            session.commit()
+
+        self.logger.info(f"archived {key_count} keys and deleted {game_count} games")
+        await send_direct_message(
+            ctx,
+            embed(
+                title="Archiving Keys", text=f"{key_count} keys archived, {game_count} games deleted", colour=Colours.GREEN
+            )
+        )
+
+    @commands.command()
+    async def restore(
+        self,
+        ctx: commands.Context,
+        *,
+        member: str = commands.Parameter(
+            name="member",
+            displayed_name="Member",
+            description="Member whose keys to restore, every archived key if left out",
+            kind=inspect.Parameter.POSITIONAL_ONLY,
+            default="",
+        ),
+    ):
+        """Restore archived keys"""
+
+        self.logger.info(f"restore request from user {ctx.author.display_name}")
+
+        user: Optional[User] = None
+        if member:
+            user = await self._get_user(ctx, member)
+            if not user:
+                return
+
+        with self.db_sessionmaker() as session:
+            if not await is_admin(session, ctx):
+                self.logger.info(f"{ctx.author.display_name} is not an authorized admin")
+                return
+
+            restored, skipped = archive.restore_keys(session, user.id if user else 0)
+            session.commit()
+
+        await send_direct_message(
+            ctx,
+            embed(
+                title="Restoring Keys",
+                text=f"{restored} keys restored, {skipped} expired or duplicate keys left in the archive",
+                colour=Colours.GREEN,
+            )
+        )
+
     @commands.command()
     async def delete(
         self,
@@ -445,15 +536,18 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
 
             game = session.get(Game, game_id)
             if not game:
-                await ctx.author.send(embed=embed("Game not found", colour=Colours.RED))
+                await send_direct_message(ctx, embed("Game not found", colour=Colours.RED))
                 return
 
+            for key in game.keys:
+                session.delete(key)
             session.delete(game)
             session.flush()
             session.commit()
 
-            await ctx.author.send(
-                embed=embed(
+            await send_direct_message(
+                ctx,
+                embed(
                     title="Deleting Expired Keys",
                     text=f"game_id {game_id} deleted", colour=Colours.GREEN)
                 )
@@ -489,28 +583,130 @@ class AdminCommands(commands.Cog, name='Admin Commands', command_attrs=dict(hidd
             session.flush()
             session.commit()
 
-        await ctx.author.send(
-            embed=embed(
+        await send_direct_message(
+            ctx,
+            embed(
                 title="Claim cooldown reset",
                 text=f"Claim cooldown reset for {member.name} ", colour=Colours.GREEN)
             )
 
+    @commands.command()
+    async def slowqueries(
+        self,
+        ctx: commands.Context,
+        count: int = commands.Parameter(
+            name="count",
+            displayed_name="Count",
+            description=f"The number of statements to show, at most {_MAX_SLOW_QUERIES}",
+            kind=inspect.Parameter.POSITIONAL_ONLY,
+            default=_MAX_SLOW_QUERIES,
+        ),
+    ):
+        """Show the slowest database statements since startup"""
+
+        self.logger.info(f"slowqueries request from user {ctx.author.display_name}")
+
+        with self.db_sessionmaker() as session:
+            if not await is_admin(session, ctx):
+                self.logger.info(f"{ctx.author.display_name} is not an authorized admin")
+                return
+
+        if not self.slow_query_log:
+            await send_direct_message(ctx, embed("Slow query logging is disabled", colour=Colours.GOLD))
+            return
+
+        shown: int = min(max(count, 1), _MAX_SLOW_QUERIES)
+        slow_queries: List[SlowQuery] = self.slow_query_log.top(shown)
+        if not slow_queries:
+            await send_direct_message(ctx, embed("No slow queries recorded", colour=Colours.GREEN))
+            return
+
+        text: str = f"Statements over {self.slow_query_log.threshold * 1000:.0f} ms by total time"
+        if shown != count:
+            text += f"\nShowing {shown}, not {count}: the count is clamped to 1 to {_MAX_SLOW_QUERIES}"
+
+        msg = embed(title="Slow Queries", text=text, colour=Colours.GOLD)
+
+        for query in slow_queries:
+            value: str = f"```sql\n{_truncate(' '.join(query.statement.split()), 600)}\n```"
+            if query.plan:
+                value += f"\n```\n{_truncate(query.plan, 300)}\n```"
+            msg.add_field(
+                name=f"{query.count}x, {query.max * 1000:.0f} ms max, {query.total * 1000:.0f} ms total",
+                value=value,
+                inline=False,
+            )
+
+        await send_direct_message(ctx, msg)
+
+    @commands.command()
+    async def snapshot(self, ctx: commands.Context):
+        """Show the memory held by the in-memory inventory snapshot per guild"""
+
+        self.logger.info(f"snapshot request from user {ctx.author.display_name}")
+
+        with self.db_sessionmaker() as session:
+            if not await is_admin(session, ctx):
+                self.logger.info(f"{ctx.author.display_name} is not an authorized admin")
+                return
+
+        if not self.inventory_snapshot:
+            await send_direct_message(ctx, embed("The inventory snapshot is disabled", colour=Colours.GOLD))
+            return
+
+        usage: List[Tuple[int, int]] = sorted(
+            self.inventory_snapshot.memory_usage().items(), key=lambda item: item[1], reverse=True
+        )
+
+        msg = embed(
+            title="Inventory Snapshot",
+            text=f"{len(usage)} guilds using {sum(size for _, size in usage) / 1024:.0f} KiB",
+        )
+
+        # an embed holds at most 25 fields
+        for guild_id, size in usage[:25]:
+            guild: Optional[discord.Guild] = self.bot.get_guild(guild_id)
+            msg.add_field(
+                name=guild.name if guild else str(guild_id),
+                value=f"{len(self.inventory_snapshot.guilds[guild_id].games)} games, {size / 1024:.0f} KiB",
+            )
+
+        await send_direct_message(ctx, msg)
+
+    @commands.command()
+    @commands.is_owner()
+    async def synccommands(self, ctx: commands.Context):
+        """Register the slash commands with discord"""
+
+        self.logger.info(f"synccommands request from user {ctx.author.display_name}")
+
+        # discord rate limits this, so it is run by hand after the slash commands change
+        synced: List[discord.app_commands.AppCommand] = await self.bot.tree.sync()
+
+        await send_direct_message(
+            ctx, embed(f"Registered {len(synced)} slash commands", title="Slash Commands", colour=Colours.GREEN)
+        )
+
     async def _get_user(self, ctx: commands.Context, user_str: str) -> Optional[discord.User]:
         match: re.Match = self._member_patt.match(user_str)
         if not match:
-            await ctx.author.send(embed=embed("Invalid member", colour=Colours.RED))
+            await send_direct_message(ctx, embed("Invalid member", colour=Colours.RED))
             return None
 
         user_id: int
         try:
             user_id = int(match.group(1))
         except ValueError:
-            await ctx.author.send(embed=embed("Invalid member ID", colour=Colours.RED))
+            await send_direct_message(ctx, embed("Invalid member ID", colour=Colours.RED))
             return None
 
         user: User = await self.bot.fetch_user(user_id)
         if not user:
-            await ctx.author.send(embed=embed("No user found with the provided ID", colour=Colours.RED))
+            await send_direct_message(ctx, embed("No user found with the provided ID", colour=Colours.RED))
             return None
 
         return user
+
+
+def _truncate(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length - 3] + "..."
@@ -1,19 +1,30 @@
 import inspect
 import datetime
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 
-from discord import Embed, Forbidden, NotFound
+from discord import Embed, Forbidden, Interaction, NotFound, app_commands
 from discord.ext import commands
 from discord.ext.commands import Bot
 
 from discord_key_bot.db import search
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 
-from discord_key_bot.common import util
+from discord_key_bot.command.pagination import PageView
+from discord_key_bot.command.util import did_you_mean, title_choices
+from discord_key_bot.common import defaults, util
+from discord_key_bot.common.singleflight import SingleFlight
 from discord_key_bot.db.models import Game, Key, Member
-from discord_key_bot.common.util import GameKeyCount, send_message, get_page_header_text, get_expiration_eod
+from discord_key_bot.common.util import (
+    GameKeyCount,
+    send_message,
+    send_direct_message,
+    get_page_header_text,
+    get_expiration_eod,
+)
 from discord_key_bot.db.queries import SortOrder
+from discord_key_bot.db.titles import TitleIndex
 from discord_key_bot.platform import Platform, get_platform
 from discord_key_bot.common.colours import Colours
 
@@ -21,10 +32,24 @@ from discord_key_bot.common.colours import Colours
 class DirectCommands(commands.Cog, name='Direct Message Commands'):
     """Run these commands in private messages to the bot"""
 
-    def __init__(self, bot: Bot, db_sessionmaker: sessionmaker, page_size: int):
+    def __init__(
+        self,
+        bot: Bot,
+        db_sessionmaker: sessionmaker,
+        page_size: int,
+        title_index: Optional[TitleIndex] = None,
+        page_timeout: float = defaults.PAGE_TIMEOUT,
+        single_flight: Optional[SingleFlight] = None,
+    ):
         self.bot: Bot = bot
         self.db_sessionmaker: sessionmaker = db_sessionmaker
         self.page_size: int = page_size
+        self.title_index: Optional[TitleIndex] = title_index
+        self.page_timeout: float = page_timeout
+        # without the bot's, reads run on the event loop as before
+        self.single_flight: SingleFlight = (
+            single_flight if single_flight is not None else SingleFlight(use_threads=False)
+        )
         self.logger = logging.getLogger(__name__)
 
     @commands.command()
@@ -58,27 +83,28 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
                 await ctx.message.delete()
             except (Forbidden, NotFound):
                 self.logger.warning("Failed to clean up improper guild message", exc_info=True)
-            await ctx.author.send(
-                embed=util.embed(
+            await send_direct_message(
+                ctx,
+                util.embed(
                     "You should really do this here, so it's only the bot giving away keys.",
                     colour=Colours.LUMINOUS_VIVID_PINK,
                 )
             )
 
         with self.db_sessionmaker() as session:
-            game: Game = Game.get(session, game_name)
-
             try:
                 platform: Platform = get_platform(platform_name)
             except ValueError:
-                await ctx.author.send(
-                    embed=util.embed(f'"{platform_name}" is not valid platform', Colours.RED),
+                await send_direct_message(
+                    ctx,
+                    util.embed(f'"{platform_name}" is not valid platform', Colours.RED),
                 )
                 return
 
             if not platform.is_valid_key(key):
-                await ctx.author.send(
-                    embed=util.embed("This key is not valid for this platform.", Colours.RED),
+                await send_direct_message(
+                    ctx,
+                    util.embed("This key is not valid for this platform.", Colours.RED),
                 )
                 return
 
@@ -89,23 +115,39 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
                 )
                 return
 
+            # looked up once the key is known to be valid, so a rejected key doesn't insert its game
+            game: Game = Game.get(session, game_name)
             member: Member = Member.get(session, ctx.author.id, ctx.author.name)
 
             game.keys.append(
                 Key(platform=platform.search_name, key=key, creator=member, game=game)
             )
 
-            session.commit()
+            try:
+                session.commit()
+            except IntegrityError:
+                # added by someone else since the check above
+                session.rollback()
+                await send_message(
+                    ctx=ctx,
+                    msg=util.embed(f"Key already exists!", Colours.GOLD),
+                )
+                return
 
-            await ctx.author.send(
-                embed=util.embed(
+            await send_direct_message(
+                ctx,
+                util.embed(
                     f'Key for "{game.pretty_name}" added. Thanks {ctx.author.name}!',
                     Colours.GREEN,
                     title=f"{platform.name} Key Added",
                 )
             )
 
-    @commands.command()
+    @commands.hybrid_command()
+    @app_commands.describe(
+        platform_name="The platform of the game you wish to remove",
+        game_name="The name of the game you wish to remove",
+    )
     async def remove(
         self,
         ctx: commands.Context,
@@ -139,15 +181,16 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
             return
 
         with self.db_sessionmaker() as session:
-            member: Member = Member.get(session, ctx.author.id, ctx.author.name)
-
             game: Game = search.get_game(session=session, game_name=game_name)
             if not game:
-                await send_message(ctx=ctx, msg=util.embed("Game not found"))
+                suggestions: List[str] = (
+                    self.title_index.suggest_for_member(ctx.author.id, game_name) if self.title_index else []
+                )
+                await send_message(ctx=ctx, msg=util.embed(did_you_mean("Game not found", suggestions)))
                 return
 
             try:
-                key: Key = game.find_key(platform, member.id)
+                key: Key = game.find_key(platform, ctx.author.id)
             except ValueError:
                 await send_message(ctx=ctx, msg=util.embed("No keys found for this platform"))
                 return
@@ -159,15 +202,21 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
             msg.add_field(name=game.pretty_name, value=key.key)
 
             session.delete(key)
-            session.refresh(game)
             session.flush()
 
-            if not game.keys:
+            if not game.key_count:
                 session.delete(game)
 
             session.commit()
 
-        await ctx.author.send(embed=msg)
+        await send_direct_message(ctx, msg)
+
+    @remove.autocomplete("game_name")
+    async def complete_game_name(self, interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
+        if not self.title_index:
+            return []
+
+        return title_choices(self.title_index.for_member(interaction.user.id).complete(current))
 
     @commands.command()
     async def mykeys(
@@ -183,31 +232,42 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
     ) -> None:
         """Browse your own keys"""
         if ctx.guild:
-            await ctx.author.send(
-                embed=util.embed(f"This command needs to be sent in a direct message")
+            await send_direct_message(
+                ctx,
+                util.embed(f"This command needs to be sent in a direct message")
             )
             return
 
-        with self.db_sessionmaker() as session:
-            member = Member.get(session, ctx.author.id, ctx.author.name)
-
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                page=page,
-                per_page=self.page_size,
-                member_id=member.id,
-                sort=SortOrder.TITLE,
-            )
+        member_id: int = ctx.author.id
 
-            total: int = search.count_games(session=session, member_id=member.id)
+        async def fetch(window: int, per_page: int) -> Tuple[List[GameKeyCount], int]:
+            def read() -> Tuple[List[GameKeyCount], int]:
+                with self.db_sessionmaker() as session:
+                    games: List[GameKeyCount] = search.get_paginated_games(
+                        session=session,
+                        page=window,
+                        per_page=per_page,
+                        member_id=member_id,
+                        sort=SortOrder.TITLE,
+                    )
 
-        msg: Embed = util.build_page_message(
-            title="Your Keys",
-            text=get_page_header_text(page, total, self.page_size),
-            games=games,
-        )
+                    total: int = search.count_games(session=session, member_id=member_id)
+
+                return games, total
+
+            return await self.single_flight.do(("mykeys", member_id, window, per_page), read)
 
-        await send_message(ctx=ctx, msg=msg)
+        def render(page: int, total: int, games: List[GameKeyCount]) -> Embed:
+            return util.build_page_message(
+                title="Your Keys",
+                text=get_page_header_text(page, total, self.page_size),
+                games=games,
+            )
+
+        view: PageView = PageView(
+            ctx.author.id, fetch=fetch, render=render, page_size=self.page_size, timeout=self.page_timeout
+        )
+        await view.send(ctx, page)
 
     @commands.command()
     async def expiration(
@@ -234,8 +294,9 @@ class DirectCommands(commands.Cog, name='Direct Message Commands'):
                 await ctx.message.delete()
             except (Forbidden, NotFound):
                 pass
-            await ctx.author.send(
-                embed=util.embed(
+            await send_direct_message(
+                ctx,
+                util.embed(
                     "You should really do this here, so it's only the bot giving away keys.",
                     colour=Colours.LUMINOUS_VIVID_PINK,
                 )
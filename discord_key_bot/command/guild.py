@@ -2,17 +2,25 @@ import csv
 import inspect
 import datetime
 import io
+import logging
 
-from discord import Embed, File
+from discord import Embed, File, Interaction, app_commands
 from discord.ext import commands
 from discord.ext.commands import Bot
 from sqlalchemy.orm import sessionmaker
-from typing import List, Optional
-
-from discord_key_bot.common import util
-from discord_key_bot.db import search
-from discord_key_bot.db.models import Member, Key, Game
+from typing import FrozenSet, Hashable, List, Optional, Set, Tuple
+
+from discord_key_bot.command.pagination import PageView, RenderPage
+from discord_key_bot.command.util import did_you_mean, title_choices
+from discord_key_bot.common import defaults, util
+from discord_key_bot.common.outbox import ClaimDelivery, ClaimOutbox
+from discord_key_bot.common.singleflight import SingleFlight
+from discord_key_bot.db import search, claims
+from discord_key_bot.db.models import Member, Key, Game, Guild
 from discord_key_bot.db.queries import SortOrder
+from discord_key_bot.db.shares import ShareIndex
+from discord_key_bot.db.snapshot import GuildInventory, InventorySnapshot
+from discord_key_bot.db.titles import TitleIndex
 from discord_key_bot.platform import all_platforms, get_platform, Platform
 from discord_key_bot.common.util import GameKeyCount, send_message, get_page_header_text
 from discord_key_bot.common.colours import Colours
@@ -26,14 +34,38 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
         wait_time: datetime.timedelta,
         page_size: int,
         expiration_waiver_period: datetime.timedelta,
+        share_index: ShareIndex,
+        inventory_snapshot: Optional[InventorySnapshot] = None,
+        title_index: Optional[TitleIndex] = None,
+        page_timeout: float = defaults.PAGE_TIMEOUT,
+        single_flight: Optional[SingleFlight] = None,
+        claim_outbox: Optional[ClaimOutbox] = None,
     ):
         self.bot: Bot = bot
         self.wait_time: datetime.timedelta = wait_time
         self.db_sessionmaker: sessionmaker = db_sessionmaker
         self.page_size: int = page_size
         self.expiration_waiver_period: datetime.timedelta = expiration_waiver_period
+        self.share_index: ShareIndex = share_index
+        self.inventory_snapshot: Optional[InventorySnapshot] = inventory_snapshot
+        self.title_index: Optional[TitleIndex] = title_index
+        self.page_timeout: float = page_timeout
+        # without the bot's, reads run on the event loop as before
+        self.single_flight: SingleFlight = (
+            single_flight if single_flight is not None else SingleFlight(use_threads=False)
+        )
+        self.claim_outbox: ClaimOutbox = (
+            claim_outbox if claim_outbox is not None else ClaimOutbox(db_sessionmaker, bot.message_dispatcher)
+        )
+        self.logger: logging.Logger = logging.getLogger(__name__)
 
-    @commands.command()
+    async def cog_load(self) -> None:
+        # reservations a stopped process left behind, the outbox's sweep releases any later ones
+        self.claim_outbox.release_stale()
+
+    @commands.hybrid_command()
+    @app_commands.guild_only()
+    @app_commands.describe(game_name="The name of the game you wish to search for")
     async def search(
         self,
         ctx: commands.Context,
@@ -52,15 +84,21 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
                 session=session,
                 title=game_name,
                 guild_id=ctx.guild.id,
+                creator_ids=self.share_index.members(ctx.guild.id),
                 per_page=self.page_size,
                 sort=SortOrder.TITLE,
             )
 
-        msg = util.build_page_message(
-            title="Search Results",
-            text=f"Top {self.page_size} search results...",
-            games=games
-        )
+        if games:
+            msg = util.build_page_message(
+                title="Search Results",
+                text=f"Top {self.page_size} search results...",
+                games=games
+            )
+        else:
+            msg = util.embed(
+                did_you_mean("No matching games found", self._suggest(ctx, game_name)), title="Search Results"
+            )
 
         await send_message(ctx=ctx, msg=msg)
 
@@ -112,30 +150,19 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
             )
             return
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                platform=platform,
-                guild_id=ctx.guild.id,
-                per_page=self.page_size,
-                page=page,
-                sort=SortOrder.TITLE,
-            )
-
-            total: int = search.count_games(
-                session=session, guild_id=ctx.guild.id, platform=platform
+        def render(page: int, total: int, games: List[GameKeyCount]) -> Embed:
+            msg = util.embed(
+                get_page_header_text(page, total, self.page_size),
+                title=f"Browse Games available for {platform.name}",
             )
 
-        msg = util.embed(
-            get_page_header_text(page, total, self.page_size),
-            title=f"Browse Games available for {platform.name}",
-        )
+            for game in games:
+                value = f"Keys available: {game.platforms[0].count}"
+                msg.add_field(name=game.name, value=value, inline=True)
 
-        for game in games:
-            value = f"Keys available: {game.platforms[0].count}"
-            msg.add_field(name=game.name, value=value, inline=True)
+            return msg
 
-        await send_message(ctx=ctx, msg=msg)
+        await self._page_view(ctx, render, sort=SortOrder.TITLE, platform=platform).send(ctx, page)
 
     @commands.command()
     async def browse(
@@ -151,24 +178,14 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
     ) -> None:
         """Browse through available games"""
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                page=page,
-                per_page=self.page_size,
-                sort=SortOrder.TITLE,
+        def render(page: int, total: int, games: List[GameKeyCount]) -> Embed:
+            return util.build_page_message(
+                title="Browse Games",
+                text=get_page_header_text(page, total, self.page_size),
+                games=games,
             )
 
-            total: int = search.count_games(session=session, guild_id=ctx.guild.id)
-
-        msg: Embed = util.build_page_message(
-            title="Browse Games",
-            text=get_page_header_text(page, total, self.page_size),
-            games=games,
-        )
-
-        await send_message(ctx=ctx, msg=msg)
+        await self._page_view(ctx, render, sort=SortOrder.TITLE).send(ctx, page)
 
     @commands.command()
     async def latest(
@@ -184,38 +201,20 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
     ) -> None:
         """Browse through available games by date added in descending order"""
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                page=page,
-                per_page=self.page_size,
-                sort=SortOrder.LATEST,
+        def render(page: int, total: int, games: List[GameKeyCount]) -> Embed:
+            return util.build_page_message(
+                title="Latest Games",
+                text=get_page_header_text(page, total, self.page_size),
+                games=games,
             )
 
-            total: int = search.count_games(session=session, guild_id=ctx.guild.id)
-
-        msg: Embed = util.build_page_message(
-            title="Latest Games",
-            text=get_page_header_text(page, total, self.page_size),
-            games=games,
-        )
-
-        await send_message(ctx=ctx, msg=msg)
+        await self._page_view(ctx, render, sort=SortOrder.LATEST).send(ctx, page)
 
     @commands.command()
     async def random(self, ctx: commands.Context) -> None:
         """Display random available games"""
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                per_page=self.page_size,
-                sort=SortOrder.RANDOM,
-            )
-
-            total: int = search.count_games(session=session, guild_id=ctx.guild.id)
+        games, total = await self._inventory(ctx, sort=SortOrder.RANDOM)
 
         msg = util.embed(
             f"Showing {min(self.page_size, total)} random games of {total} total",
@@ -231,56 +230,65 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
     async def share(self, ctx: commands.Context) -> None:
         """Share your keys with this guild"""
 
+        if self.share_index.is_sharing(ctx.guild.id, ctx.author.id):
+            await send_message(
+                ctx=ctx,
+                msg=util.embed(f"You are already sharing with {ctx.guild.name}", colour=Colours.GOLD)
+            )
+            return
+
         with self.db_sessionmaker() as session:
-            member: Member = Member.get(session, ctx.author.id, ctx.author.name)
-            if ctx.guild.id in member.guilds:
-                await send_message(
-                    ctx=ctx,
-                    msg=util.embed(f"You are already sharing with {ctx.guild.name}", colour=Colours.GOLD)
-                )
-            else:
-                member.guilds.append(ctx.guild.id)
-                game_count: int = search.count_games(
-                    session=session, guild_id=ctx.guild.id
-                )
-                session.commit()
-                await send_message(
-                    ctx=ctx,
-                    msg=util.embed(
-                        f"Thanks {ctx.author.name}! Your keys are now available on {ctx.guild.name}. " +
-                        f" There are now {game_count} games available.",
-                        colour=Colours.GREEN,
-                    )
-                )
+            Member.get(session, ctx.author.id, ctx.author.name)
+            session.add(Guild(guild_id=ctx.guild.id, member_id=ctx.author.id))
+            session.commit()
+
+        # the share index and the snapshot have picked up the share on commit
+        game_count: int = self._count_games(ctx)
+
+        await send_message(
+            ctx=ctx,
+            msg=util.embed(
+                f"Thanks {ctx.author.name}! Your keys are now available on {ctx.guild.name}. " +
+                f" There are now {game_count} games available.",
+                colour=Colours.GREEN,
+            )
+        )
 
     @commands.command()
     async def unshare(self, ctx: commands.Context) -> None:
         """Remove this guild from the guilds you share keys with"""
+        if not self.share_index.is_sharing(ctx.guild.id, ctx.author.id):
+            await send_message(
+                ctx=ctx,
+                msg=util.embed(
+                    f"You aren't currently sharing with {ctx.guild.name}",
+                    colour=Colours.GOLD,
+                ),
+            )
+            return
+
         with self.db_sessionmaker() as session:
-            member: Member = Member.get(session, ctx.author.id, ctx.author.name)
+            for share in session.query(Guild).filter(Guild.guild_id == ctx.guild.id, Guild.member_id == ctx.author.id):
+                session.delete(share)
+            session.commit()
 
-            if ctx.guild.id not in member.guilds:
-                await send_message(
-                    ctx=ctx,
-                    msg=util.embed(
-                        f"You aren't currently sharing with {ctx.guild.name}",
-                        colour=Colours.GOLD,
-                    ),
-                )
-            else:
-                member.guilds.remove(ctx.guild.id)
-                game_count: int = search.count_games(session=session, guild_id=ctx.guild.id)
-                session.commit()
-                await send_message(
-                    ctx=ctx,
-                    msg=util.embed(
-                        f"Thanks {ctx.author.name}! You have removed {ctx.guild.name} from sharing. " +
-                        f"There are now {game_count} games available.",
-                        colour=Colours.GREEN,
-                    ),
-                )
+        game_count: int = self._count_games(ctx)
 
-    @commands.command()
+        await send_message(
+            ctx=ctx,
+            msg=util.embed(
+                f"Thanks {ctx.author.name}! You have removed {ctx.guild.name} from sharing. " +
+                f"There are now {game_count} games available.",
+                colour=Colours.GREEN,
+            ),
+        )
+
+    @commands.hybrid_command()
+    @app_commands.guild_only()
+    @app_commands.describe(
+        platform_name="The platform you wish to claim a key for (e.g. Steam)",
+        game_name="The name of the game you wish to claim a key for",
+    )
     async def claim(
         self,
         ctx: commands.Context,
@@ -316,70 +324,101 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
                 return
 
             game: Optional[Game] = search.get_game(
-                session, game_name, ctx.guild.id
+                session, game_name, ctx.guild.id, creator_ids=self.share_index.members(ctx.guild.id)
             )
 
             if not game:
-                await send_message(ctx=ctx, msg=util.embed("Game not found"))
-                return
-
-            try:
-                key: Key = game.find_key(platform)
-            except ValueError:
-                await send_message(ctx=ctx, msg=util.embed("No keys found for the specified platform"))
+                suggestions: List[str] = self._suggest(ctx, game_name)
+                await send_message(ctx=ctx, msg=util.embed(did_you_mean("Game not found", suggestions)))
                 return
 
-            is_waiver_claim: bool = self._is_in_waiver_period(key)
-
-            timeleft = self._get_cooldown(member)
-            if not is_waiver_claim and timeleft.total_seconds() > 0:
-                await send_message(
-                    ctx=ctx,
-                    msg=util.embed(
-                        f"You must wait {util.pretty_timedelta(timeleft)} until your next claim",
-                        colour=Colours.RED,
-                        title="Failed to claim",
-                    ),
-                )
-                return
+            # keys reserved by another claim since the game was read
+            skipped: Set[int] = set()
+            while True:
+                try:
+                    key: Key = game.find_key(platform, skipped=skipped)
+                except ValueError:
+                    await send_message(ctx=ctx, msg=util.embed("No keys found for the specified platform"))
+                    return
+
+                is_waiver_claim: bool = self._is_in_waiver_period(key)
+
+                timeleft = self._get_cooldown(member)
+                if not is_waiver_claim and timeleft.total_seconds() > 0:
+                    await send_message(
+                        ctx=ctx,
+                        msg=util.embed(
+                            f"You must wait {util.pretty_timedelta(timeleft)} until your next claim",
+                            colour=Colours.RED,
+                            title="Failed to claim",
+                        ),
+                    )
+                    return
 
-            session.delete(key)
-            session.refresh(game)
+                if claims.reserve_key(session, key, member):
+                    break
+                skipped.add(key.id)
 
-            if not game.keys:
-                session.delete(game)
+            previous_claim: Optional[datetime.datetime] = member.last_claim
+            applies_cooldown: bool = key.creator_id != member.id and not is_waiver_claim
 
-            if key.creator_id != member.id and not is_waiver_claim:
+            # release the write lock before talking to discord
+            if applies_cooldown:
                 member.last_claim = datetime.datetime.now(datetime.UTC)
             session.commit()
 
+            key_id: int = key.id
+            game_name: str = game.pretty_name
+
             claim_msg: Embed = util.embed(
                 f"Please find your key below", title="Game claimed!", colour=Colours.GREEN
             )
 
-            claim_msg.add_field(name=game.pretty_name, value=key.key)
+            claim_msg.add_field(name=game_name, value=key.key)
 
-            if is_waiver_claim:
-                channel_msg: Embed = util.embed(
-                    f'Thanks for adopting "{game.pretty_name}" before it expires, {ctx.author.display_name}! ' +
-                    'There is no cooldown for claiming this key.'
-                )
-            else:
-                channel_msg: Embed = util.embed(
-                    f'"{game.pretty_name}" claimed by {ctx.author.display_name}. Check your PMs for more info. Enjoy!'
-                )
+        async def on_delivered(delivered: bool) -> None:
+            await self._announce_claim(ctx, game_name, delivered, is_waiver_claim)
 
-            try:
-                await ctx.author.send(embed=claim_msg)
-            except Exception as e:
-                session.rollback()
-                raise e
+        # the outbox sends the key and completes the claim, or releases the key if it can't be delivered
+        self.claim_outbox.submit(
+            ClaimDelivery(key_id, ctx.guild.id, ctx.author, claim_msg, previous_claim, applies_cooldown), on_delivered
+        )
 
+    async def _announce_claim(
+        self, ctx: commands.Context, game_name: str, delivered: bool, is_waiver_claim: bool
+    ) -> None:
+        if not delivered:
             await send_message(
                 ctx=ctx,
-                msg=channel_msg,
+                msg=util.embed(
+                    f"I couldn't send you a direct message, {ctx.author.display_name}. " +
+                    "Check your privacy settings and try again.",
+                    colour=Colours.RED,
+                    title="Failed to claim",
+                ),
+            )
+            return
+
+        if is_waiver_claim:
+            channel_text: str = (
+                f'Thanks for adopting "{game_name}" before it expires, {ctx.author.display_name}! ' +
+                'There is no cooldown for claiming this key.'
+            )
+        else:
+            channel_text: str = (
+                f'"{game_name}" claimed by {ctx.author.display_name}. Check your PMs for more info. Enjoy!'
             )
 
+        await util.send_announcement(ctx=ctx, topic="games claimed", text=channel_text)
+
+    @search.autocomplete("game_name")
+    @claim.autocomplete("game_name")
+    async def complete_game_name(self, interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
+        if not self.title_index or not interaction.guild_id:
+            return []
+
+        return title_choices(self.title_index.for_guild(interaction.guild_id).complete(current))
+
     @commands.command()
     async def imfeelinglucky(
             self,
@@ -406,16 +445,7 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
             )
             return
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                platform=platform,
-                per_page=1,
-                sort=SortOrder.RANDOM,
-            )
-
-            total: int = search.count_games(session=session, guild_id=ctx.guild.id, platform=platform)
+        games, total = await self._inventory(ctx, sort=SortOrder.RANDOM, platform=platform, per_page=1)
 
         msg = util.embed(
             f"Showing one random game of {total} total",
@@ -444,25 +474,9 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
     ) -> None:
         """Keys expiring soon"""
 
-        count: int
-
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                per_page=self.page_size,
-                page=page,
-                sort=SortOrder.EXPIRATION,
-                expiring_only=True,
-            )
-
-            total: int = search.count_games(
-                session=session, guild_id=ctx.guild.id, expiring_only=True
-            )
-
+        def render(page: int, total: int, games: List[GameKeyCount]) -> Embed:
             if not games:
-                await send_message(ctx=ctx, msg=util.embed("No keys found"))
-                return
+                return util.embed("No keys found")
 
             msg: Embed = util.embed(title="Expiring Keys",
                                     text=get_page_header_text(page, total, self.page_size, "keys"))
@@ -470,8 +484,51 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
             for game in games:
                 msg.add_field(name=game.name, value=game.platforms_string())
 
+            return msg
+
+        await self._page_view(ctx, render, sort=SortOrder.EXPIRATION, expiring_only=True).send(ctx, page)
+
+    @commands.command()
+    async def stats(self, ctx: commands.Context) -> None:
+        """Keys claimed in this guild"""
+
+        with self.db_sessionmaker() as session:
+            claim_stats: claims.ClaimStats = claims.guild_stats(
+                session, ctx.guild.id, datetime.datetime.now(datetime.UTC).date()
+            )
+            donated: int = claims.donor_claims(session, ctx.guild.id, ctx.author.id)
+
+        msg: Embed = util.embed(f"Keys claimed on {ctx.guild.name}", title="Claim Stats")
+        msg.add_field(name="Today", value=str(claim_stats.today))
+        msg.add_field(name="Last 7 days", value=str(claim_stats.week))
+        msg.add_field(name="Last 30 days", value=str(claim_stats.month))
+        msg.add_field(name="All time", value=str(claim_stats.total))
+        msg.add_field(name="Your keys", value=f"{donated} claimed here", inline=False)
+
         await send_message(ctx=ctx, msg=msg)
 
+    @commands.command()
+    async def leaderboard(self, ctx: commands.Context) -> None:
+        """Members whose keys were claimed most in this guild"""
+
+        with self.db_sessionmaker() as session:
+            donors: List[claims.Donor] = claims.top_donors(session, ctx.guild.id, self.page_size)
+
+        if not donors:
+            await send_message(ctx=ctx, msg=util.embed("No keys have been claimed here yet"))
+            return
+
+        await send_message(
+            ctx=ctx,
+            msg=util.embed(
+                "\n".join(
+                    f"{rank}. {donor.name or donor.member_id}: {donor.claims} claimed"
+                    for rank, donor in enumerate(donors, 1)
+                ),
+                title="Top Donors",
+            ),
+        )
+
     @commands.command()
     async def export(
         self,
@@ -479,17 +536,7 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
     ) -> None:
         """Export key counts"""
 
-        with self.db_sessionmaker() as session:
-            games: List[GameKeyCount] = search.get_paginated_games(
-                session=session,
-                guild_id=ctx.guild.id,
-                per_page=-1,
-                sort=SortOrder.TITLE,
-            )
-
-            total: int = search.count_games(
-                session=session, guild_id=ctx.guild.id, expiring_only=False
-            )
+        games, total = await self._inventory(ctx, sort=SortOrder.TITLE, per_page=-1)
 
         f: io.StringIO = io.StringIO()
         writer: csv.writer = csv.writer(f, dialect="excel")
@@ -502,10 +549,102 @@ class GuildCommands(commands.Cog, name='Channel Commands'):
         b: io.BytesIO = io.BytesIO(f.getvalue().encode('utf8'))
         f.close()
 
+        # the dispatcher sends it later, so the buffer stays open until the upload has read it
         csvfile: File = File(b, filename="key_count_export.csv")
 
-        await ctx.send(f"Exported key counts for {total} games", file=csvfile)
-        b.close()
+        await send_message(ctx, f"Exported key counts for {total} games", file=csvfile)
+
+    async def _inventory(
+        self,
+        ctx: commands.Context,
+        sort: SortOrder,
+        platform: Optional[Platform] = None,
+        page: int = 1,
+        per_page: int = 0,
+        expiring_only: bool = False,
+    ) -> Tuple[List[GameKeyCount], int]:
+        """A page of the games available on this guild and their total, from the snapshot when it serves the guild"""
+
+        per_page = per_page or self.page_size
+
+        if self.inventory_snapshot and self.inventory_snapshot.serves(ctx.guild.id):
+            inventory: GuildInventory = self.inventory_snapshot.get(ctx.guild.id)
+            return (
+                inventory.get_paginated_games(
+                    platform=platform, page=page, per_page=per_page, sort=sort, expiring_only=expiring_only
+                ),
+                inventory.count_games(platform=platform, expiring_only=expiring_only),
+            )
+
+        guild_id: int = ctx.guild.id
+        creator_ids: FrozenSet[int] = self.share_index.members(guild_id)
+
+        def read() -> Tuple[List[GameKeyCount], int]:
+            with self.db_sessionmaker() as session:
+                games: List[GameKeyCount] = search.get_paginated_games(
+                    session=session,
+                    guild_id=guild_id,
+                    creator_ids=creator_ids,
+                    platform=platform,
+                    page=page,
+                    per_page=per_page,
+                    sort=sort,
+                    expiring_only=expiring_only,
+                )
+
+                total: int = search.count_games(
+                    session=session,
+                    guild_id=guild_id,
+                    creator_ids=creator_ids,
+                    platform=platform,
+                    expiring_only=expiring_only,
+                )
+
+            return games, total
+
+        if sort == SortOrder.RANDOM:
+            # members asking at the same time still expect their own draw
+            return read()
+
+        # guilds sharing the same members see the same keys
+        key: Hashable = (
+            "inventory", creator_ids, sort, platform.name if platform else "", page, per_page, expiring_only
+        )
+        return await self.single_flight.do(key, read)
+
+    def _page_view(
+        self,
+        ctx: commands.Context,
+        render: RenderPage,
+        sort: SortOrder,
+        platform: Optional[Platform] = None,
+        expiring_only: bool = False,
+    ) -> PageView:
+        """Buttons paging through `_inventory`, a window of pages at a time"""
+
+        return PageView(
+            ctx.author.id,
+            fetch=lambda window, per_page: self._inventory(
+                ctx, sort=sort, platform=platform, page=window, per_page=per_page, expiring_only=expiring_only
+            ),
+            render=render,
+            page_size=self.page_size,
+            timeout=self.page_timeout,
+        )
+
+    def _count_games(self, ctx: commands.Context) -> int:
+        if self.inventory_snapshot and self.inventory_snapshot.serves(ctx.guild.id):
+            return self.inventory_snapshot.get(ctx.guild.id).count_games()
+
+        creator_ids: FrozenSet[int] = self.share_index.members(ctx.guild.id)
+        with self.db_sessionmaker() as session:
+            return search.count_games(session=session, guild_id=ctx.guild.id, creator_ids=creator_ids)
+
+    def _suggest(self, ctx: commands.Context, game_name: str) -> List[str]:
+        if not self.title_index:
+            return []
+
+        return self.title_index.suggest_for_guild(ctx.guild.id, game_name)
 
     def _get_cooldown(self, member: Member) -> datetime.timedelta:
         if member.last_claim:
@@ -0,0 +1,113 @@
+"""
+Previous and next buttons under a paged command's reply.
+
+The command fetches a window of several pages in one query batch, and the buttons page through that window by
+editing the message in place. Only leaving the window runs another batch. The buttons are removed once nobody has
+pressed them for the timeout, which also ends the cached window.
+"""
+
+import asyncio
+import logging
+from math import ceil
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+from discord_key_bot.common import defaults, metrics
+from discord_key_bot.common.util import GameKeyCount, send_message
+
+# (window number from 1, games per window) -> the window's games and the total
+FetchWindow = Callable[[int, int], Awaitable[Tuple[List[GameKeyCount], int]]]
+
+# (page, total, the page's games) -> the message showing it
+RenderPage = Callable[[int, int, List[GameKeyCount]], discord.Embed]
+
+
+class PageView(discord.ui.View):
+    def __init__(
+        self,
+        author_id: int,
+        fetch: FetchWindow,
+        render: RenderPage,
+        page_size: int,
+        prefetch_pages: int = defaults.PAGE_PREFETCH,
+        timeout: float = defaults.PAGE_TIMEOUT,
+    ) -> None:
+        super().__init__(timeout=timeout)
+        self.author_id: int = author_id
+        self.fetch: FetchWindow = fetch
+        self.render: RenderPage = render
+        self.page_size: int = page_size
+        self.prefetch_pages: int = prefetch_pages
+        self.page: int = 1
+        self.total: int = 0
+        self.message: Optional[discord.Message] = None
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        self._window_number: int = 0
+        self._window: List[GameKeyCount] = []
+
+    @property
+    def pages(self) -> int:
+        return ceil(self.total / self.page_size)
+
+    async def show(self, page: int) -> discord.Embed:
+        """Move to `page`, fetching its window unless it is already held"""
+
+        # `!browse 0` and below show the first page
+        page = max(page, 1)
+        window_number: int = (page - 1) // self.prefetch_pages + 1
+        metrics.record_cache_hit("page_window", window_number == self._window_number)
+        if window_number != self._window_number:
+            self._window, self.total = await self.fetch(window_number, self.page_size * self.prefetch_pages)
+            self._window_number = window_number
+
+        self.page = page
+        self.previous_page.disabled = page <= 1
+        self.next_page.disabled = page >= self.pages
+
+        start: int = (page - 1) % self.prefetch_pages * self.page_size
+        return self.render(page, self.total, self._window[start:start + self.page_size])
+
+    async def send(self, ctx: commands.Context, page: int) -> None:
+        """Reply with `page`, with buttons when there are other pages to go to"""
+
+        msg: discord.Embed = await self.show(page)
+        if self.previous_page.disabled and self.next_page.disabled:
+            self.stop()
+            await send_message(ctx=ctx, msg=msg)
+            return
+
+        delivery: asyncio.Future = await send_message(ctx=ctx, msg=msg, view=self)
+        delivery.add_done_callback(self._delivered)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.author_id:
+            return True
+
+        await interaction.response.send_message("Run the command yourself to page through it.", ephemeral=True)
+        return False
+
+    async def on_timeout(self) -> None:
+        if not self.message:
+            return
+
+        try:
+            await self.message.edit(view=None)
+        except discord.HTTPException:
+            self.logger.debug("Unable to remove the page buttons", exc_info=True)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        await interaction.response.edit_message(embed=await self.show(self.page - 1), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        await interaction.response.edit_message(embed=await self.show(self.page + 1), view=self)
+
+    def _delivered(self, delivery: asyncio.Future) -> None:
+        self.message = delivery.result()
+        if self.message is None:
+            # never sent, nothing will press the buttons
+            self.stop()
@@ -1,5 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 
+from discord import app_commands
 from discord.ext import commands
 from sqlalchemy.orm import Session
 
@@ -22,3 +23,20 @@ async def is_owner(session: Session, ctx: commands.Context) -> bool:
     member: Optional[Member] = session.query(Member).filter(Member.id == ctx.author.id).first()
 
     return member and member.is_owner
+
+
+# the longest name and value of an application command choice
+_MAX_CHOICE_LENGTH: int = 100
+
+
+def title_choices(titles: List[str]) -> List[app_commands.Choice[str]]:
+    # a longer title can't be offered, it can still be typed out
+    return [app_commands.Choice(name=title, value=title) for title in titles if len(title) <= _MAX_CHOICE_LENGTH]
+
+
+def did_you_mean(text: str, suggestions: List[str]) -> str:
+    if not suggestions:
+        return text
+
+    quoted: str = " or ".join(f'"{title}"' for title in suggestions)
+    return f"{text}. Did you mean {quoted}?"
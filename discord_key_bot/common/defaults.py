@@ -4,3 +4,20 @@ BANG: str = "!"
 CLAIM_COOLDOWN: int = 86400
 SQLALCHEMY_URI: str = "sqlite:///:memory:"
 EXPIRATION_WAIVER_PERIOD: int = 604800
+MESSAGE_QUEUE_SIZE: int = 50
+ANNOUNCEMENT_WINDOW: float = 10.0
+METRICS_PORT: int = 0
+METRICS_HOST: str = "127.0.0.1"
+SLOW_QUERY_THRESHOLD_MS: int = 100
+SHARD_COUNT: int = 0
+SHARD_IDS: str = ""
+CACHE_SYNC_INTERVAL: float = 5.0
+SNAPSHOT_GUILDS: str = ""
+PAGE_PREFETCH: int = 5
+PAGE_TIMEOUT: float = 180.0
+RATE_LIMIT_CAPACITY: float = 10.0
+RATE_LIMIT_REFILL_RATE: float = 0.2
+RATE_LIMIT_COSTS: str = "export=5,random=3,imfeelinglucky=3,search=2,browse=2,latest=2,platform=2,expiring=2"
+EXPIRY_ANNOUNCEMENTS: bool = True
+ARCHIVE_AFTER_DAYS: int = 365
+ARCHIVE_UNSHARED_AFTER_DAYS: int = 30
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import typing
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
+
+import discord
+
+from discord_key_bot.common import metrics
+from discord_key_bot.common.util import RETRIES, embed
+
+MessageContent = Union[str, discord.Embed]
+
+# discord embeds cap descriptions at 4096 characters
+_MAX_SUMMARY_LENGTH: int = 4000
+
+
+class DispatcherStats(typing.NamedTuple):
+    queued: int
+    max_queued: int
+    destinations: int
+    sent: int
+    retried: int
+    failed: int
+    coalesced: int
+    blocked: int
+
+
+class _Outbound(typing.NamedTuple):
+    kind: str
+    destination: discord.abc.Messageable
+    msg: MessageContent
+    result: asyncio.Future
+    view: Optional[discord.ui.View] = None
+    file: Optional[discord.File] = None
+
+
+class MessageDispatcher(object):
+    """Delivers outbound messages through per-channel and per-user queues
+
+    Each destination gets its own bounded queue drained by a worker task, so a slow or rate limited
+    destination never holds up a command handler or any other destination. Enqueueing blocks once a
+    destination's queue is full, which pushes back on whoever is flooding it. Messages go out as fast
+    as discord.py sends them, a destination's worker only waits after discord refused a message.
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        announcement_window: float,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.queue_size: int = queue_size
+        self.announcement_window: float = announcement_window
+        self.retry_delay: float = retry_delay
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        self._queues: Dict[Hashable, asyncio.Queue] = {}
+        self._announcements: Dict[Tuple[int, str], List[str]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._max_queued: int = 0
+        self._sent: int = 0
+        self._retried: int = 0
+        self._failed: int = 0
+        self._coalesced: int = 0
+        self._blocked: int = 0
+
+    async def send_to_user(
+        self,
+        user: discord.abc.User,
+        msg: MessageContent,
+        view: Optional[discord.ui.View] = None,
+        file: Optional[discord.File] = None,
+    ) -> asyncio.Future:
+        return await self._enqueue(("user", user.id), "user", user, msg, view, file)
+
+    async def send_to_channel(
+        self,
+        channel: discord.abc.Messageable,
+        msg: MessageContent,
+        view: Optional[discord.ui.View] = None,
+        file: Optional[discord.File] = None,
+    ) -> asyncio.Future:
+        return await self._enqueue(("channel", channel.id), "channel", channel, msg, view, file)
+
+    async def announce(self, channel: discord.abc.Messageable, topic: str, text: str) -> None:
+        """Send a channel announcement, coalescing any more on the same topic within the announcement window"""
+
+        if self.announcement_window <= 0:
+            await self.send_to_channel(channel, embed(text))
+            return
+
+        key: Tuple[int, str] = (channel.id, topic)
+        pending: Optional[List[str]] = self._announcements.get(key)
+        if pending is not None:
+            pending.append(text)
+            self._coalesced += 1
+            metrics.OUTBOUND_MESSAGES.inc(result="coalesced")
+            return
+
+        self._announcements[key] = []
+        self._spawn(self._close_announcement_window(key, channel, topic))
+        await self.send_to_channel(channel, embed(text))
+
+    def stats(self) -> DispatcherStats:
+        return DispatcherStats(
+            queued=sum(queue.qsize() for queue in self._queues.values()),
+            max_queued=self._max_queued,
+            destinations=len(self._queues),
+            sent=self._sent,
+            retried=self._retried,
+            failed=self._failed,
+            coalesced=self._coalesced,
+            blocked=self._blocked,
+        )
+
+    async def _enqueue(
+        self,
+        key: Hashable,
+        kind: str,
+        destination: discord.abc.Messageable,
+        msg: MessageContent,
+        view: Optional[discord.ui.View] = None,
+        file: Optional[discord.File] = None,
+    ) -> asyncio.Future:
+        queue: Optional[asyncio.Queue] = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[key] = queue
+            self._spawn(self._work(key, queue))
+
+        if queue.full():
+            self._blocked += 1
+            metrics.OUTBOUND_MESSAGES.inc(result="blocked")
+            self.logger.debug(f"Outbound queue for {key} is full, waiting for it to drain")
+
+        result: asyncio.Future = asyncio.get_running_loop().create_future()
+        await queue.put(_Outbound(kind, destination, msg, result, view, file))
+        self._max_queued = max(self._max_queued, queue.qsize())
+        metrics.OUTBOUND_QUEUE_DEPTH.inc()
+
+        return result
+
+    async def _work(self, key: Hashable, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            outbound: _Outbound = queue.get_nowait()
+            metrics.OUTBOUND_QUEUE_DEPTH.dec()
+            message: Optional[discord.Message] = await self._deliver(outbound)
+            if not outbound.result.done():
+                outbound.result.set_result(message)
+
+        del self._queues[key]
+
+    async def _deliver(self, outbound: _Outbound) -> Optional[discord.Message]:
+        for attempt in range(1, RETRIES + 1):
+            if attempt > 1 and outbound.file is not None:
+                # the failed attempt read the file
+                outbound.file.reset()
+
+            try:
+                with metrics.DISCORD_SEND_DURATION.time(destination=outbound.kind):
+                    if isinstance(outbound.msg, str):
+                        message: discord.Message = await outbound.destination.send(
+                            outbound.msg, view=outbound.view, file=outbound.file
+                        )
+                    else:
+                        message: discord.Message = await outbound.destination.send(
+                            embed=outbound.msg, view=outbound.view, file=outbound.file
+                        )
+            except (discord.Forbidden, discord.NotFound):
+                self.logger.warning(f"Unable to deliver message to {outbound.destination}", exc_info=True)
+                break
+            except (discord.HTTPException, discord.RateLimited) as e:
+                if attempt == RETRIES:
+                    self.logger.error(f"Giving up delivering message to {outbound.destination}", exc_info=True)
+                    break
+
+                self._retried += 1
+                metrics.OUTBOUND_MESSAGES.inc(result="retried")
+                # discord.py waits out a 429 itself, RateLimited means the wait was longer than it may block for
+                delay: float = (
+                    e.retry_after if isinstance(e, discord.RateLimited) else self.retry_delay * 2 ** (attempt - 1)
+                )
+                # the destination's worker waits here, so later messages to it back off too
+                await asyncio.sleep(delay)
+            except Exception:
+                self.logger.exception(f"Failed to deliver message to {outbound.destination}")
+                break
+            else:
+                self._sent += 1
+                metrics.OUTBOUND_MESSAGES.inc(result="sent")
+                return message
+
+        self._failed += 1
+        metrics.OUTBOUND_MESSAGES.inc(result="failed")
+        return None
+
+    async def _close_announcement_window(
+        self, key: Tuple[int, str], channel: discord.abc.Messageable, topic: str
+    ) -> None:
+        while True:
+            await asyncio.sleep(self.announcement_window)
+
+            pending: List[str] = self._announcements[key]
+            if not pending:
+                del self._announcements[key]
+                return
+
+            # keep the window open while the burst continues
+            self._announcements[key] = []
+            await self.send_to_channel(channel, self._summarize(topic, pending))
+
+    def _summarize(self, topic: str, announcements: List[str]) -> discord.Embed:
+        if len(announcements) == 1:
+            return embed(announcements[0])
+
+        lines: List[str] = []
+        length: int = 0
+        for text in announcements:
+            if length + len(text) > _MAX_SUMMARY_LENGTH:
+                lines.append(f"...and {len(announcements) - len(lines)} more")
+                break
+            lines.append(text)
+            length += len(text) + 1
+
+        window: str = f"{self.announcement_window:g}s"
+        return embed("\n".join(lines), title=f"{len(announcements)} {topic} in the last {window}")
+
+    def _spawn(self, coro: typing.Coroutine) -> None:
+        # hold a reference so pending tasks aren't garbage collected
+        task: asyncio.Task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
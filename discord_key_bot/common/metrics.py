@@ -0,0 +1,312 @@
+import asyncio
+import bisect
+import logging
+import math
+import time
+import typing
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class Sample(typing.NamedTuple):
+    name: str
+    labels: Tuple[Tuple[str, str], ...]
+    value: float
+
+
+class Metric(object):
+    """Base class for a named metric with an optional fixed set of label names"""
+
+    type_name: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+    def _label_values(self, labels: Dict[str, typing.Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, values: LabelValues) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.label_names, values))
+
+
+class Counter(Metric):
+    type_name: str = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: typing.Any) -> None:
+        key: LabelValues = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: typing.Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterator[Sample]:
+        for key, value in sorted(self._values.items()):
+            yield Sample(f"{self.name}_total", self._labels(key), value)
+
+
+class Gauge(Metric):
+    type_name: str = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: typing.Any) -> None:
+        self._values[self._label_values(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: typing.Any) -> None:
+        key: LabelValues = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: typing.Any) -> None:
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels: typing.Any) -> None:
+        self._values.pop(self._label_values(labels), None)
+
+    def value(self, **labels: typing.Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> Iterator[Sample]:
+        for key, value in sorted(self._values.items()):
+            yield Sample(self.name, self._labels(key), value)
+
+
+class _HistogramSeries(object):
+    def __init__(self, bucket_count: int) -> None:
+        self.buckets: List[int] = [0] * bucket_count
+        self.count: int = 0
+        self.sum: float = 0.0
+
+
+class Histogram(Metric):
+    type_name: str = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: typing.Any) -> None:
+        key: LabelValues = self._label_values(labels)
+        series: Optional[_HistogramSeries] = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+
+        index: int = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series.buckets[index] += 1
+        series.count += 1
+        series.sum += value
+
+    def time(self, **labels: typing.Any) -> "Timer":
+        return Timer(self, labels)
+
+    def count(self, **labels: typing.Any) -> int:
+        series: Optional[_HistogramSeries] = self._series.get(self._label_values(labels))
+        return series.count if series else 0
+
+    def samples(self) -> Iterator[Sample]:
+        for key, series in sorted(self._series.items()):
+            labels: Tuple[Tuple[str, str], ...] = self._labels(key)
+            cumulative: int = 0
+            for bound, bucket_count in zip(self.buckets, series.buckets):
+                cumulative += bucket_count
+                yield Sample(f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative)
+            yield Sample(f"{self.name}_bucket", labels + (("le", "+Inf"),), series.count)
+            yield Sample(f"{self.name}_sum", labels, series.sum)
+            yield Sample(f"{self.name}_count", labels, series.count)
+
+
+class Timer(object):
+    """Context manager observing the elapsed wall time into a histogram"""
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, typing.Any]) -> None:
+        self._histogram: Histogram = histogram
+        self._labels: Dict[str, typing.Any] = labels
+        self._start: float = 0.0
+
+    def __enter__(self) -> "Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class Registry(object):
+    """Collection of metrics rendered together in the Prometheus text exposition format"""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for sample in metric.samples():
+                lines.append(_format_sample(sample))
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_sample(sample: Sample) -> str:
+    if not sample.labels:
+        return f"{sample.name} {_format_value(sample.value)}"
+
+    labels: str = ",".join(f'{name}="{_escape_label(value)}"' for name, value in sample.labels)
+    return f"{sample.name}{{{labels}}} {_format_value(sample.value)}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(text: str) -> str:
+    return _escape_help(text).replace('"', '\\"')
+
+
+REGISTRY: Registry = Registry()
+
+COMMAND_DURATION: Histogram = REGISTRY.histogram(
+    "keybot_command_duration_seconds", "Time spent handling a bot command", ["cog", "command"]
+)
+COMMAND_ERRORS: Counter = REGISTRY.counter(
+    "keybot_command_errors", "Bot commands that ended in an error", ["command", "error"]
+)
+QUERY_DURATION: Histogram = REGISTRY.histogram(
+    "keybot_query_duration_seconds", "Time spent running inventory queries", ["query", "sort"]
+)
+CACHE_REQUESTS: Counter = REGISTRY.counter(
+    "keybot_cache_requests", "In-memory cache lookups by outcome", ["cache", "result"]
+)
+EVENT_LOOP_LAG: Histogram = REGISTRY.histogram(
+    "keybot_event_loop_lag_seconds", "How late the event loop woke up a sleeping task"
+)
+DISCORD_SEND_DURATION: Histogram = REGISTRY.histogram(
+    "keybot_discord_send_duration_seconds", "Time taken by a discord send call", ["destination"]
+)
+OUTBOUND_QUEUE_DEPTH: Gauge = REGISTRY.gauge(
+    "keybot_outbound_queue_depth", "Messages waiting in the outbound dispatcher"
+)
+OUTBOUND_MESSAGES: Counter = REGISTRY.counter(
+    "keybot_outbound_messages", "Outbound messages by delivery outcome", ["result"]
+)
+STARTUP_DURATION: Gauge = REGISTRY.gauge(
+    "keybot_startup_seconds", "Seconds from process start until a startup phase finished", ["phase"]
+)
+RATE_LIMITED: Counter = REGISTRY.counter(
+    "keybot_rate_limited_commands", "Commands rejected by the per-member rate limiter", ["command"]
+)
+EXPIRY_ANNOUNCEMENTS: Counter = REGISTRY.counter(
+    "keybot_expiry_announcements", "Keys announced to a guild as they entered the expiration waiver period"
+)
+SNAPSHOT_BYTES: Gauge = REGISTRY.gauge(
+    "keybot_inventory_snapshot_bytes", "Estimated memory held by a guild's in-memory inventory snapshot", ["guild"]
+)
+
+
+def record_cache_hit(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+async def monitor_event_loop(interval: float = 1.0) -> None:
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    while True:
+        started: float = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+async def serve(host: str, port: int, registry: Registry = REGISTRY) -> asyncio.AbstractServer:
+    """Start a minimal HTTP server exposing the registry on /metrics"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line: bytes = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+
+            parts: List[str] = request_line.decode("latin-1").split()
+            path: str = parts[1].split("?")[0] if len(parts) > 1 else ""
+
+            if path == "/metrics":
+                status: str = "200 OK"
+                body: bytes = registry.render().encode("utf-8")
+            else:
+                status: str = "404 Not Found"
+                body: bytes = b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logger.debug("metrics client disconnected", exc_info=True)
+        finally:
+            writer.close()
+
+    server: asyncio.AbstractServer = await asyncio.start_server(handle, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    return server
@@ -0,0 +1,132 @@
+"""
+Delivers claimed keys once the claim's transaction has committed.
+
+!claim reserves a key, commits, and hands the delivery to the outbox. A task per delivery sends the key by direct
+message through the dispatcher. A key that reached the claimant is then completed: recorded in the ledger and deleted.
+Completing is retried until it succeeds and never falls back to releasing the key, which would hand it out twice. A key
+that couldn't be delivered is released and the claimant's cooldown given back.
+
+Reservations no delivery finished, left behind by a process that stopped in between, are released at startup and then
+every minute once they are older than claims.RESERVATION_TIMEOUT. Each sweep first renews the reservations of the keys
+this process is still delivering or completing, so neither it nor any other process releases them.
+"""
+
+import asyncio
+import datetime
+import logging
+import typing
+from typing import Awaitable, Callable, Dict, Optional
+
+import discord
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.common.dispatcher import MessageDispatcher
+from discord_key_bot.db import claims
+from discord_key_bot.db.models import Member
+
+# how often reservations past the timeout are looked for
+_SWEEP_INTERVAL: float = 60.0
+
+# completing a delivered claim is retried with a backoff doubling up to this many seconds
+_MAX_RETRY_DELAY: float = 60.0
+
+
+class ClaimDelivery(typing.NamedTuple):
+    key_id: int
+    guild_id: int
+    recipient: discord.abc.User
+    message: discord.Embed
+    # the claimant's last claim before this one, restored if the key couldn't be delivered
+    previous_claim: Optional[datetime.datetime]
+    applies_cooldown: bool
+
+
+# called with whether the key reached the claimant, once the claim was completed or the key released
+OnDelivered = Callable[[bool], Awaitable[None]]
+
+
+class ClaimOutbox(object):
+    def __init__(self, db_sessionmaker: sessionmaker, dispatcher: MessageDispatcher, retry_delay: float = 1.0) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        self.dispatcher: MessageDispatcher = dispatcher
+        self.retry_delay: float = retry_delay
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        # key id -> the task delivering it, until its claim is completed or the key released
+        self._deliveries: Dict[int, asyncio.Task] = {}
+
+    def submit(self, delivery: ClaimDelivery, on_delivered: OnDelivered) -> asyncio.Task:
+        """Deliver a key reserved by a committed claim"""
+
+        task: asyncio.Task = asyncio.create_task(self._deliver(delivery, on_delivered))
+        self._deliveries[delivery.key_id] = task
+        task.add_done_callback(lambda _: self._deliveries.pop(delivery.key_id, None))
+
+        return task
+
+    @property
+    def pending(self) -> int:
+        return len(self._deliveries)
+
+    async def join(self) -> None:
+        """Wait for the deliveries submitted so far to be completed or released"""
+
+        await asyncio.gather(*self._deliveries.values(), return_exceptions=True)
+
+    def release_stale(self) -> int:
+        """Release the reservations past the timeout, after renewing those of this process's deliveries"""
+
+        with self.db_sessionmaker() as session:
+            claims.renew_reservations(session, list(self._deliveries))
+            released: int = claims.release_stale_reservations(session)
+            session.commit()
+
+        if released:
+            self.logger.warning(f"Released {released} keys left reserved by undelivered claims")
+
+        return released
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(_SWEEP_INTERVAL)
+
+            try:
+                self.release_stale()
+            except Exception:
+                self.logger.exception("failed to release stale reservations")
+
+    async def _deliver(self, delivery: ClaimDelivery, on_delivered: OnDelivered) -> None:
+        sent: Optional[discord.Message] = await (
+            await self.dispatcher.send_to_user(delivery.recipient, delivery.message)
+        )
+
+        if sent is not None:
+            await self._complete(delivery)
+        else:
+            try:
+                self._release(delivery)
+            except Exception:
+                self.logger.exception(f"Failed to release key {delivery.key_id}, it is released once it times out")
+
+        await on_delivered(sent is not None)
+
+    async def _complete(self, delivery: ClaimDelivery) -> None:
+        attempt: int = 0
+        while True:
+            try:
+                with self.db_sessionmaker() as session:
+                    claims.complete_claim(session, delivery.key_id, delivery.guild_id)
+                    session.commit()
+                return
+            except Exception:
+                # the claimant has the key, releasing it would hand it out again
+                self.logger.exception(f"Failed to complete the delivered claim of key {delivery.key_id}, retrying")
+
+            await asyncio.sleep(min(self.retry_delay * 2 ** attempt, _MAX_RETRY_DELAY))
+            attempt += 1
+
+    def _release(self, delivery: ClaimDelivery) -> None:
+        with self.db_sessionmaker() as session:
+            claims.release_key(session, delivery.key_id)
+            if delivery.applies_cooldown:
+                session.get(Member, delivery.recipient.id).last_claim = delivery.previous_claim
+            session.commit()
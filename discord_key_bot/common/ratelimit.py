@@ -0,0 +1,113 @@
+"""
+Per-member token buckets that keep one member from flooding the database with commands.
+
+Each member gets a bucket per cog, holding up to `capacity` tokens and refilled at `refill_rate` tokens a second.
+A command takes its cost from the bucket, the inventory-wide commands costing more than the rest, and is rejected
+while the bucket can't cover it. Only the first rejection of a run is answered, so a member hammering the bot gets
+a single reply instead of one per command.
+"""
+
+import time
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+from discord.ext import commands
+
+from discord_key_bot.common import metrics
+
+# tokens a command takes when it isn't listed in the costs
+DEFAULT_COST: float = 1.0
+
+# buckets left alone this long are refilled anyway, so they are dropped rather than kept
+_PRUNE_INTERVAL: float = 60.0
+
+BucketKey = Tuple[int, str]
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, retry_after: float, notify: bool) -> None:
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after: float = retry_after
+        # first rejection since the member's last accepted command
+        self.notify: bool = notify
+
+
+class _Bucket(object):
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens: float = tokens
+        self.updated: float = updated
+        self.notified: bool = False
+
+
+class CommandRateLimiter(object):
+    def __init__(
+        self,
+        capacity: float,
+        refill_rate: float,
+        costs: Optional[Mapping[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.capacity: float = capacity
+        self.refill_rate: float = refill_rate
+        self.costs: Dict[str, float] = dict(costs or {})
+        self.clock: Callable[[], float] = clock
+        self.buckets: Dict[BucketKey, _Bucket] = {}
+        self._pruned: float = clock()
+
+    def cost(self, command_name: str) -> float:
+        # a cost above the capacity could never be paid
+        return min(self.costs.get(command_name, DEFAULT_COST), self.capacity)
+
+    def acquire(self, member_id: int, command_class: str, command_name: str) -> None:
+        """Take the cost of `command_name` from the member's bucket, or raise `RateLimited`"""
+
+        now: float = self.clock()
+        if now - self._pruned > _PRUNE_INTERVAL:
+            self._prune(now)
+
+        key: BucketKey = (member_id, command_class)
+        bucket: Optional[_Bucket] = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = _Bucket(self.capacity, now)
+        else:
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.refill_rate)
+            bucket.updated = now
+
+        cost: float = self.cost(command_name)
+        if bucket.tokens >= cost:
+            bucket.tokens -= cost
+            bucket.notified = False
+            return
+
+        notify: bool = not bucket.notified
+        bucket.notified = True
+        metrics.RATE_LIMITED.inc(command=command_name)
+        raise RateLimited((cost - bucket.tokens) / self.refill_rate if self.refill_rate > 0 else 0.0, notify)
+
+    async def check(self, ctx: commands.Context) -> bool:
+        """Global bot check, register it with call_once so the help command listing commands costs nothing"""
+
+        self.acquire(ctx.author.id, ctx.cog.qualified_name if ctx.cog else "", ctx.command.qualified_name)
+        return True
+
+    def _prune(self, now: float) -> None:
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if bucket.tokens + (now - bucket.updated) * self.refill_rate < self.capacity
+        }
+        self._pruned = now
+
+
+def parse_costs(text: str) -> Dict[str, float]:
+    """Parse "export=5,random=3" into command costs"""
+
+    costs: Dict[str, float] = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+
+        command, _, cost = item.partition("=")
+        costs[command.strip()] = float(cost)
+
+    return costs
@@ -0,0 +1,56 @@
+"""
+Coalesces identical database reads that are in flight at the same time.
+
+A read is run in a worker thread under a key made of its normalized parameters. Anyone asking for the same key
+before it finishes waits on that read instead of starting another, and everyone gets the same result, or the same
+exception. The key is forgotten as soon as the read finishes, so nothing is cached. Every key is also forgotten as
+soon as the change log reports a write, so a read asked for after this process has seen a write never joins one
+that started before it. Results are shared between callers and must not be modified.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, Hashable, TypeVar
+
+from discord_key_bot.common import metrics
+from discord_key_bot.db.changes import ChangeSet
+
+T = TypeVar("T")
+
+
+class SingleFlight(object):
+    def __init__(self, use_threads: bool = True) -> None:
+        # an in-memory SQLite database is private to its thread, reads have to stay on the event loop
+        self.use_threads: bool = use_threads
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    async def do(self, key: Hashable, func: Callable[[], T]) -> T:
+        """The result of `func`, shared with every other caller of `key` while it runs"""
+
+        call: asyncio.Future = self._calls.get(key)
+        metrics.record_cache_hit("single_flight", call is not None)
+
+        if call is None:
+            if not self.use_threads:
+                # nothing can join a call that never yields
+                return func()
+
+            call = self._calls[key] = asyncio.ensure_future(asyncio.to_thread(func))
+            call.add_done_callback(lambda done: self._finished(key, done))
+
+        # one caller giving up doesn't cancel the read for the others
+        return await asyncio.shield(call)
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        # reads in flight may predate the write, they finish for their callers but nobody else joins them
+        if changes:
+            self._calls.clear()
+
+    def _finished(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+        # every caller may have been cancelled, the exception is logged rather than reported as never retrieved
+        if not call.cancelled() and call.exception() is not None:
+            self.logger.debug(f"Coalesced read {key!r} failed", exc_info=call.exception())
@@ -1,6 +1,9 @@
+import asyncio
 import datetime
+import hashlib
 import re
 import typing
+import unicodedata
 from math import ceil
 from typing import List
 from zoneinfo import ZoneInfo
@@ -13,6 +16,9 @@ from discord_key_bot.platform import Platform
 
 RETRIES: int = 3
 
+# dropped from the front of a title when ordering, so "The Witness" is listed under W
+_LEADING_ARTICLE = re.compile(r"^(the|a|an)\s+(?=\S)")
+
 
 class KeyCount(typing.NamedTuple):
     label: str
@@ -51,27 +57,68 @@ def get_search_name(title: str) -> str:
     return re.sub(r"\W", "_", title.lower())
 
 
+def get_sort_name(title: str) -> str:
+    # accents are dropped so "Ōkami" sorts next to "Okami"
+    decomposed: str = unicodedata.normalize("NFKD", title.casefold().strip())
+    sort_name: str = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _LEADING_ARTICLE.sub("", sort_name)
+
+
+def get_key_fingerprint(key: str) -> str:
+    # the same key typed with other casing or separators, e.g. "abcde-fghij" and "ABCDEFGHIJ", has one fingerprint
+    canonical: str = re.sub(r"[\W_]", "", key.upper())
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
 async def send_message(
-    ctx: commands.Context, msg: typing.Union[str, discord.Embed]
-) -> None:
+    ctx: commands.Context,
+    msg: typing.Union[str, discord.Embed],
+    view: typing.Optional[discord.ui.View] = None,
+    file: typing.Optional[discord.File] = None,
+) -> asyncio.Future:
     if is_direct_message(ctx):
-        await send_direct_message(ctx, msg)
+        return await send_direct_message(ctx, msg, view, file)
     else:
-        await send_channel_message(ctx, msg)
+        return await send_channel_message(ctx, msg, view, file)
 
 
-async def send_direct_message(ctx: commands.Context, msg: typing.Union[str, discord.Embed]) -> None:
-    if isinstance(msg, str):
-        await ctx.author.send(msg)
-    else:
-        await ctx.author.send(embed=msg)
+async def send_direct_message(
+    ctx: commands.Context,
+    msg: typing.Union[str, discord.Embed],
+    view: typing.Optional[discord.ui.View] = None,
+    file: typing.Optional[discord.File] = None,
+) -> asyncio.Future:
+    return await ctx.bot.message_dispatcher.send_to_user(ctx.author, msg, view, file)
 
 
-async def send_channel_message(ctx: commands.Context, msg: typing.Union[str, discord.Embed]) -> None:
-    if isinstance(msg, str):
-        await ctx.send(msg)
-    else:
-        await ctx.send(embed=msg)
+async def send_channel_message(
+    ctx: commands.Context,
+    msg: typing.Union[str, discord.Embed],
+    view: typing.Optional[discord.ui.View] = None,
+    file: typing.Optional[discord.File] = None,
+) -> asyncio.Future:
+    return await ctx.bot.message_dispatcher.send_to_channel(ctx.channel, msg, view, file)
+
+
+async def send_announcement(ctx: commands.Context, topic: str, text: str) -> None:
+    await ctx.bot.message_dispatcher.announce(ctx.channel, topic, text)
+
+
+async def acknowledge_interaction(ctx: commands.Context) -> None:
+    # slash commands reply through the dispatcher like prefix commands, the interaction only needs an answer in time
+    if ctx.interaction and not ctx.interaction.response.is_done():
+        await ctx.interaction.response.defer(ephemeral=True)
+
+
+async def close_interaction(ctx: commands.Context) -> None:
+    if not ctx.interaction:
+        return
+
+    await acknowledge_interaction(ctx)
+    try:
+        await ctx.interaction.delete_original_response()
+    except discord.HTTPException:
+        pass
 
 
 def get_page_header_text(page: int, total: int, per_page: int, unit: str = "games") -> str:
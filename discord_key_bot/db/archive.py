@@ -0,0 +1,127 @@
+"""
+Cold storage for keys that nobody is likely to claim.
+
+Keys added longer ago than the archive age, and keys of members who share with no guild that were added longer ago than
+a shorter grace period, are moved from `keys` into `archived_keys` and the games left without keys are deleted, so the
+inventory queries only read keys that can be claimed. The move is one transaction on the same database. An archived key keeps its game's title, and is added back
+under a new id when restored.
+"""
+
+import collections
+import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import DateTime, and_, false, func, insert, literal, or_, select, true
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from discord_key_bot.common.util import get_key_fingerprint
+from discord_key_bot.db import counters, search
+from discord_key_bot.db.models import ArchivedKey, Game, Guild, Key
+
+# fingerprints per lookup when checking restored keys against the live ones
+_FINGERPRINT_BATCH_SIZE: int = 500
+
+
+def archive_keys(
+    session: Session,
+    added_before: Optional[datetime.datetime] = None,
+    unshared_added_before: Optional[datetime.datetime] = None,
+) -> Tuple[int, int]:
+    """Move the keys added before `added_before`, or shared with no guild and added before `unshared_added_before`, to
+    the archive
+
+    Returns the number of games deleted and keys archived.
+    """
+
+    stale: ColumnElement = and_(
+        # a key being delivered is about to be claimed
+        Key.reserved_at.is_(None),
+        or_(
+            and_(
+                # not a correlated EXISTS, guilds is indexed by guild first
+                Key.creator_id.not_in(select(Guild.member_id).where(Guild.member_id.is_not(None))),
+                # a donor who just ran !add may not have run !share yet
+                Key.created_at < unshared_added_before if unshared_added_before else true(),
+            ),
+            Key.created_at < added_before if added_before else false(),
+        ),
+    )
+
+    session.execute(insert(ArchivedKey).from_select(
+        ["game_name", "key", "fingerprint", "platform", "creator_id", "expiration", "created_at", "archived_at"],
+        select(
+            Game.pretty_name,
+            Key.key,
+            Key.fingerprint,
+            Key.platform,
+            Key.creator_id,
+            Key.expiration,
+            Key.created_at,
+            literal(datetime.datetime.now(datetime.UTC), DateTime),
+        ).join(Game, Game.id == Key.game_id).where(stale),
+    ))
+
+    # a bulk delete bypasses the flush listener, so take the archived keys off the counters here
+    counters.adjust(session, collections.Counter({
+        (game_id, platform): -count
+        for game_id, platform, count in session.query(Key.game_id, Key.platform, func.count(Key.id))
+        .filter(stale)
+        .group_by(Key.game_id, Key.platform)
+    }))
+    archived_keys: int = session.query(Key).filter(stale).delete(synchronize_session=False)
+
+    return search.delete_orphan_games(session), archived_keys
+
+
+def restore_keys(session: Session, creator_id: int = 0) -> Tuple[int, int]:
+    """Move the archived keys of `creator_id`, or every archived key, back into `keys`
+
+    Keys that have expired since, or were added again while archived, stay in the archive.
+    Returns the number of keys restored and left in the archive.
+    """
+
+    query = session.query(ArchivedKey)
+    if creator_id:
+        query = query.filter(ArchivedKey.creator_id == creator_id)
+    archived: List[ArchivedKey] = query.all()
+
+    # recomputed rather than read from the row, the v5 upgrade cleared the stored one on duplicates
+    fingerprints: Dict[int, str] = {row.id: get_key_fingerprint(row.key) for row in archived}
+    live: Set[str] = _live_fingerprints(session, list(set(fingerprints.values())))
+    now: datetime.datetime = datetime.datetime.now(datetime.UTC)
+    games: Dict[str, Game] = {}
+    restored: int = 0
+
+    # looking up each game would otherwise flush the keys restored so far, one small flush per game
+    with session.no_autoflush:
+        for row in archived:
+            if fingerprints[row.id] in live or (row.expiration and row.expiration.replace(tzinfo=datetime.UTC) <= now):
+                continue
+
+            if row.game_name not in games:
+                games[row.game_name] = Game.get(session, row.game_name)
+
+            session.add(Key(
+                game_id=games[row.game_name].id,
+                key=row.key,
+                platform=row.platform,
+                creator_id=row.creator_id,
+                expiration=row.expiration,
+                # dated to the restore, or the next archive run would take it straight back
+                created_at=now,
+            ))
+            session.delete(row)
+            live.add(fingerprints[row.id])
+            restored += 1
+
+    return restored, len(archived) - restored
+
+
+def _live_fingerprints(session: Session, fingerprints: List[str]) -> Set[str]:
+    live: Set[str] = set()
+    for start in range(0, len(fingerprints), _FINGERPRINT_BATCH_SIZE):
+        batch: List[str] = fingerprints[start:start + _FINGERPRINT_BATCH_SIZE]
+        live.update(fingerprint for fingerprint, in session.query(Key.fingerprint).filter(Key.fingerprint.in_(batch)))
+
+    return live
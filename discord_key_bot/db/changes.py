@@ -0,0 +1,277 @@
+"""
+Cross-process cache invalidation through the append-only changes table.
+
+Every flush that adds, removes or edits keys, games, shares or members appends rows describing what it touched, in
+the same transaction. Each process reads the rows past its high-water mark, and any committed late just below it, and
+hands the affected guilds, members and games to the registered callbacks, so a cache kept by one shard is evicted when
+another shard writes to the shared database. A process's own commits are handed over as they commit, from the rows
+they wrote, without reading the table back.
+"""
+
+import asyncio
+import datetime
+import logging
+import typing
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set
+
+from sqlalchemy import Connection, Result, delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session, sessionmaker, ORMExecuteState, UOWTransaction
+
+from discord_key_bot.db.models import Change, Game, Guild, Key, Member
+
+# rows older than this have been read by every process that is still running
+CHANGE_RETENTION: datetime.timedelta = datetime.timedelta(hours=1)
+
+# member columns that nothing caches, changing only these is not logged
+_UNCACHED_MEMBER_COLUMNS: Set[str] = {"last_claim"}
+
+_SHARE_KINDS: Set[str] = {"share", "unshare"}
+
+# execution option naming the rows an UPDATE or DELETE touches, as _row keyword arguments, logged instead of "bulk"
+CHANGED_ROWS: str = "changes.rows"
+
+# ids below the high-water mark that are read again: on PostgreSQL a transaction can commit after one that was handed
+# a later id, so its rows show up behind the mark
+_REREAD_WINDOW: int = 1000
+
+
+class ChangeSet(typing.NamedTuple):
+    guild_ids: Set[int]
+    member_ids: Set[int]
+    game_ids: Set[int]
+    # a bulk statement whose rows are unknown, every cache has to be dropped
+    everything: bool = False
+    # guilds a member started or stopped sharing with, every key visible there may have changed
+    shared_guild_ids: FrozenSet[int] = frozenset()
+
+    def __bool__(self) -> bool:
+        return self.everything or bool(self.guild_ids or self.member_ids or self.game_ids)
+
+
+class ChangeWatcher(object):
+    def __init__(self, db_sessionmaker: sessionmaker, interval: float) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        self.interval: float = interval
+        self.high_water_mark: int = 0
+        # ids already read that are still inside the re-read window
+        self._seen: Set[int] = set()
+        self.callbacks: List[Callable[[ChangeSet], None]] = []
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self._last_prune: datetime.datetime = datetime.datetime.now(datetime.UTC)
+
+    def register(self, callback: Callable[[ChangeSet], None]) -> None:
+        """Call `callback` with every batch of changes made by this or any other process"""
+        self.callbacks.append(callback)
+
+    def install(self) -> None:
+        with self.db_sessionmaker() as session:
+            self.high_water_mark = session.query(func.max(Change.id)).scalar() or 0
+            self._seen = self._window_ids(session)
+
+        event.listen(self.db_sessionmaker, "after_flush", _after_flush)
+        event.listen(self.db_sessionmaker, "do_orm_execute", _do_orm_execute)
+        event.listen(self.db_sessionmaker, "after_commit", self._after_commit)
+        event.listen(self.db_sessionmaker, "after_rollback", _after_rollback)
+
+    def poll(self) -> ChangeSet:
+        """Read the changes past the high-water mark and pass them to the callbacks"""
+
+        with self.db_sessionmaker() as session:
+            # only the ids are read for the window, the rows are read once
+            new_ids: Set[int] = self._window_ids(session) - self._seen
+            if not new_ids:
+                return ChangeSet(set(), set(), set())
+
+            rows: List[Mapping[str, typing.Any]] = [
+                row for row in session.execute(
+                    select(Change.__table__).where(Change.id >= min(new_ids)).order_by(Change.id)
+                ).mappings()
+                if row["id"] in new_ids
+            ]
+            self.high_water_mark = max(self.high_water_mark, max(new_ids))
+            self._seen = {
+                change_id for change_id in self._seen | new_ids if change_id > self.high_water_mark - _REREAD_WINDOW
+            }
+            changes: ChangeSet = _change_set(rows, _member_guild_ids(session.connection(), rows))
+
+        self._notify(changes)
+
+        return changes
+
+    def _notify(self, changes: ChangeSet) -> None:
+        for callback in self.callbacks:
+            try:
+                callback(changes)
+            except Exception:
+                self.logger.exception("change callback failed")
+
+    def _window_ids(self, session: Session) -> Set[int]:
+        return {
+            change_id for change_id, in
+            session.query(Change.id).filter(Change.id > self.high_water_mark - _REREAD_WINDOW)
+        }
+
+    def prune(self, session: Session, retention: datetime.timedelta = CHANGE_RETENTION) -> int:
+        cutoff: datetime.datetime = datetime.datetime.now(datetime.UTC) - retention
+        return session.execute(delete(Change).where(Change.created_at < cutoff)).rowcount
+
+    async def run(self) -> None:
+        while True:
+            try:
+                changes: ChangeSet = self.poll()
+                if changes:
+                    self.logger.debug(f"changes up to {self.high_water_mark}: {changes}")
+
+                if datetime.datetime.now(datetime.UTC) - self._last_prune > CHANGE_RETENTION:
+                    with self.db_sessionmaker() as session:
+                        pruned: int = self.prune(session)
+                        session.commit()
+                    self._last_prune = datetime.datetime.now(datetime.UTC)
+                    self.logger.debug(f"pruned {pruned} old changes")
+            except Exception:
+                self.logger.exception("failed to poll changes")
+
+            await asyncio.sleep(self.interval)
+
+    def _after_commit(self, session: Session) -> None:
+        # this process evicts its own writes straight away, from the rows it wrote, and the poll skips their ids
+        pending: Optional[_Pending] = session.info.pop(_PENDING, None)
+        if pending is None:
+            return
+
+        self._seen.update(pending.change_ids)
+        self._notify(_change_set(pending.rows, pending.guild_ids))
+
+
+_PENDING: str = "changes.pending"
+
+
+class _Pending(object):
+    """The changes a session wrote in its open transaction"""
+
+    def __init__(self) -> None:
+        self.change_ids: Set[int] = set()
+        self.rows: List[Mapping[str, typing.Any]] = []
+        # guilds the changed members share with, read in the same transaction
+        self.guild_ids: Set[int] = set()
+
+
+def _after_rollback(session: Session) -> None:
+    # the rows are gone, and on SQLite their ids are handed out again
+    session.info.pop(_PENDING, None)
+
+
+def _after_flush(session: Session, flush_context: UOWTransaction) -> None:
+    rows: List[Dict[str, typing.Any]] = []
+
+    for obj in session.new:
+        if isinstance(obj, Key):
+            rows.append(_row("add", member_id=obj.creator_id, game_id=obj.game_id))
+        elif isinstance(obj, Guild):
+            rows.append(_row("share", guild_id=obj.guild_id, member_id=obj.member_id))
+        elif isinstance(obj, Game):
+            rows.append(_row("game", game_id=obj.id))
+
+    for obj in session.deleted:
+        if isinstance(obj, Key):
+            rows.append(_row("claim" if obj.reserved_at else "remove", member_id=obj.creator_id, game_id=obj.game_id))
+        elif isinstance(obj, Guild):
+            rows.append(_row("unshare", guild_id=obj.guild_id, member_id=obj.member_id))
+        elif isinstance(obj, Game):
+            rows.append(_row("remove", game_id=obj.id))
+
+    for obj in session.dirty:
+        if isinstance(obj, Key):
+            # a key moved by a rename leaves its old game too
+            for game_id in {obj.game_id, *_previous_values(obj, "game_id")}:
+                rows.append(_row("update", member_id=obj.creator_id, game_id=game_id))
+        elif isinstance(obj, Game):
+            rows.append(_row("game", game_id=obj.id))
+        elif isinstance(obj, Member):
+            if _changed_columns(obj) - _UNCACHED_MEMBER_COLUMNS:
+                rows.append(_row("member", member_id=obj.id))
+            # unshared guilds are deleted as orphans during the flush, so they only show up in the collection
+            for guild in _previous_values(obj, "_guilds"):
+                rows.append(_row("unshare", guild_id=guild.guild_id, member_id=obj.id))
+
+    _append(session, rows)
+
+
+def _do_orm_execute(orm_execute_state: ORMExecuteState) -> Optional[Result]:
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in (Game, Guild, Key, Member):
+        return None
+
+    # run the statement here so that one which matched no rows isn't logged
+    result: Result = orm_execute_state.invoke_statement()
+    if result.rowcount:
+        changed_rows: Optional[List[Dict[str, typing.Any]]] = orm_execute_state.execution_options.get(CHANGED_ROWS)
+        _append(
+            orm_execute_state.session,
+            [_row(**row) for row in changed_rows] if changed_rows is not None else [_row("bulk")],
+        )
+
+    return result
+
+
+def _append(session: Session, rows: List[Dict[str, typing.Any]]) -> None:
+    if not rows:
+        return
+
+    # a core statement on the session's connection, so it neither autoflushes nor re-enters the ORM events
+    connection: Connection = session.connection()
+    result: Result = connection.execute(insert(Change.__table__).returning(Change.id), rows)
+
+    pending: _Pending = session.info.setdefault(_PENDING, _Pending())
+    pending.change_ids.update(change_id for change_id, in result)
+    pending.rows.extend(rows)
+    pending.guild_ids.update(_member_guild_ids(connection, rows))
+
+
+def _change_set(rows: List[Mapping[str, typing.Any]], member_guild_ids: Iterable[int]) -> ChangeSet:
+    return ChangeSet(
+        # a member's keys are visible in every guild they share with
+        guild_ids={row["guild_id"] for row in rows if row["guild_id"] is not None} | set(member_guild_ids),
+        member_ids={row["member_id"] for row in rows if row["member_id"] is not None},
+        game_ids={row["game_id"] for row in rows if row["game_id"] is not None},
+        everything=any(row["kind"] == "bulk" for row in rows),
+        shared_guild_ids=frozenset(row["guild_id"] for row in rows if row["kind"] in _SHARE_KINDS),
+    )
+
+
+def _member_guild_ids(connection: Connection, rows: List[Mapping[str, typing.Any]]) -> Set[int]:
+    member_ids: Set[int] = {row["member_id"] for row in rows if row["member_id"] is not None}
+    if not member_ids:
+        return set()
+
+    return {
+        guild_id for guild_id, in
+        connection.execute(select(Guild.guild_id).where(Guild.member_id.in_(member_ids)).distinct())
+    }
+
+
+def _row(
+    kind: str,
+    guild_id: Optional[int] = None,
+    member_id: Optional[int] = None,
+    game_id: Optional[int] = None,
+) -> Dict[str, typing.Any]:
+    return {
+        "kind": kind,
+        "guild_id": guild_id,
+        "member_id": member_id,
+        "game_id": game_id,
+        "created_at": datetime.datetime.now(datetime.UTC),
+    }
+
+
+def _changed_columns(obj: typing.Any) -> Set[str]:
+    state = inspect(obj)
+    return {attr.key for attr in state.mapper.column_attrs if state.attrs[attr.key].history.has_changes()}
+
+
+def _previous_values(obj: typing.Any, name: str) -> Iterable[typing.Any]:
+    return [value for value in inspect(obj).attrs[name].history.deleted if value is not None]
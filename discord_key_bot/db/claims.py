@@ -0,0 +1,150 @@
+import datetime
+import typing
+from typing import Collection, Dict, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from discord_key_bot.db import changes, sqlalchemy_helpers
+from discord_key_bot.db.models import Claim, ClaimDay, ClaimDonor, Game, Key, Member
+
+# reservations older than this can only be left behind by a delivery that never finished
+RESERVATION_TIMEOUT: datetime.timedelta = datetime.timedelta(minutes=5)
+
+
+def reserve_key(session: Session, key: Key, member: Member) -> bool:
+    """Reserve `key` for `member`, False if another claim reserved it first"""
+
+    # only one of several processes claiming the same key gets to deliver it
+    return session.execute(
+        update(Key)
+        .where(Key.id == key.id, Key.reserved_at.is_(None))
+        .values(reserved_by=member.id, reserved_at=datetime.datetime.now(datetime.UTC)),
+        execution_options={
+            changes.CHANGED_ROWS: [{"kind": "update", "member_id": key.creator_id, "game_id": key.game_id}],
+        },
+    ).rowcount == 1
+
+
+class ClaimStats(typing.NamedTuple):
+    today: int
+    week: int
+    month: int
+    total: int
+
+
+class Donor(typing.NamedTuple):
+    member_id: int
+    name: Optional[str]
+    claims: int
+
+
+def complete_claim(session: Session, key_id: int, guild_id: int) -> None:
+    key: Optional[Key] = session.get(Key, key_id)
+    if not key:
+        return
+
+    record_claim(session, key, guild_id)
+
+    game: Game = key.game
+    session.delete(key)
+    session.flush()
+
+    if not game.key_count:
+        session.delete(game)
+
+
+def release_key(session: Session, key_id: int) -> None:
+    key: Optional[Key] = session.get(Key, key_id)
+    if key:
+        key.reserved_by = None
+        key.reserved_at = None
+
+
+def release_stale_reservations(session: Session, timeout: datetime.timedelta = RESERVATION_TIMEOUT) -> int:
+    cutoff: datetime.datetime = datetime.datetime.now(datetime.UTC) - timeout
+
+    return session.execute(
+        update(Key).where(Key.reserved_at < cutoff).values(reserved_by=None, reserved_at=None)
+    ).rowcount
+
+
+def renew_reservations(session: Session, key_ids: Collection[int]) -> None:
+    """Restart the timeout of the reservations of keys still being delivered, so no process releases them"""
+
+    if not key_ids:
+        return
+
+    session.execute(
+        update(Key)
+        .where(Key.id.in_(key_ids), Key.reserved_at.is_not(None))
+        .values(reserved_at=datetime.datetime.now(datetime.UTC)),
+        # the keys stay reserved, no cache has anything to evict
+        execution_options={changes.CHANGED_ROWS: []},
+    )
+
+
+def record_claim(session: Session, key: Key, guild_id: int) -> None:
+    """Add the claim of a reserved `key` to the ledger and its rollups, in the claim's transaction"""
+
+    claimed_at: datetime.datetime = datetime.datetime.now(datetime.UTC)
+    session.add(Claim(
+        claimed_at=claimed_at,
+        guild_id=guild_id,
+        member_id=key.reserved_by,
+        creator_id=key.creator_id,
+        game_id=key.game_id,
+        game_name=key.game.pretty_name,
+        platform=key.platform,
+    ))
+
+    # the rollups are counted up in place, so reading them never has to scan the ledger
+    _increment(session, ClaimDay, {"guild_id": guild_id, "day": claimed_at.date()})
+    _increment(session, ClaimDonor, {"guild_id": guild_id, "creator_id": key.creator_id})
+
+
+def guild_stats(session: Session, guild_id: int, today: datetime.date) -> ClaimStats:
+    """Claims made in `guild_id` today, in the last 7 and 30 days and ever"""
+
+    days: Dict[datetime.date, int] = dict(
+        session.query(ClaimDay.day, ClaimDay.claims).filter(
+            ClaimDay.guild_id == guild_id, ClaimDay.day > today - datetime.timedelta(days=30)
+        )
+    )
+    # one row per member whose keys were claimed here, however long the history
+    total: int = session.query(func.sum(ClaimDonor.claims)).filter(ClaimDonor.guild_id == guild_id).scalar() or 0
+
+    return ClaimStats(
+        today=days.get(today, 0),
+        week=sum(claims for day, claims in days.items() if day > today - datetime.timedelta(days=7)),
+        month=sum(days.values()),
+        total=total,
+    )
+
+
+def donor_claims(session: Session, guild_id: int, member_id: int) -> int:
+    """Claims of `member_id`'s keys made in `guild_id`"""
+
+    donor: Optional[ClaimDonor] = session.get(ClaimDonor, (guild_id, member_id))
+    return donor.claims if donor else 0
+
+
+def top_donors(session: Session, guild_id: int, limit: int) -> List[Donor]:
+    """The members whose keys were claimed most in `guild_id`"""
+
+    return [
+        Donor(*row) for row in
+        session.query(ClaimDonor.creator_id, Member.name, ClaimDonor.claims)
+        .outerjoin(Member, Member.id == ClaimDonor.creator_id)
+        .filter(ClaimDonor.guild_id == guild_id)
+        .order_by(ClaimDonor.claims.desc())
+        .limit(limit)
+    ]
+
+
+def _increment(session: Session, entity: typing.Any, keys: Dict[str, typing.Any]) -> None:
+    session.execute(
+        sqlalchemy_helpers.upsert(session, entity)
+        .values(claims=1, **keys)
+        .on_conflict_do_update(index_elements=list(keys), set_={"claims": entity.claims + 1})
+    )
@@ -1,19 +1,48 @@
+import logging
+from typing import Optional
+
 from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import URL, Engine
 from sqlalchemy.orm import sessionmaker
 
-from .models import Base, upgrade_tables
+from . import counters
+from .models import Base, schema_is_current, upgrade_tables
+from .slow_queries import SlowQueryLog
+
+logger: logging.Logger = logging.getLogger("discord_key_bot.db.connection")
 
 
-def new(uri: str, connection_timeout: str = 15, echo: bool = False) -> sessionmaker:
+def new(
+    uri: str,
+    connection_timeout: str = 15,
+    echo: bool = False,
+    slow_query_log: Optional[SlowQueryLog] = None,
+) -> sessionmaker:
     engine: Engine = create_engine(
         uri,
         echo=echo,
         connect_args={"timeout": connection_timeout},
     )
-    Base.metadata.create_all(engine)
+    if slow_query_log:
+        slow_query_log.install(engine)
 
     db_sessionmaker = sessionmaker(bind=engine)
-    upgrade_tables(db_sessionmaker)
+
+    # the common case: every table is already at its latest version, so skip reflection entirely
+    if schema_is_current(db_sessionmaker):
+        logger.debug("Database schema is current")
+    else:
+        logger.info("Creating and upgrading database tables")
+        Base.metadata.create_all(engine)
+        upgrade_tables(db_sessionmaker)
+
+    counters.install(db_sessionmaker)
 
     return db_sessionmaker
+
+
+def is_in_memory(db_sessionmaker: sessionmaker) -> bool:
+    """Whether the database is an in-memory SQLite one, which every thread sees a separate, empty copy of"""
+
+    url: URL = db_sessionmaker.kw["bind"].url
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
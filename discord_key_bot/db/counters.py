@@ -0,0 +1,126 @@
+"""
+Per-game key counters, kept on games.key_count and in game_platform_counts.
+
+Key inserts, deletes and moves are counted by a flush listener and written on the session's connection in the same
+transaction. Bulk statements that delete keys must call `adjust` themselves.
+"""
+
+import collections
+import typing
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import bindparam, delete, event, insert, inspect, select, update
+from sqlalchemy.orm import Session, sessionmaker, UOWTransaction
+
+from discord_key_bot.db.models import Game, GamePlatformCount, Key
+
+_TOUCHED_GAMES: str = "counters.touched_games"
+
+Deltas = typing.Counter[Tuple[int, str]]
+
+
+def install(db_sessionmaker: sessionmaker) -> None:
+    event.listen(db_sessionmaker, "before_flush", _before_flush)
+    event.listen(db_sessionmaker, "after_flush", _after_flush)
+    event.listen(db_sessionmaker, "after_flush_postexec", _after_flush_postexec)
+
+
+def adjust(session: Session, deltas: Deltas) -> None:
+    """Apply key count changes per (game_id, platform) to both counter tables"""
+
+    deltas = collections.Counter({pair: delta for pair, delta in deltas.items() if delta})
+    if not deltas:
+        return
+
+    game_deltas: typing.Counter[int] = collections.Counter()
+    for (game_id, platform), delta in deltas.items():
+        game_deltas[game_id] += delta
+
+    connection = session.connection()
+    counts = GamePlatformCount.__table__
+    existing: Set[Tuple[int, str]] = set(connection.execute(
+        select(counts.c.game_id, counts.c.platform).where(counts.c.game_id.in_(game_deltas))
+    ).all())
+
+    # one executemany per statement, a flush can touch thousands of keys
+    updates: List[Dict[str, typing.Any]] = [
+        {"b_game_id": game_id, "b_platform": platform, "b_delta": delta}
+        for (game_id, platform), delta in deltas.items() if (game_id, platform) in existing
+    ]
+    if updates:
+        connection.execute(
+            update(counts)
+            .where(counts.c.game_id == bindparam("b_game_id"), counts.c.platform == bindparam("b_platform"))
+            .values(key_count=counts.c.key_count + bindparam("b_delta")),
+            updates,
+        )
+
+    inserts: List[Dict[str, typing.Any]] = [
+        {"game_id": game_id, "platform": platform, "key_count": delta}
+        for (game_id, platform), delta in deltas.items() if (game_id, platform) not in existing
+    ]
+    if inserts:
+        connection.execute(insert(counts), inserts)
+
+    games = Game.__table__
+    game_updates: List[Dict[str, typing.Any]] = [
+        {"b_game_id": game_id, "b_delta": delta} for game_id, delta in game_deltas.items() if delta
+    ]
+    if game_updates:
+        connection.execute(
+            update(games)
+            .where(games.c.id == bindparam("b_game_id"))
+            .values(key_count=games.c.key_count + bindparam("b_delta")),
+            game_updates,
+        )
+
+    session.info.setdefault(_TOUCHED_GAMES, set()).update(game_deltas)
+
+
+def _before_flush(session: Session, flush_context: UOWTransaction, instances: typing.Any) -> None:
+    # the platform counts reference the game, so they go before it
+    game_ids: Set[int] = {obj.id for obj in session.deleted if isinstance(obj, Game) and obj.id is not None}
+    if game_ids:
+        session.connection().execute(
+            delete(GamePlatformCount.__table__).where(GamePlatformCount.game_id.in_(game_ids))
+        )
+
+
+def _after_flush(session: Session, flush_context: UOWTransaction) -> None:
+    deltas: Deltas = collections.Counter()
+    deleted_games: Set[int] = {obj.id for obj in session.deleted if isinstance(obj, Game)}
+
+    for obj in session.new:
+        if isinstance(obj, Key):
+            deltas[(obj.game_id, obj.platform)] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Key):
+            deltas[(obj.game_id, obj.platform)] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Key):
+            # moved to another game by a rename, or to another platform
+            old_game_id: int = _previous_value(obj, "game_id", obj.game_id)
+            old_platform: str = _previous_value(obj, "platform", obj.platform)
+            if (old_game_id, old_platform) != (obj.game_id, obj.platform):
+                deltas[(old_game_id, old_platform)] -= 1
+                deltas[(obj.game_id, obj.platform)] += 1
+
+    # a deleted game's counters went with it
+    adjust(session, collections.Counter({
+        (game_id, platform): delta for (game_id, platform), delta in deltas.items() if game_id not in deleted_games
+    }))
+
+
+def _after_flush_postexec(session: Session, flush_context: UOWTransaction) -> None:
+    # the counters were updated behind the ORM's back, reload them on next access
+    for game_id in session.info.pop(_TOUCHED_GAMES, set()):
+        game: typing.Optional[Game] = session.identity_map.get(inspect(Game).identity_key_from_primary_key((game_id,)))
+        if game is not None and game not in session.deleted:
+            session.expire(game, ["key_count"])
+
+
+def _previous_value(obj: typing.Any, name: str, default: typing.Any) -> typing.Any:
+    deleted: Iterable[typing.Any] = inspect(obj).attrs[name].history.deleted
+    return next((value for value in deleted if value is not None), default)
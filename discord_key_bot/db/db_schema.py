@@ -1,7 +1,8 @@
 import logging
-from typing import Callable
+from typing import Callable, Dict
 
 from sqlalchemy import Column, Integer, String
+from sqlalchemy.exc import OperationalError, ProgrammingError
 
 from sqlalchemy.orm import declarative_base, Session
 
@@ -33,6 +34,18 @@ def get_version(entity: str, session: Session) -> int:
         return table_version.version
 
 
+def get_versions(session: Session) -> Dict[str, int]:
+    """Every entity's version in one query, empty if the version table has not been created yet"""
+    try:
+        return {
+            entity: version
+            for entity, version in session.query(TableVersion.entity, TableVersion.version)
+        }
+    except (OperationalError, ProgrammingError):
+        session.rollback()
+        return {}
+
+
 def set_version(entity: str, version: int, session: Session) -> None:
     table_version = session.query(TableVersion).filter(TableVersion.entity == entity).first()
     if not table_version:
@@ -0,0 +1,221 @@
+"""
+Announces keys as they enter the expiration waiver period, when they can be claimed without a cooldown.
+
+Every key expiring from now on is read once at startup, through the index on `keys.expiration`, into a heap ordered by
+the moment it enters the waiver period. A single task sleeps until the top of the heap is due, so the database is
+never polled. The keys of the games in the change log are read again, and a key whose expiration was set or moved is
+pushed again; the entry it replaces is skipped once it reaches the top. Keys already inside the waiver period at
+startup are not announced, so a restart doesn't repeat announcements. A key being delivered keeps its entry but isn't
+announced, and a failed delivery releasing it doesn't schedule it again.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+import typing
+from typing import Awaitable, Callable, Collection, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.common import metrics
+from discord_key_bot.db.changes import ChangeSet
+from discord_key_bot.db.models import Game, Key
+from discord_key_bot.db.shares import ShareIndex
+
+# the heap is checked against the clock at least this often, in case the clock was changed
+_MAX_SLEEP: float = 3600.0
+
+# (when the key enters the waiver period, push number, key id)
+_Entry = Tuple[datetime.datetime, int, int]
+
+
+class ExpiringKey(typing.NamedTuple):
+    key_id: int
+    game_id: int
+    creator_id: int
+    title: str
+    platform: str
+    expiration: datetime.datetime
+
+
+# (guild id, key) -> send the announcement
+Announce = Callable[[int, ExpiringKey], Awaitable[None]]
+
+
+class ExpirationSchedule(object):
+    def __init__(
+        self,
+        db_sessionmaker: sessionmaker,
+        share_index: ShareIndex,
+        waiver_period: datetime.timedelta,
+        announce: Announce,
+    ) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        self.share_index: ShareIndex = share_index
+        self.waiver_period: datetime.timedelta = waiver_period
+        self.announce: Announce = announce
+        # every key expiring from now on that can be claimed
+        self.keys: Dict[int, ExpiringKey] = {}
+        # key id -> its last known expiration, reserved keys included, only a change of it schedules the key again
+        self._expirations: Dict[int, datetime.datetime] = {}
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+        self._heap: List[_Entry] = []
+        # key id -> push number of its live heap entry, any other entry of the key is stale
+        self._pending: Dict[int, int] = {}
+        self._pushes: Iterator[int] = itertools.count()
+        self._games: Dict[int, Set[int]] = {}
+        self._wakeup: asyncio.Event = asyncio.Event()
+
+    def load(self) -> None:
+        """Read every key expiring from now on"""
+
+        started: float = time.perf_counter()
+        self.keys.clear()
+        self._expirations.clear()
+        self._games.clear()
+        self._pending.clear()
+        self._heap = []
+
+        now: datetime.datetime = _now()
+        for key, reserved in self._read(now):
+            self._add(key, reserved)
+            if key.expiration - self.waiver_period > now:
+                push: int = next(self._pushes)
+                self._heap.append((key.expiration - self.waiver_period, push, key.key_id))
+                self._pending[key.key_id] = push
+
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+        self.logger.debug(
+            f"scheduled {len(self._pending)} of {len(self.keys)} expiring keys "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        """When the next key enters the waiver period"""
+
+        while self._heap and self._pending.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+        return self._heap[0][0] if self._heap else None
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        if changes.everything:
+            self.load()
+            return
+
+        if not changes.game_ids:
+            return
+
+        previous: Set[int] = set()
+        for game_id in changes.game_ids:
+            for key_id in self._games.pop(game_id, ()):
+                previous.add(key_id)
+                self.keys.pop(key_id, None)
+
+        current: Set[int] = set()
+        now: datetime.datetime = _now()
+        for key, reserved in self._read(now, changes.game_ids):
+            current.add(key.key_id)
+            # a reservation or its release leaves the expiration as it was, and the key's entry where it was
+            if self._expirations.get(key.key_id) != key.expiration:
+                # a key just put inside the waiver period is announced right away
+                self._push(max(key.expiration - self.waiver_period, now), key.key_id)
+            self._add(key, reserved)
+
+        for key_id in previous - current:
+            self._expirations.pop(key_id, None)
+            self._pending.pop(key_id, None)
+
+        # replaced entries pile up under frequent changes
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._heap = [entry for entry in self._heap if self._pending.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+
+    async def run(self) -> None:
+        while True:
+            due: Optional[datetime.datetime] = self.next_due()
+            delay: Optional[float] = None
+            if due is not None:
+                delay = min(max(0.0, (due - _now()).total_seconds()), _MAX_SLEEP)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.fire(_now())
+            except Exception:
+                self.logger.exception("failed to announce expiring keys")
+
+    async def fire(self, now: datetime.datetime) -> int:
+        """Announce the keys that entered the waiver period by `now`, returns the number of announcements"""
+
+        due: List[ExpiringKey] = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, _, key_id = heapq.heappop(self._heap)
+            del self._pending[key_id]
+            # a reserved key isn't in keys, it is being delivered
+            key: Optional[ExpiringKey] = self.keys.get(key_id)
+            if key and key.expiration > now:
+                due.append(key)
+
+        if not due:
+            return 0
+
+        member_guilds: Dict[int, List[int]] = {}
+        for guild_id, member_ids in self.share_index.guilds.items():
+            for member_id in member_ids:
+                member_guilds.setdefault(member_id, []).append(guild_id)
+
+        # several keys of a game entering the waiver period together are announced once per guild
+        announced: Set[Tuple[int, int, str]] = set()
+        for key in due:
+            for guild_id in member_guilds.get(key.creator_id, ()):
+                if (guild_id, key.game_id, key.platform) not in announced:
+                    announced.add((guild_id, key.game_id, key.platform))
+                    await self.announce(guild_id, key)
+
+        metrics.EXPIRY_ANNOUNCEMENTS.inc(len(announced))
+        return len(announced)
+
+    def _read(
+        self, now: datetime.datetime, game_ids: Optional[Collection[int]] = None
+    ) -> List[Tuple[ExpiringKey, bool]]:
+        """The keys expiring after `now`, each with whether it is reserved"""
+
+        with self.db_sessionmaker() as session:
+            query = session.query(
+                Key.id, Key.game_id, Key.creator_id, Game.pretty_name, Key.platform, Key.expiration, Key.reserved_at
+            ).join(Game, Game.id == Key.game_id).filter(Key.expiration > now)
+            if game_ids is not None:
+                query = query.filter(Key.game_id.in_(game_ids))
+
+            return [(ExpiringKey(*row[:-1]), row[-1] is not None) for row in query]
+
+    def _add(self, key: ExpiringKey, reserved: bool) -> None:
+        # a key being delivered can't be claimed, its expiration is kept for when a failed delivery releases it
+        if not reserved:
+            self.keys[key.key_id] = key
+        self._expirations[key.key_id] = key.expiration
+        self._games.setdefault(key.game_id, set()).add(key.key_id)
+
+    def _push(self, due: datetime.datetime, key_id: int) -> None:
+        push: int = next(self._pushes)
+        heapq.heappush(self._heap, (due, push, key_id))
+        self._pending[key_id] = push
+
+        if self._heap[0][1] == push:
+            # sooner than the task is sleeping until
+            self._wakeup.set()
+
+
+def _now() -> datetime.datetime:
+    # expirations are stored as naive UTC
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
@@ -1,61 +1,195 @@
 import datetime
+import logging
 import typing
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, and_
-from sqlalchemy.orm import relationship, mapped_column, Mapped, Session, sessionmaker, Query
+from sqlalchemy import (
+    Column, Index, Integer, String, ForeignKey, Date, DateTime, Boolean, and_, bindparam, text, update
+)
+from sqlalchemy.orm import relationship, mapped_column, Mapped, Session, sessionmaker, Query, validates
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
-from discord_key_bot.common.util import get_search_name, get_eod
+from discord_key_bot.common.util import get_search_name, get_sort_name, get_key_fingerprint, get_eod
 from discord_key_bot.db import sqlalchemy_helpers, db_schema
-from .db_schema import Base
+from .db_schema import Base, TableVersion
 from .. import platform
 from ..platform import Platform
 
+logger: logging.Logger = logging.getLogger(__name__)
+
+# rows per statement when filling a new column on an existing table
+_BACKFILL_BATCH_SIZE: int = 1000
+
 
 class Game(Base):
     __tablename__ = "games"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True, unique=True)
     pretty_name = Column(String)
+    # ordering key for title sorted pages, kept in step with pretty_name
+    sort_name = Column(String, index=True)
     keys: Mapped[List["Key"]] = relationship(back_populates="game")
 
+    # maintained by db.counters in the same flush as key inserts and deletes
+    key_count = Column(Integer, nullable=False, default=0, server_default="0")
+
     @staticmethod
     def get(session: Session, pretty_name: str) -> "Game":
-        name = get_search_name(pretty_name)
-        game = session.query(Game).filter(Game.name == name).first()
+        return sqlalchemy_helpers.get_or_insert(session, Game, Game.name, {
+            "name": get_search_name(pretty_name),
+            "pretty_name": pretty_name,
+            "sort_name": get_sort_name(pretty_name),
+        })
 
-        if not game:
-            game = Game(name=name, pretty_name=pretty_name)
-            session.add(game)
-
-        return game
-
-    def find_key(self, platform: Platform, member_id: int = 0) -> "Key":
+    def find_key(self, platform: Platform, member_id: int = 0, skipped: typing.Collection[int] = ()) -> "Key":
         # claim the latest expiring keys first
         sorted_keys: List[Optional["Key"]] = sorted(
             self.keys, key=lambda k: datetime.datetime.max if not k.expiration else k.expiration)
         try:
             return next(key for key in sorted_keys if key.platform == platform.search_name
-                        and (member_id == 0 or key.creator_id == member_id) and not key.is_expired())
+                        and (member_id == 0 or key.creator_id == member_id) and not key.is_expired()
+                        and not key.is_reserved() and key.id not in skipped)
         except StopIteration:
             raise ValueError
 
 
+def _backfill(
+    session: Session, table: str, column: str, source: str, value: typing.Callable[[typing.Any], typing.Any]
+) -> None:
+    """Set `column` of every row to `value` of its `source` column"""
+
+    # committed per batch so other processes aren't locked out of a large table for the whole backfill, and up front
+    # so an index created on another connection sees the new column even when there is nothing to fill
+    session.commit()
+    last_id: int = 0
+    while True:
+        rows = session.execute(
+            text(f"SELECT id, {source} FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": _BACKFILL_BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+
+        session.execute(
+            text(f"UPDATE {table} SET {column} = :value WHERE id = :id"),
+            [{"id": row_id, "value": value(source_value)} for row_id, source_value in rows],
+        )
+        session.commit()
+        last_id = rows[-1][0]
+
+
+def _duplicates(session: Session, table: str, column: str) -> Dict[typing.Any, List[int]]:
+    """Ids of the rows sharing their `column` value with another row, ordered by id, by value"""
+
+    # grouped here rather than with GROUP_CONCAT, which PostgreSQL doesn't have
+    rows = session.execute(text(
+        f"SELECT {column}, id FROM {table} "
+        f"WHERE {column} IN (SELECT {column} FROM {table} GROUP BY {column} HAVING COUNT(1) > 1) ORDER BY id"
+    )).all()
+
+    duplicates: Dict[typing.Any, List[int]] = {}
+    for value, row_id in rows:
+        duplicates.setdefault(value, []).append(row_id)
+
+    return duplicates
+
+
+class GamePlatformCount(Base):
+    __tablename__ = "game_platform_counts"
+
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    platform = Column(String, primary_key=True)
+    key_count = Column(Integer, nullable=False, default=0)
+
+
+def _upgrade_games(session: Session) -> None:
+    def upgrade_func(ver: int) -> int:
+        if ver < 1:
+            sqlalchemy_helpers.table_add_column("games", "key_count", Integer, session, default=0)
+            session.execute(text(
+                "UPDATE games SET key_count = (SELECT COUNT(1) FROM keys WHERE keys.game_id = games.id)"
+            ))
+            session.execute(text("DELETE FROM game_platform_counts"))
+            session.execute(text(
+                "INSERT INTO game_platform_counts (game_id, platform, key_count) "
+                "SELECT game_id, platform, COUNT(1) FROM keys GROUP BY game_id, platform"
+            ))
+            ver = 1
+        if ver < 2:
+            sqlalchemy_helpers.table_add_column("games", "sort_name", String, session)
+            _backfill(session, "games", "sort_name", "pretty_name", lambda name: get_sort_name(name or ""))
+            if not sqlalchemy_helpers.index_exists("games", "ix_games_sort_name", session):
+                sqlalchemy_helpers.create_index("games", session, "sort_name")
+            ver = 2
+        if ver < 3:
+            merge_duplicate_games()
+            if not sqlalchemy_helpers.index_exists("games", "ix_games_name", session):
+                sqlalchemy_helpers.get_index_by_name(Game.__table__, "ix_games_name").create(bind=session.bind)
+            ver = 3
+
+        return ver
+
+    def merge_duplicate_games() -> None:
+        # titles added concurrently before games.name was unique, their keys move to the oldest row
+        for name, (kept_id, *merged_ids) in _duplicates(session, "games", "name").items():
+            logger.warning(f"Merging games {merged_ids} into game {kept_id}, they share the name '{name}'")
+
+            parameters: Dict[str, typing.Any] = {"kept_id": kept_id, "merged_ids": merged_ids}
+            merged = bindparam("merged_ids", expanding=True)
+            session.execute(
+                text("UPDATE keys SET game_id = :kept_id WHERE game_id IN :merged_ids").bindparams(merged), parameters
+            )
+            session.execute(
+                text("DELETE FROM game_platform_counts WHERE game_id = :kept_id OR game_id IN :merged_ids")
+                .bindparams(merged),
+                parameters,
+            )
+            session.execute(text("DELETE FROM games WHERE id IN :merged_ids").bindparams(merged), parameters)
+            session.execute(text(
+                "INSERT INTO game_platform_counts (game_id, platform, key_count) "
+                "SELECT game_id, platform, COUNT(1) FROM keys WHERE game_id = :kept_id GROUP BY game_id, platform"
+            ), parameters)
+            session.execute(text(
+                "UPDATE games SET key_count = (SELECT COUNT(1) FROM keys WHERE keys.game_id = games.id) "
+                "WHERE id = :kept_id"
+            ), parameters)
+
+        session.commit()
+
+    db_schema.upgrade(entity='games', upgrade_func=upgrade_func, session=session)
+
+
 class Key(Base):
     __tablename__ = "keys"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    game_id: Mapped[int] = mapped_column(ForeignKey("games.id"))
+    game_id: Mapped[int] = mapped_column(ForeignKey("games.id"), index=True)
     game: Mapped["Game"] = relationship(back_populates="keys")
 
     key = Column(String)
+    # get_key_fingerprint(key), unique so the database turns away a key added twice
+    fingerprint = Column(String)
     platform = Column(String)
 
     creator_id = Column(Integer, ForeignKey("members.id"))
     creator = relationship("Member", backref="keys")
-    expiration = Column(DateTime)
+    # indexed for the expiration schedule, which reads every key expiring from now on
+    expiration = Column(DateTime, index=True)
+
+    # set while a claimed key is being delivered to the claimant
+    reserved_by = Column(Integer)
+    reserved_at = Column(DateTime)
+
+    # keys added before the column existed are dated to the upgrade
+    created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+
+    __table_args__ = (Index("ix_keys_fingerprint", "fingerprint", unique=True),)
+
+    @validates("key")
+    def _set_fingerprint(self, _: str, key: str) -> str:
+        self.fingerprint = get_key_fingerprint(key)
+        return key
 
     def is_expired(self) -> bool:
         if not self.expiration:
@@ -63,29 +197,75 @@ class Key(Base):
 
         return self.expiration <= datetime.datetime.now()
 
+    def is_reserved(self) -> bool:
+        return self.reserved_at is not None
+
 
 def _upgrade_keys(session: Session) -> None:
     def upgrade_func(ver: int) -> int:
         if ver < 1:
             sqlalchemy_helpers.table_add_column("keys", "expiration", DateTime, session)
             ver = 1
-        elif ver < 2:
+        if ver < 2:
             add_expiration_tz(platform.gog)
 
             ver = 2
+        if ver < 3:
+            sqlalchemy_helpers.table_add_column("keys", "reserved_by", Integer, session)
+            sqlalchemy_helpers.table_add_column("keys", "reserved_at", DateTime, session)
+            ver = 3
+        if ver < 4:
+            if not sqlalchemy_helpers.index_exists("keys", "ix_keys_game_id", session):
+                sqlalchemy_helpers.create_index("keys", session, "game_id")
+            ver = 4
+        if ver < 5:
+            sqlalchemy_helpers.table_add_column("keys", "fingerprint", String, session)
+            _backfill(session, "keys", "fingerprint", "key", lambda key: get_key_fingerprint(key or ""))
+            clear_duplicate_fingerprints()
+            if not sqlalchemy_helpers.index_exists("keys", "ix_keys_fingerprint", session):
+                sqlalchemy_helpers.get_index_by_name(Key.__table__, "ix_keys_fingerprint").create(bind=session.bind)
+            ver = 5
+        if ver < 6:
+            if not sqlalchemy_helpers.index_exists("keys", "ix_keys_expiration", session):
+                sqlalchemy_helpers.create_index("keys", session, "expiration")
+            ver = 6
+        if ver < 7:
+            sqlalchemy_helpers.table_add_column("keys", "created_at", DateTime, session)
+            session.execute(
+                text("UPDATE keys SET created_at = :now WHERE created_at IS NULL"),
+                {"now": datetime.datetime.now(datetime.UTC).replace(tzinfo=None)},
+            )
+            session.commit()
+            ver = 7
 
         return ver
 
+    def clear_duplicate_fingerprints() -> None:
+        # the oldest copy keeps its fingerprint, the others are left for the owners to sort out
+        # a NULL fingerprint never matches IN, so keys without one aren't counted as duplicates
+        for kept_id, *cleared_ids in _duplicates(session, "keys", "fingerprint").values():
+            logger.warning(f"Keys {cleared_ids} duplicate key {kept_id} and were left without a fingerprint")
+            session.execute(
+                text("UPDATE keys SET fingerprint = NULL WHERE id IN :key_ids").bindparams(
+                    bindparam("key_ids", expanding=True)
+                ),
+                {"key_ids": cleared_ids},
+            )
+
+        session.commit()
+
     def add_expiration_tz(plat: platform.Platform):
-        statement: Query[typing.Type[Key]] = session.query(Key).join(Game).filter(
+        # only touch the columns that exist at this version, later upgrades add more to the model
+        statement: Query = session.query(Key.id, Key.expiration).join(Game).filter(
             and_(
                 Key.platform.is_(plat.search_name),
                 Key.expiration.isnot(None)
             )
         )
-        keys: typing.Sequence[Key] = session.scalars(statement).all()
-        for k in keys:
-            k.expiration = get_eod(k.expiration, plat.expiration_tz)
+        for key_id, expiration in session.execute(statement).all():
+            session.execute(
+                update(Key).where(Key.id == key_id).values(expiration=get_eod(expiration, plat.expiration_tz))
+            )
 
         session.flush()
         session.commit()
@@ -100,6 +280,20 @@ class Guild(Base):
     guild_id = Column(Integer)
     member_id = Column(Integer, ForeignKey("members.id"))
 
+    __table_args__ = (Index("ix_guilds_guild_id_member_id", "guild_id", "member_id"),)
+
+
+def _upgrade_guilds(session: Session) -> None:
+    def upgrade_func(ver: int) -> int:
+        if ver < 1:
+            if not sqlalchemy_helpers.index_exists("guilds", "ix_guilds_guild_id_member_id", session):
+                sqlalchemy_helpers.create_index("guilds", session, "guild_id", "member_id")
+            ver = 1
+
+        return ver
+
+    db_schema.upgrade(entity='guilds', upgrade_func=upgrade_func, session=session)
+
 
 class Member(Base):
     __tablename__ = "members"
@@ -119,14 +313,10 @@ class Member(Base):
     )
 
     @staticmethod
-    def get(session: Session, member_id: int, name: str):
-        member: Member = session.query(Member).filter(Member.id == member_id).first()
-
-        if not member:
-            member = Member(id=member_id, name=name, is_admin=False)
-            session.add(member)
-
-        return member
+    def get(session: Session, member_id: int, name: str) -> "Member":
+        return sqlalchemy_helpers.get_or_insert(
+            session, Member, Member.id, {"id": member_id, "name": name, "is_admin": False}
+        )
 
 
 def _upgrade_member(session: Session) -> None:
@@ -143,11 +333,114 @@ def _upgrade_member(session: Session) -> None:
     db_schema.upgrade(entity='members', upgrade_func=upgrade_func, session=session)
 
 
+class Change(Base):
+    """Append-only log of writes, read by every bot process to evict what it has cached"""
+
+    __tablename__ = "changes"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    guild_id = Column(Integer)
+    member_id = Column(Integer)
+    game_id = Column(Integer)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+    # without AUTOINCREMENT SQLite hands out the ids of pruned rows again, below every process's high-water mark
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class Claim(Base):
+    """Append-only ledger of delivered claims, the claimed keys themselves are deleted"""
+
+    __tablename__ = "claims"
+
+    id = Column(Integer, primary_key=True)
+    claimed_at = Column(DateTime, nullable=False)
+    guild_id = Column(Integer, nullable=False)
+    member_id = Column(Integer, nullable=False)
+    creator_id = Column(Integer, nullable=False)
+    # not a foreign key, a game is deleted with its last key and SQLite hands its id out again
+    game_id = Column(Integer, nullable=False)
+    # so the ledger keeps the title too
+    game_name = Column(String, nullable=False)
+    platform = Column(String, nullable=False)
+
+
+class ClaimDay(Base):
+    """Claims per guild and UTC day, added to with every ledger row"""
+
+    __tablename__ = "claim_days"
+
+    guild_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    claims = Column(Integer, nullable=False)
+
+
+class ClaimDonor(Base):
+    """Claims of each member's keys per guild, added to with every ledger row"""
+
+    __tablename__ = "claim_donors"
+
+    guild_id = Column(Integer, primary_key=True)
+    creator_id = Column(Integer, primary_key=True)
+    claims = Column(Integer, nullable=False)
+
+    # the leaderboard reads the top of a guild's donors straight off the index
+    __table_args__ = (Index("ix_claim_donors_guild_id_claims", "guild_id", "claims"),)
+
+
+class ArchivedKey(Base):
+    """Keys moved out of `keys` by the archive, see `db.archive`"""
+
+    __tablename__ = "archived_keys"
+
+    id = Column(Integer, primary_key=True)
+    # a game is deleted with its last live key, so the archive keeps the title instead
+    game_name = Column(String, nullable=False)
+    key = Column(String)
+    fingerprint = Column(String)
+    platform = Column(String)
+    creator_id = Column(Integer, index=True)
+    expiration = Column(DateTime)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False)
+
+
+# Latest version of each table, bump it together with the table's upgrade function.
+# Tables without an upgrade function are stamped at version 0 once they have been created.
+SCHEMA_VERSIONS: Dict[str, int] = {
+    "games": 3,
+    "keys": 7,
+    "guilds": 1,
+    "members": 2,
+}
+
+
+def _expected_versions() -> Dict[str, int]:
+    return {
+        table: SCHEMA_VERSIONS.get(table, 0)
+        for table in Base.metadata.tables
+        if table != TableVersion.__tablename__
+    }
+
+
+def schema_is_current(db_sessionmaker: sessionmaker) -> bool:
+    with db_sessionmaker() as session:
+        versions: Dict[str, int] = db_schema.get_versions(session)
+
+    return all(versions.get(table, -1) >= version for table, version in _expected_versions().items())
+
+
 def upgrade_tables(db_sessionmaker: sessionmaker) -> None:
     with db_sessionmaker() as session:
         try:
             _upgrade_keys(session=session)
+            _upgrade_games(session=session)
+            _upgrade_guilds(session=session)
             _upgrade_member(session=session)
+
+            for table, version in _expected_versions().items():
+                db_schema.set_version(table, version, session=session)
         except Exception as e:
             session.rollback()
             raise e
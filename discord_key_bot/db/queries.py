@@ -1,5 +1,8 @@
 from enum import Enum
-from typing import Dict
+from typing import Dict, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.sql.elements import TextClause
 
 
 class SortOrder(Enum):
@@ -9,95 +12,270 @@ class SortOrder(Enum):
     EXPIRATION = 4
 
 
+class Visibility(Enum):
+    # every key, e.g. a member's own keys
+    ALL = 1
+    # keys of the members sharing with :guild_id, looked up in the guilds table
+    GUILD = 2
+    # keys of the members in :creator_ids, usually taken from the in-memory share index
+    CREATORS = 3
+
+
+_visibility_filters: Dict[Visibility, str] = {
+    Visibility.ALL: "",
+    Visibility.GUILD: "AND keys.creator_id IN (SELECT guilds.member_id FROM guilds WHERE guilds.guild_id = :guild_id)",
+    Visibility.CREATORS: "AND keys.creator_id IN :creator_ids",
+}
+
 _paginated_game_template: str = """
 WITH platform_games AS (
-    SELECT 
+    SELECT
         games.id as game_id,
-        games.pretty_name AS game_name, 
+        games.pretty_name AS game_name,
+        games.sort_name AS sort_name,
         keys.platform AS platform,
-        IIF(:expiring_only = 1, keys.expiration, NULL) AS expiration,
-        count(keys.id) AS key_count 
-    FROM 
-        games 
-        JOIN keys 
-            ON games.id = keys.game_id 
-        JOIN members
-            ON members.id = keys.creator_id
-    WHERE 
-        (:member_id = 0 OR members.id = :member_id)
+        IIF(:expiring_only = 1, MIN(keys.expiration), NULL) AS expiration,
+        count(keys.id) AS key_count
+    FROM
+        keys
+        JOIN games
+            ON games.id = keys.game_id
+    WHERE
+        (:member_id = 0 OR keys.creator_id = :member_id)
         AND (:platform = '' OR keys.platform = :platform)
         AND (:search_args = '' OR games.name LIKE '%' || :search_args || '%')
         AND ((keys.expiration IS NULL AND :expiring_only = 0) OR keys.expiration > CURRENT_DATE)
-        AND ( 
-            :guild_id = 0 
-            OR EXISTS (
-                SELECT 1
-                FROM guilds 
-                WHERE 
-                    members.id = guilds.member_id 
-                    AND guilds.guild_id = :guild_id))
-    GROUP BY 
+        AND keys.reserved_at IS NULL
+        {visibility}
+    GROUP BY
         games.id, keys.platform
 ),
 page AS (
-    SELECT 
-        DISTINCT game_id 
-    FROM 
-        platform_games 
-    ORDER BY 
-        {}
+    SELECT
+        game_id
+    FROM
+        platform_games
+    GROUP BY
+        game_id
+    ORDER BY
+        {page_order}
     LIMIT :per_page
     OFFSET :offset
 )
 
-SELECT 
-    game_name, platform, expiration, key_count 
-FROM 
-    platform_games 
+SELECT
+    game_name, platform, expiration, key_count
+FROM
+    platform_games
     JOIN page
         ON platform_games.game_id = page.game_id
-    ORDER BY 
-        {};
+    ORDER BY
+        {result_order};
 """
 
-paginated_queries: Dict[SortOrder, str] = {
-    SortOrder.TITLE: _paginated_game_template.format(
-        "LOWER(game_name) ASC", "LOWER(game_name) ASC"
-    ),
-    SortOrder.LATEST: _paginated_game_template.format(
-        "game_id DESC", "platform_games.game_id DESC"
-    ),
-    SortOrder.RANDOM: _paginated_game_template.format(
-        "RANDOM()", "LOWER(game_name) ASC"
-    ),
-    SortOrder.EXPIRATION: _paginated_game_template.format(
-        "expiration ASC", "expiration ASC, LOWER(game_name) ASC"
+_sort_orders: Dict[SortOrder, Tuple[str, str]] = {
+    SortOrder.TITLE: ("sort_name ASC, game_id ASC", "sort_name ASC, platform_games.game_id ASC"),
+    SortOrder.LATEST: ("game_id DESC", "platform_games.game_id DESC"),
+    SortOrder.RANDOM: ("RANDOM()", "sort_name ASC, platform_games.game_id ASC"),
+    # a game is placed by its soonest expiring platform
+    SortOrder.EXPIRATION: (
+        "MIN(expiration) ASC, sort_name ASC, game_id ASC",
+        "expiration ASC, sort_name ASC, platform_games.game_id ASC",
     ),
 }
 
-count_games: str = """
-    SELECT 
+# Title order walks ix_games_sort_name and stops once the page is full, instead of aggregating every visible key
+# and sorting the lot. Only the keys of the page's games are counted. A member's own keys are few enough that
+# sorting them is cheaper than walking every title, so Visibility.ALL keeps the aggregate query.
+_title_page_template: str = """
+WITH page AS (
+    SELECT
+        games.id AS game_id,
+        games.sort_name AS sort_name
+    FROM
+        games
+    WHERE
+        games.key_count > 0
+        AND (:search_args = '' OR games.name LIKE '%' || :search_args || '%')
+        AND EXISTS (
+            SELECT 1
+            FROM
+                keys
+            WHERE
+                keys.game_id = games.id
+                AND (:member_id = 0 OR keys.creator_id = :member_id)
+                AND (:platform = '' OR keys.platform = :platform)
+                AND ((keys.expiration IS NULL AND :expiring_only = 0) OR keys.expiration > CURRENT_DATE)
+                AND keys.reserved_at IS NULL
+                {visibility}
+        )
+    ORDER BY
+        games.sort_name ASC, games.id ASC
+    LIMIT :per_page
+    OFFSET :offset
+)
+
+SELECT
+    games.pretty_name AS game_name,
+    keys.platform AS platform,
+    IIF(:expiring_only = 1, MIN(keys.expiration), NULL) AS expiration,
+    count(keys.id) AS key_count
+FROM
+    page
+    CROSS JOIN games
+        ON games.id = page.game_id
+    CROSS JOIN keys
+WHERE
+    keys.game_id = games.id
+    AND (:member_id = 0 OR keys.creator_id = :member_id)
+    AND (:platform = '' OR keys.platform = :platform)
+    AND ((keys.expiration IS NULL AND :expiring_only = 0) OR keys.expiration > CURRENT_DATE)
+    AND keys.reserved_at IS NULL
+    {visibility}
+GROUP BY
+    page.sort_name, games.id, keys.platform
+ORDER BY
+    page.sort_name ASC, games.id ASC;
+"""
+
+_count_games_template: str = """
+    SELECT
         COUNT(1)
-    FROM 
+    FROM
         games
-    WHERE EXISTS (
+    WHERE
+        games.key_count > 0
+        AND (
+            :platform = ''
+            OR EXISTS (
+                SELECT 1
+                FROM game_platform_counts
+                WHERE
+                    game_platform_counts.game_id = games.id
+                    AND game_platform_counts.platform = :platform
+                    AND game_platform_counts.key_count > 0))
+        AND EXISTS (
         SELECT 1
-        FROM 
-            keys 
-            JOIN members
-                ON members.id = keys.creator_id
-        WHERE 
+        FROM
+            keys
+        WHERE
             keys.game_id = games.id
-            AND (:member_id = 0 OR members.id = :member_id)
+            AND (:member_id = 0 OR keys.creator_id = :member_id)
             AND (:platform = '' OR keys.platform = :platform)
             AND ((keys.expiration IS NULL AND :expiring_only = 0) OR keys.expiration > CURRENT_DATE)
-            AND (
-                :guild_id = 0 
-                OR EXISTS (
-                    SELECT 1
-                    FROM guilds
-                    WHERE 
-                        members.id = guilds.member_id 
-                        AND guilds.guild_id = :guild_id))
+            AND keys.reserved_at IS NULL
+            {visibility}
     )
 """
+
+
+def _compile(query: str, visibility: Visibility) -> TextClause:
+    clause: TextClause = text(query)
+    if visibility == Visibility.CREATORS:
+        clause = clause.bindparams(bindparam("creator_ids", expanding=True))
+
+    return clause
+
+
+# every variant is built once, so the statement cache sees the same object on every call
+paginated_queries: Dict[Tuple[SortOrder, Visibility], TextClause] = {
+    (sort, visibility): _compile(
+        _paginated_game_template.format(
+            visibility=_visibility_filters[visibility],
+            page_order=page_order,
+            result_order=result_order,
+        ),
+        visibility,
+    )
+    for sort, (page_order, result_order) in _sort_orders.items()
+    for visibility in Visibility
+}
+paginated_queries.update({
+    (SortOrder.TITLE, visibility): _compile(
+        _title_page_template.format(visibility=_visibility_filters[visibility]), visibility
+    )
+    for visibility in Visibility
+    if visibility != Visibility.ALL
+})
+
+count_games: Dict[Visibility, TextClause] = {
+    visibility: _compile(_count_games_template.format(visibility=_visibility_filters[visibility]), visibility)
+    for visibility in Visibility
+}
+
+_guild_inventory_template: str = """
+    SELECT
+        shares.guild_id,
+        games.id,
+        games.pretty_name,
+        games.sort_name,
+        keys.platform,
+        COUNT(keys.id),
+        COUNT(keys.expiration),
+        MIN(keys.expiration)
+    FROM
+        keys
+        -- keys stay the outer loop, the shares are probed through an automatic index
+        CROSS JOIN (SELECT DISTINCT guild_id, member_id FROM guilds WHERE guild_id IN :guild_ids) AS shares
+            ON shares.member_id = keys.creator_id
+        JOIN games
+            ON games.id = keys.game_id
+    WHERE
+        (keys.expiration IS NULL OR keys.expiration > CURRENT_DATE)
+        AND keys.reserved_at IS NULL
+        {games_filter}
+    GROUP BY
+        shares.guild_id, games.id, keys.platform
+    ORDER BY
+        shares.guild_id, games.id
+"""
+
+# claimable keys per guild, game and platform for the inventory snapshot
+guild_inventory: TextClause = text(_guild_inventory_template.format(games_filter="")).bindparams(
+    bindparam("guild_ids", expanding=True)
+)
+
+guild_game_inventory: TextClause = text(
+    _guild_inventory_template.format(games_filter="AND keys.game_id IN :game_ids")
+).bindparams(bindparam("guild_ids", expanding=True), bindparam("game_ids", expanding=True))
+
+_guild_titles_template: str = """
+    SELECT DISTINCT
+        shares.guild_id,
+        games.id,
+        games.name,
+        games.pretty_name
+    FROM
+        keys
+        CROSS JOIN (SELECT DISTINCT guild_id, member_id FROM guilds WHERE guild_id IN :guild_ids) AS shares
+            ON shares.member_id = keys.creator_id
+        JOIN games
+            ON games.id = keys.game_id
+    WHERE
+        (keys.expiration IS NULL OR keys.expiration > CURRENT_DATE)
+        AND keys.reserved_at IS NULL
+        {games_filter}
+"""
+
+# titles with a claimable key per guild for the title index
+guild_titles: TextClause = text(_guild_titles_template.format(games_filter="")).bindparams(
+    bindparam("guild_ids", expanding=True)
+)
+
+guild_game_titles: TextClause = text(
+    _guild_titles_template.format(games_filter="AND keys.game_id IN :game_ids")
+).bindparams(bindparam("guild_ids", expanding=True), bindparam("game_ids", expanding=True))
+
+# titles a member has keys for, whether or not they are claimable
+member_titles: TextClause = text("""
+    SELECT DISTINCT
+        games.id,
+        games.name,
+        games.pretty_name
+    FROM
+        keys
+        JOIN games
+            ON games.id = keys.game_id
+    WHERE
+        keys.creator_id = :member_id
+""")
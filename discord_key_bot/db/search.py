@@ -3,53 +3,55 @@ import datetime
 import typing
 from typing import List
 
-from sqlalchemy import text, or_, and_, func, exists
-from sqlalchemy.ext.baked import Result
-from sqlalchemy.orm import Session, Query, aliased
+from sqlalchemy import Result, or_, func, exists
+from sqlalchemy.orm import Session, Query
 
+from discord_key_bot.common import metrics
 from discord_key_bot.common.defaults import PAGE_SIZE
 from discord_key_bot.common.util import (
     GameKeyCount,
     KeyCount,
+    get_key_fingerprint,
     get_search_name,
 )
 from discord_key_bot.db.models import (
     Game,
+    GamePlatformCount,
     Key,
     Member,
     Guild,
 )
-from discord_key_bot.db import queries
-from discord_key_bot.db.queries import SortOrder, paginated_queries
+from discord_key_bot.db import counters, queries
+from discord_key_bot.db.queries import SortOrder, Visibility, paginated_queries
 from discord_key_bot.platform import get_platform, Platform
 
+MAX_CREATOR_PARAMS: int = 500
+
 
 def get_game(
     session: Session,
     game_name: str,
     guild_id: int = 0,
+    creator_ids: typing.Optional[typing.Collection[int]] = None,
 ) -> typing.Optional[Game]:
-    game: typing.Optional[Game] = (
-        session.query(Game)
-        .filter(
-            and_(
-                or_(
-                    guild_id == 0,
-                    Key.creator_id.in_(session.query(Member.id).join(Guild).filter(
-                        Guild.guild_id == guild_id,
-                        and_(
-                            or_(
-                                Key.expiration.is_(None),
-                                Key.expiration > func.current_date()
-                            ),
-                        )
-                    ))
-                ),
-                Game.name == get_search_name(game_name),
-            ),
+    query: Query = session.query(Game).filter(Game.name == get_search_name(game_name))
+
+    visibility: Visibility = _visibility(guild_id, creator_ids)
+    if visibility != Visibility.ALL:
+        visible_creators = (
+            creator_ids if visibility == Visibility.CREATORS
+            else session.query(Guild.member_id).filter(Guild.guild_id == guild_id)
+        )
+        query = query.filter(
+            exists().where(
+                Key.game_id == Game.id,
+                Key.creator_id.in_(visible_creators),
+                or_(Key.expiration.is_(None), Key.expiration > func.current_date()),
+            )
         )
-        .first()
-    )
+
+    with metrics.QUERY_DURATION.time(query="get_game", sort=""):
+        game: typing.Optional[Game] = query.first()
 
     return game
 
@@ -92,7 +94,7 @@ def find_key(
     key_data: typing.Optional[Key] = (
         session.query(Key)
         .filter(
-            Key.key == key
+            Key.fingerprint == get_key_fingerprint(key)
         )
         .first()
     )
@@ -110,24 +112,25 @@ def get_paginated_games(
     per_page: int = PAGE_SIZE,
     sort: SortOrder = SortOrder.TITLE,
     expiring_only: bool = False,
+    creator_ids: typing.Optional[typing.Collection[int]] = None,
 ) -> List[GameKeyCount]:
-    # TODO: make a less hacky query building solution
-    query: str = paginated_queries[sort]
-
+    visibility: Visibility = _visibility(guild_id, creator_ids)
     offset: int = (page - 1) * per_page
 
-    results: Result = session.execute(
-        text(query),
-        {
-            "guild_id": guild_id,
-            "offset": offset,
-            "per_page": per_page,
-            "member_id": member_id,
-            "platform": _platform_search_str(platform),
-            "search_args": get_search_name(title),
-            "expiring_only": expiring_only
-        },
-    )
+    with metrics.QUERY_DURATION.time(query="paginated_games", sort=sort.name):
+        results: List[typing.Tuple] = session.execute(
+            paginated_queries[(sort, visibility)],
+            {
+                "guild_id": guild_id,
+                "creator_ids": list(creator_ids or ()),
+                "offset": offset,
+                "per_page": per_page,
+                "member_id": member_id,
+                "platform": _platform_search_str(platform),
+                "search_args": get_search_name(title),
+                "expiring_only": expiring_only
+            },
+        ).all()
 
     # group platform key counts by game
     game_count_dict: typing.DefaultDict[str, List[KeyCount]] = collections.defaultdict(list)
@@ -149,44 +152,77 @@ def count_games(
     platform: Platform = None,
     member_id: int = 0,
     expiring_only: bool = False,
+    creator_ids: typing.Optional[typing.Collection[int]] = None,
 ) -> int:
-    results: Result = session.execute(
-        text(queries.count_games),
-        {
-            "guild_id": guild_id,
-            "member_id": member_id,
-            "platform": _platform_search_str(platform),
-            "expiring_only": expiring_only,
-        },
-    )
+    with metrics.QUERY_DURATION.time(query="count_games", sort=""):
+        results: Result = session.execute(
+            queries.count_games[_visibility(guild_id, creator_ids)],
+            {
+                "guild_id": guild_id,
+                "creator_ids": list(creator_ids or ()),
+                "member_id": member_id,
+                "platform": _platform_search_str(platform),
+                "expiring_only": expiring_only,
+            },
+        )
 
-    return results.first()[0]
+        return results.first()[0]
 
 
 def key_exists(session: Session, key: str) -> bool:
-    return bool(find_key(session=session, key=key))
+    with metrics.QUERY_DURATION.time(query="key_exists", sort=""):
+        return bool(find_key(session=session, key=key))
 
 
 def delete_expired(session: Session) -> typing.Tuple[int, int]:
-    deleted_keys: int = session.query(Key).filter(Key.expiration < func.current_date()).delete()
+    expired = Key.expiration < func.current_date()
+
+    # a bulk delete bypasses the flush listener, so take the expired keys off the counters here
+    counters.adjust(session, collections.Counter({
+        (game_id, platform): -count
+        for game_id, platform, count in session.query(Key.game_id, Key.platform, func.count(Key.id))
+        .filter(expired)
+        .group_by(Key.game_id, Key.platform)
+    }))
+    deleted_keys: int = session.query(Key).filter(expired).delete()
 
-    game_alias = aliased(Game)
-    deleted_games: int = session.query(Game).filter(
-        ~session.query(game_alias).join(Key).filter(Game.id == game_alias.id).exists()
-    ).delete()
+    return delete_orphan_games(session), deleted_keys
 
-    return deleted_games, deleted_keys
+
+def delete_orphan_games(session: Session) -> int:
+    """Delete the games left without keys by a bulk delete"""
+
+    orphans = session.query(Game.id).filter(Game.key_count == 0)
+    session.query(GamePlatformCount).filter(GamePlatformCount.game_id.in_(orphans)).delete()
+    return session.query(Game).filter(Game.key_count == 0).delete()
+
+
+def _visibility(guild_id: int, creator_ids: typing.Optional[typing.Collection[int]]) -> Visibility:
+    # past this many parameters the guilds subquery is cheaper than binding every creator
+    if creator_ids is not None and (len(creator_ids) <= MAX_CREATOR_PARAMS or not guild_id):
+        return Visibility.CREATORS
+    if guild_id:
+        return Visibility.GUILD
+
+    return Visibility.ALL
 
 
 def _platform_search_str(platform: Platform) -> str:
     return platform.search_name if platform else ''
 
 
+def key_count_label(platform_name: str, expiration: typing.Optional[datetime.datetime] = None) -> str:
+    if expiration:
+        expiration_str: str = datetime.datetime.strftime(expiration, "%b %d %Y")
+        return f"{get_platform(platform_name).name} ({expiration_str})"
+    else:
+        return get_platform(platform_name).name
+
+
 def _get_key_count_label(platform_name: str, expiration: str) -> str:
     if expiration:
         # for whatever reason SQLAlchemy doesn't preserve the Datetime type on custom queries
         expiration_dt: datetime.datetime = datetime.datetime.strptime(expiration, "%Y-%m-%d %H:%M:%S.%f")
-        expiration_str: str = datetime.datetime.strftime(expiration_dt, "%b %d %Y")
-        return f"{get_platform(platform_name).name} ({expiration_str})"
+        return key_count_label(platform_name, expiration_dt)
     else:
-        return get_platform(platform_name).name
+        return key_count_label(platform_name)
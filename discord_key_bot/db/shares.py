@@ -0,0 +1,55 @@
+"""
+In-memory index of which members share their keys with which guild.
+
+Guild commands take the visible creators from here and hand them to the queries as an `IN` list, instead of every
+query looking them up in the guilds table per key. The index is loaded once at startup and reloaded per guild from
+the change log, so shares made through another process show up after its next poll.
+"""
+
+from typing import Dict, FrozenSet, Iterable, Optional, Set
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.db.changes import ChangeSet
+from discord_key_bot.db.models import Guild
+
+
+class ShareIndex(object):
+    def __init__(self, db_sessionmaker: sessionmaker) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        self.guilds: Dict[int, FrozenSet[int]] = {}
+
+    def load(self, guild_ids: Optional[Iterable[int]] = None) -> None:
+        """Read the sharing members of `guild_ids` from the database, or of every guild if none are given"""
+
+        members: Dict[int, Set[int]] = {}
+        with self.db_sessionmaker() as session:
+            query = session.query(Guild.guild_id, Guild.member_id)
+            if guild_ids is not None:
+                guild_ids = set(guild_ids)
+                query = query.filter(Guild.guild_id.in_(guild_ids))
+                members = {guild_id: set() for guild_id in guild_ids}
+
+            for guild_id, member_id in query:
+                members.setdefault(guild_id, set()).add(member_id)
+
+        if guild_ids is None:
+            self.guilds = {}
+
+        for guild_id, member_ids in members.items():
+            if member_ids:
+                self.guilds[guild_id] = frozenset(member_ids)
+            else:
+                self.guilds.pop(guild_id, None)
+
+    def members(self, guild_id: int) -> FrozenSet[int]:
+        return self.guilds.get(guild_id, frozenset())
+
+    def is_sharing(self, guild_id: int, member_id: int) -> bool:
+        return member_id in self.members(guild_id)
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        if changes.everything:
+            self.load()
+        elif changes.shared_guild_ids:
+            self.load(changes.shared_guild_ids)
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+import typing
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+if typing.TYPE_CHECKING:
+    from sqlalchemy.engine import Connection, Engine
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_EXPLAINABLE: typing.Tuple[str, ...] = ("SELECT", "WITH")
+
+
+class SlowQuery(object):
+    """Aggregated timings for one SQL statement that went over the threshold"""
+
+    def __init__(self, statement: str) -> None:
+        self.statement: str = statement
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        # the count and types of the slowest run's parameters, see describe_parameters
+        self.parameters: str = ""
+        self.plan: str = ""
+
+    def record(self, elapsed: float, parameters: str) -> None:
+        self.count += 1
+        self.total += elapsed
+        if elapsed >= self.max:
+            self.max = elapsed
+            self.parameters = parameters
+
+
+class SlowQueryLog(object):
+    """Logs statements slower than a threshold along with their query plan
+
+    Offenders are kept since startup so the worst of them can be inspected later.
+    """
+
+    def __init__(self, threshold: float, max_statements: int = 100) -> None:
+        self.threshold: float = threshold
+        self.max_statements: int = max_statements
+        self._queries: Dict[str, SlowQuery] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def install(self, engine: "Engine") -> None:
+        # created before the bot logs in, SQLAlchemy is only loaded once the database is connected
+        from sqlalchemy import event
+
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def top(self, count: int) -> List[SlowQuery]:
+        with self._lock:
+            queries: List[SlowQuery] = list(self._queries.values())
+
+        return sorted(queries, key=lambda q: q.total, reverse=True)[:count]
+
+    def _before_cursor_execute(
+        self, conn: "Connection", cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        # a connection runs one statement at a time, and one that fails never reaches the after hook to clear its start
+        conn.info["query_start_time"] = time.perf_counter()
+
+    def _after_cursor_execute(
+        self, conn: "Connection", cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        elapsed: float = time.perf_counter() - conn.info.pop("query_start_time")
+        if elapsed < self.threshold:
+            return
+
+        described: str = describe_parameters(parameters, executemany)
+        with self._lock:
+            query: Optional[SlowQuery] = self._queries.get(statement)
+            if query is None:
+                if len(self._queries) >= self.max_statements:
+                    least: SlowQuery = min(self._queries.values(), key=lambda q: q.total)
+                    del self._queries[least.statement]
+                query = self._queries[statement] = SlowQuery(statement)
+                explain: bool = True
+            else:
+                explain: bool = False
+
+            query.record(elapsed, described)
+
+        if explain and not executemany:
+            query.plan = self._explain(conn, cursor, statement, parameters)
+
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms): {statement.strip()}\n"
+            f"Parameters: {described}\n"
+            f"Query plan:\n{query.plan}"
+        )
+
+    @staticmethod
+    def _explain(conn: "Connection", cursor: Any, statement: str, parameters: Any) -> str:
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return ""
+
+        prefix: str = "EXPLAIN QUERY PLAN" if conn.dialect.name == "sqlite" else "EXPLAIN"
+
+        # use a raw DBAPI cursor so the EXPLAIN doesn't fire these hooks again
+        explain_cursor: Any = cursor.connection.cursor()
+        try:
+            explain_cursor.execute(f"{prefix} {statement}", parameters)
+            return "\n".join(str(row[-1]) for row in explain_cursor.fetchall())
+        except Exception:
+            logger.debug("Failed to capture query plan", exc_info=True)
+            return ""
+        finally:
+            explain_cursor.close()
+
+
+def describe_parameters(parameters: Any, executemany: bool) -> str:
+    """The count and types of a statement's bound parameters, never their values: key inserts and fingerprint
+    lookups bind the product keys themselves"""
+
+    rows: Sequence[Any] = parameters if executemany else [parameters]
+    if not rows:
+        return "none"
+
+    first: Any = rows[0]
+    values: Sequence[Any] = list(first.values()) if isinstance(first, Mapping) else list(first or ())
+    types: str = ", ".join(type(value).__name__ for value in values) or "none"
+
+    return f"{len(rows)} rows of ({types})" if executemany else f"({types})"
@@ -0,0 +1,261 @@
+"""
+In-memory inventory snapshot for read-heavy guilds.
+
+Every served guild's claimable keys are held as game id -> platform -> key count and soonest expiration, so the
+browsing commands page, sort and count without a query. A guild is loaded at startup or on first use and patched
+from the change log: a share or unshare reloads the guild, any other change reloads only the games it touched.
+"""
+
+import datetime
+import itertools
+import logging
+import random
+import sys
+import time
+import typing
+from typing import Collection, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.common import defaults, metrics
+from discord_key_bot.common.util import GameKeyCount, KeyCount
+from discord_key_bot.db import queries, search
+from discord_key_bot.db.changes import ChangeSet
+from discord_key_bot.db.queries import SortOrder
+from discord_key_bot.platform import Platform
+
+# guilds per inventory query, keeps the bound parameters well under SQLite's limit
+_GUILD_BATCH_SIZE: int = 500
+
+
+class PlatformStock(typing.NamedTuple):
+    count: int
+    # keys with an expiration date, and the soonest of those dates
+    expiring: int
+    expiration: Optional[datetime.datetime]
+
+
+class GameStock(typing.NamedTuple):
+    game_id: int
+    name: str
+    sort_name: str
+    platforms: Dict[str, PlatformStock]
+    # estimated bytes held for this game
+    size: int
+
+    def expiration(self, platform: Optional[str] = None) -> Optional[datetime.datetime]:
+        expirations: List[datetime.datetime] = [
+            stock.expiration for name, stock in self.platforms.items()
+            if stock.expiration and (platform is None or name == platform)
+        ]
+        return min(expirations, default=None)
+
+
+class GuildInventory(object):
+    def __init__(self, guild_id: int) -> None:
+        self.guild_id: int = guild_id
+        self.games: Dict[int, GameStock] = {}
+        self.size: int = sys.getsizeof(self) + sys.getsizeof(self.games)
+        self._orders: Dict[SortOrder, List[GameStock]] = {}
+        self._expiration: Optional[datetime.datetime] = None
+
+    def replace(self, game_ids: Iterable[int], stocks: Iterable[GameStock]) -> None:
+        """Drop `game_ids` and add `stocks` in their place"""
+
+        for game_id in game_ids:
+            old: Optional[GameStock] = self.games.pop(game_id, None)
+            if old:
+                self.size -= old.size
+
+        for stock in stocks:
+            old: Optional[GameStock] = self.games.pop(stock.game_id, None)
+            if old:
+                self.size -= old.size
+            self.games[stock.game_id] = stock
+            self.size += stock.size
+
+        self._orders.clear()
+        self._expiration = min(
+            (expiration for stock in self.games.values() if (expiration := stock.expiration())), default=None
+        )
+
+    def is_stale(self, today: datetime.date) -> bool:
+        # keys stop being claimable once CURRENT_DATE has passed their expiration date
+        return self._expiration is not None and self._expiration.date() < today
+
+    def get_paginated_games(
+        self,
+        platform: Optional[Platform] = None,
+        page: int = 1,
+        per_page: int = defaults.PAGE_SIZE,
+        sort: SortOrder = SortOrder.TITLE,
+        expiring_only: bool = False,
+    ) -> List[GameKeyCount]:
+        """The same page `search.get_paginated_games` returns for this guild"""
+
+        platform_name: Optional[str] = platform.search_name if platform else None
+        games: List[GameStock] = self._matching(self._ordered(sort), platform_name, expiring_only)
+
+        if sort == SortOrder.RANDOM:
+            games = random.sample(games, len(games) if per_page < 0 else min(per_page, len(games)))
+            games.sort(key=lambda stock: (stock.sort_name, stock.game_id))
+        elif sort == SortOrder.EXPIRATION:
+            games.sort(key=lambda stock: stock.expiration(platform_name) or datetime.datetime.max)
+
+        if per_page >= 0 and sort != SortOrder.RANDOM:
+            games = games[(page - 1) * per_page:page * per_page]
+
+        return [self._key_counts(stock, platform_name, expiring_only) for stock in games]
+
+    def count_games(self, platform: Optional[Platform] = None, expiring_only: bool = False) -> int:
+        platform_name: Optional[str] = platform.search_name if platform else None
+        return len(self._matching(self.games.values(), platform_name, expiring_only))
+
+    def _ordered(self, sort: SortOrder) -> List[GameStock]:
+        if sort not in self._orders:
+            if sort == SortOrder.LATEST:
+                self._orders[sort] = sorted(self.games.values(), key=lambda stock: stock.game_id, reverse=True)
+            else:
+                self._orders[sort] = sorted(self.games.values(), key=lambda stock: (stock.sort_name, stock.game_id))
+
+        return self._orders[sort]
+
+    @staticmethod
+    def _matching(games: Iterable[GameStock], platform: Optional[str], expiring_only: bool) -> List[GameStock]:
+        if platform is None and not expiring_only:
+            return list(games)
+
+        return [
+            stock for stock in games
+            if any(
+                (platform is None or name == platform) and (platform_stock.expiring or not expiring_only)
+                for name, platform_stock in stock.platforms.items()
+            )
+        ]
+
+    @staticmethod
+    def _key_counts(stock: GameStock, platform: Optional[str], expiring_only: bool) -> GameKeyCount:
+        platforms: List[Tuple[str, PlatformStock]] = [
+            (name, platform_stock) for name, platform_stock in stock.platforms.items()
+            if (platform is None or name == platform) and (platform_stock.expiring or not expiring_only)
+        ]
+
+        if expiring_only:
+            platforms.sort(key=lambda item: item[1].expiration)
+            return GameKeyCount(stock.name, [
+                KeyCount(search.key_count_label(name, platform_stock.expiration), platform_stock.expiring)
+                for name, platform_stock in platforms
+            ])
+
+        platforms.sort()
+        return GameKeyCount(stock.name, [
+            KeyCount(search.key_count_label(name), platform_stock.count) for name, platform_stock in platforms
+        ])
+
+
+class InventorySnapshot(object):
+    def __init__(self, db_sessionmaker: sessionmaker, guild_ids: Optional[Collection[int]] = None) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        # None serves every guild
+        self.guild_ids: Optional[FrozenSet[int]] = frozenset(guild_ids) if guild_ids is not None else None
+        self.guilds: Dict[int, GuildInventory] = {}
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def serves(self, guild_id: int) -> bool:
+        return self.guild_ids is None or guild_id in self.guild_ids
+
+    def get(self, guild_id: int) -> GuildInventory:
+        inventory: Optional[GuildInventory] = self.guilds.get(guild_id)
+        hit: bool = inventory is not None and not inventory.is_stale(datetime.datetime.now(datetime.UTC).date())
+        metrics.record_cache_hit("inventory_snapshot", hit)
+
+        if not hit:
+            self.load([guild_id])
+
+        return self.guilds[guild_id]
+
+    def load(self, guild_ids: Iterable[int], game_ids: Optional[Collection[int]] = None) -> None:
+        """Read the inventory of `guild_ids` from the database, only of `game_ids` if given"""
+
+        guild_ids = [guild_id for guild_id in guild_ids if self.serves(guild_id)]
+        if not guild_ids:
+            return
+
+        started: float = time.perf_counter()
+        stocks: Dict[int, List[GameStock]] = {guild_id: [] for guild_id in guild_ids}
+        with self.db_sessionmaker() as session:
+            for batch in _batches(guild_ids, _GUILD_BATCH_SIZE):
+                if game_ids is None:
+                    rows = session.execute(queries.guild_inventory, {"guild_ids": batch})
+                else:
+                    rows = session.execute(
+                        queries.guild_game_inventory, {"guild_ids": batch, "game_ids": list(game_ids)}
+                    )
+
+                for (guild_id, game_id), platform_rows in itertools.groupby(rows, key=lambda row: tuple(row[:2])):
+                    stocks[guild_id].append(_game_stock(game_id, list(platform_rows)))
+
+        for guild_id, guild_stocks in stocks.items():
+            if game_ids is None or guild_id not in self.guilds:
+                self.guilds[guild_id] = GuildInventory(guild_id)
+
+            inventory: GuildInventory = self.guilds[guild_id]
+            inventory.replace(game_ids or (), guild_stocks)
+            metrics.SNAPSHOT_BYTES.set(inventory.size, guild=guild_id)
+
+        self.logger.debug(
+            f"loaded {sum(len(guild_stocks) for guild_stocks in stocks.values())} games "
+            f"{'' if game_ids is None else 'patched '}for {len(guild_ids)} guilds "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def memory_usage(self) -> Dict[int, int]:
+        """Estimated bytes held per guild"""
+        return {guild_id: inventory.size for guild_id, inventory in self.guilds.items()}
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        if changes.everything:
+            # reloaded on next use
+            for guild_id in self.guilds:
+                metrics.SNAPSHOT_BYTES.remove(guild=guild_id)
+            self.guilds.clear()
+            return
+
+        reloaded: List[int] = [guild_id for guild_id in changes.shared_guild_ids if guild_id in self.guilds]
+        if reloaded:
+            self.load(reloaded)
+
+        if changes.game_ids:
+            patched: List[int] = [guild_id for guild_id in self.guilds if guild_id not in changes.shared_guild_ids]
+            self.load(patched, changes.game_ids)
+
+
+def _game_stock(game_id: int, rows: List[typing.Sequence]) -> GameStock:
+    name: str = rows[0][2]
+    sort_name: str = rows[0][3]
+    platforms: Dict[str, PlatformStock] = {
+        platform: PlatformStock(
+            count=count,
+            expiring=expiring,
+            # raw queries return datetimes as text
+            expiration=datetime.datetime.fromisoformat(expiration) if expiration else None,
+        )
+        for _, _, _, _, platform, count, expiring, expiration in rows
+    }
+
+    size: int = (
+        sys.getsizeof(name)
+        + sys.getsizeof(sort_name)
+        + sys.getsizeof(platforms)
+        + sum(sys.getsizeof(platform) + sys.getsizeof(stock) for platform, stock in platforms.items())
+    )
+    stock: GameStock = GameStock(
+        game_id=game_id, name=name, sort_name=sort_name, platforms=platforms, size=size
+    )
+
+    return stock._replace(size=size + sys.getsizeof(stock))
+
+
+def _batches(values: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
@@ -0,0 +1,211 @@
+"""
+Typo-tolerant game name lookup for "did you mean" suggestions.
+
+A SymSpell deletion dictionary over every game: each distinct title prefix is stored under all the strings left by
+deleting up to `MAX_DISTANCE` of its characters, so a misspelt name reaches the titles within that edit distance by
+looking up its own deletions instead of comparing against every title. Titles are compared without case, spaces or
+punctuation, so "portal2" finds "Portal 2". The dictionary is loaded on first use and patched per game from the
+change log.
+"""
+
+import logging
+import re
+import time
+from typing import Container, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.db.changes import ChangeSet
+from discord_key_bot.db.models import Game
+
+# edits (insertions, deletions, substitutions and swaps) a suggestion may be away from the typed name
+MAX_DISTANCE: int = 2
+
+# only this many leading characters are indexed, longer titles are told apart by the distance check
+PREFIX_LENGTH: int = 7
+
+
+class SpellingIndex(object):
+    def __init__(self, db_sessionmaker: sessionmaker) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        # game id -> (compact name, title)
+        self.names: Dict[int, Tuple[str, str]] = {}
+        # deletion -> the prefixes it was made from
+        self.deletions: Dict[str, List[str]] = {}
+        # prefix -> the games whose compact name starts with it
+        self.prefixes: Dict[str, List[int]] = {}
+        self.loaded: bool = False
+        self.logger: logging.Logger = logging.getLogger(__name__)
+
+    def load(self) -> None:
+        """Read every game from the database"""
+
+        started: float = time.perf_counter()
+        self.names.clear()
+        self.deletions.clear()
+        self.prefixes.clear()
+
+        with self.db_sessionmaker() as session:
+            for game_id, title in session.query(Game.id, Game.pretty_name):
+                compact: str = _compact(title)
+                self.names[game_id] = (compact, title)
+                self.prefixes.setdefault(compact[:PREFIX_LENGTH], []).append(game_id)
+
+        # many titles share a prefix, its deletions are made once
+        for prefix in self.prefixes:
+            for deletion in _deletions(prefix):
+                self.deletions.setdefault(deletion, []).append(prefix)
+
+        self.loaded = True
+        self.logger.debug(
+            f"indexed {len(self.names)} games under {len(self.deletions)} deletions "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def suggest(self, name: str, visible: Container[int], limit: int = 3) -> List[str]:
+        """The titles of `visible` games closest to `name`, at most `MAX_DISTANCE` edits away"""
+
+        if not self.loaded:
+            self.load()
+
+        compact: str = _compact(name)
+        seen: Set[int] = set()
+        matches: List[Tuple[int, int, str]] = []
+        nearest: int = MAX_DISTANCE + 1
+
+        for level, deletions in enumerate(_deletion_levels(compact[:PREFIX_LENGTH])):
+            # a title only reached by deleting `level` characters is at least that many edits away
+            if nearest < level:
+                break
+
+            for deletion in deletions:
+                for prefix in self.deletions.get(deletion, ()):
+                    for game_id in self.prefixes[prefix]:
+                        if game_id in seen or game_id not in visible:
+                            continue
+                        seen.add(game_id)
+
+                        candidate, title = self.names[game_id]
+                        if abs(len(candidate) - len(compact)) > nearest:
+                            continue
+
+                        distance: int = _distance(compact, candidate)
+                        if distance <= nearest:
+                            nearest = distance
+                            matches.append((distance, abs(len(candidate) - len(compact)), title))
+
+        return [title for distance, _, title in sorted(matches)[:limit] if distance == nearest]
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        if not self.loaded:
+            return
+
+        if changes.everything:
+            # reloaded on next use
+            self.loaded = False
+            return
+
+        if not changes.game_ids:
+            return
+
+        with self.db_sessionmaker() as session:
+            titles: Dict[int, str] = dict(
+                session.query(Game.id, Game.pretty_name).filter(Game.id.in_(changes.game_ids))
+            )
+
+        for game_id in changes.game_ids:
+            self._remove(game_id)
+            if game_id in titles:
+                self._add(game_id, titles[game_id])
+
+    def _add(self, game_id: int, title: str) -> None:
+        compact: str = _compact(title)
+        self.names[game_id] = (compact, title)
+
+        prefix: str = compact[:PREFIX_LENGTH]
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = []
+            for deletion in _deletions(prefix):
+                self.deletions.setdefault(deletion, []).append(prefix)
+
+        self.prefixes[prefix].append(game_id)
+
+    def _remove(self, game_id: int) -> None:
+        names: Optional[Tuple[str, str]] = self.names.pop(game_id, None)
+        if names is None:
+            return
+
+        prefix: str = names[0][:PREFIX_LENGTH]
+        game_ids: List[int] = self.prefixes[prefix]
+        game_ids.remove(game_id)
+        if game_ids:
+            return
+
+        del self.prefixes[prefix]
+        for deletion in _deletions(prefix):
+            prefixes: List[str] = self.deletions[deletion]
+            prefixes.remove(prefix)
+            if not prefixes:
+                del self.deletions[deletion]
+
+
+def _compact(title: str) -> str:
+    return re.sub(r"[\W_]", "", title.lower())
+
+
+def _deletion_levels(word: str) -> List[Set[str]]:
+    """`word`, then the strings left by deleting one of its characters, then two, up to `MAX_DISTANCE`"""
+
+    levels: List[Set[str]] = [{word}]
+    for _ in range(MAX_DISTANCE):
+        levels.append({edge[:i] + edge[i + 1:] for edge in levels[-1] for i in range(len(edge))})
+
+    return levels
+
+
+def _deletions(word: str) -> Set[str]:
+    return set().union(*_deletion_levels(word))
+
+
+def _distance(a: str, b: str) -> int:
+    """Optimal string alignment distance of `a` and `b`, or `MAX_DISTANCE + 1` once it is known to be larger"""
+
+    # a typo rarely touches both ends, so most of the comparison is dropped here
+    start: int = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end: int = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+
+    if abs(len(a) - len(b)) > MAX_DISTANCE:
+        return MAX_DISTANCE + 1
+    if not a or not b:
+        return max(len(a), len(b))
+
+    too_far: int = MAX_DISTANCE + 1
+    before: List[int] = []
+    previous: List[int] = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current: List[int] = [i] + [too_far] * len(b)
+        nearest: int = i
+        # cells further than MAX_DISTANCE off the diagonal can't lead to a match
+        for j in range(max(1, i - MAX_DISTANCE), min(len(b), i + MAX_DISTANCE) + 1):
+            value: int = previous[j - 1] + (a[i - 1] != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < nearest:
+                nearest = value
+
+        if nearest > MAX_DISTANCE:
+            return too_far
+        before, previous = previous, current
+
+    return min(previous[-1], too_far)
+
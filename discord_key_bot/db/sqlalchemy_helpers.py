@@ -2,9 +2,10 @@
 Miscellaneous SQLAlchemy helpers.
 """
 
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 from sqlalchemy import Index, text, Column, Engine, ClauseElement
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy.orm import Session
 from sqlalchemy.schema import MetaData, Table
@@ -123,24 +124,17 @@ def table_add_column(
 
     column = Column(name=name, type_=col_type, default=default)
 
-    # Use SQLAlchemy's reflection API to get the column DDL
+    # Compile the column DDL for the bound engine's dialect
     engine: Engine = session.get_bind()
-    meta: MetaData = MetaData()
-    meta.reflect(bind=engine)
     col_statement: ClauseElement = CreateColumn(column).compile(bind=engine).statement
 
     # Add the column
     statement = f'ALTER TABLE {table.name} ADD {col_statement}'
     session.execute(text(statement))
 
-    # Get the new schema with added column
-    table = table_schema(table.name, session)
-    column = get_column_by_name(table, name)
-
-    # Backfill the desired default value for engines that don't support defaults
-    if default is not None and not column.default:
-        statement = table.update().values({name: default})
-        session.execute(statement)
+    # The default is only applied on insert, so backfill it for existing rows
+    if default is not None:
+        session.execute(text(f'UPDATE {table.name} SET {name} = :default'), {"default": default})
 
 
 def drop_tables(names: List[str], session: Session) -> None:
@@ -192,3 +186,44 @@ def get_column_by_name(table: Table, name: str) -> Optional[Column]:
         return next(column for column in table.columns if column.name == name)
     except StopIteration:
         return None
+
+
+def upsert(session: Session, entity: Any) -> Union[sqlite.Insert, postgresql.Insert]:
+    """
+    An INSERT for the session's dialect, which can be given an ON CONFLICT clause
+
+    :param session: Session the statement will run on
+    :param entity: Mapped class or table to insert into
+    :return: The dialect's insert construct
+    """
+    dialect: str = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert(entity)
+    if dialect == "postgresql":
+        return postgresql.insert(entity)
+
+    raise NotImplementedError(f"ON CONFLICT is not supported on {dialect}")
+
+
+def get_or_insert(session: Session, entity: Any, column: Column, values: Dict[str, Any]) -> Any:
+    """
+    The row of `entity` whose unique `column` matches `values`, inserted if there is none
+
+    The row is inserted with ON CONFLICT DO NOTHING RETURNING, one statement when it is new. Only when it already
+    existed, including when another session added it first, is it read with a SELECT.
+
+    :param session: Session to use
+    :param entity: Mapped class to look up
+    :param column: Unique column identifying the row
+    :param values: Column values of a new row, including `column`
+    :return: The existing or inserted row
+    """
+    statement = upsert(session, entity).values(**values).on_conflict_do_nothing(
+        index_elements=[column]
+    ).returning(entity)
+
+    row: Optional[Any] = session.scalars(statement).one_or_none()
+    if row is not None:
+        return row
+
+    return session.query(entity).filter(column == values[column.key]).one()
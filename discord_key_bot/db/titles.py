@@ -0,0 +1,185 @@
+"""
+Sorted in-memory title index for slash command autocomplete.
+
+Each guild's claimable titles, and each member's own titles, are held as (search name, game id, title) tuples sorted
+by search name, so the titles starting with what a member typed are found by bisection instead of a `LIKE` scan.
+Guilds and members are loaded on first use and kept current from the change log like the other caches. A name that
+matches no title is looked up in the spelling index for the nearest titles of the same guild or member.
+"""
+
+import bisect
+import datetime
+import logging
+import time
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from discord_key_bot.common import metrics
+from discord_key_bot.common.util import get_search_name
+from discord_key_bot.db import queries
+from discord_key_bot.db.changes import ChangeSet
+from discord_key_bot.db.spelling import SpellingIndex
+
+# discord shows at most this many autocomplete choices
+MAX_COMPLETIONS: int = 25
+
+# guilds per title query, keeps the bound parameters well under SQLite's limit
+_GUILD_BATCH_SIZE: int = 500
+
+TitleEntry = Tuple[str, int, str]
+
+
+class Titles(object):
+    def __init__(self, entries: Iterable[TitleEntry] = ()) -> None:
+        self.entries: List[TitleEntry] = sorted(entries)
+        self._search_names: Dict[int, str] = {game_id: search_name for search_name, game_id, _ in self.entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, game_id: int) -> bool:
+        return game_id in self._search_names
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[str]:
+        """Titles whose search name starts with the search name of `prefix`, in search name order"""
+
+        search_name: str = get_search_name(prefix)
+        titles: List[str] = []
+
+        index: int = bisect.bisect_left(self.entries, (search_name,))
+        while index < len(self.entries) and len(titles) < limit and self.entries[index][0].startswith(search_name):
+            titles.append(self.entries[index][2])
+            index += 1
+
+        return titles
+
+    def replace(self, game_ids: Iterable[int], entries: Iterable[TitleEntry]) -> None:
+        """Drop `game_ids` and add `entries` in their place"""
+
+        for game_id in game_ids:
+            self._remove(game_id)
+
+        for entry in entries:
+            self._remove(entry[1])
+            bisect.insort(self.entries, entry)
+            self._search_names[entry[1]] = entry[0]
+
+    def _remove(self, game_id: int) -> None:
+        search_name: Optional[str] = self._search_names.pop(game_id, None)
+        if search_name is None:
+            return
+
+        index: int = bisect.bisect_left(self.entries, (search_name, game_id))
+        if index < len(self.entries) and self.entries[index][:2] == (search_name, game_id):
+            del self.entries[index]
+
+
+class TitleIndex(object):
+    def __init__(self, db_sessionmaker: sessionmaker) -> None:
+        self.db_sessionmaker: sessionmaker = db_sessionmaker
+        self.guilds: Dict[int, Titles] = {}
+        self.members: Dict[int, Titles] = {}
+        self.spelling: SpellingIndex = SpellingIndex(db_sessionmaker)
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        # keys stop being claimable once CURRENT_DATE has passed their expiration date
+        self._loaded_on: datetime.date = _today()
+
+    def for_guild(self, guild_id: int) -> Titles:
+        """The titles with a key claimable in `guild_id`"""
+
+        self._expire()
+        titles: Optional[Titles] = self.guilds.get(guild_id)
+        metrics.record_cache_hit("title_index", titles is not None)
+
+        if titles is None:
+            self.load([guild_id])
+            titles = self.guilds[guild_id]
+
+        return titles
+
+    def for_member(self, member_id: int) -> Titles:
+        """The titles `member_id` has added keys for"""
+
+        titles: Optional[Titles] = self.members.get(member_id)
+        metrics.record_cache_hit("title_index", titles is not None)
+
+        if titles is None:
+            with self.db_sessionmaker() as session:
+                titles = Titles(
+                    (search_name, game_id, title)
+                    for game_id, search_name, title in session.execute(queries.member_titles, {"member_id": member_id})
+                )
+            self.members[member_id] = titles
+
+        return titles
+
+    def suggest_for_guild(self, guild_id: int, name: str) -> List[str]:
+        """The claimable titles in `guild_id` closest to a misspelt `name`"""
+        return self.spelling.suggest(name, self.for_guild(guild_id))
+
+    def suggest_for_member(self, member_id: int, name: str) -> List[str]:
+        """The titles of `member_id` closest to a misspelt `name`"""
+        return self.spelling.suggest(name, self.for_member(member_id))
+
+    def load(self, guild_ids: Iterable[int], game_ids: Optional[Collection[int]] = None) -> None:
+        """Read the titles of `guild_ids` from the database, only of `game_ids` if given"""
+
+        guild_ids = list(guild_ids)
+        if not guild_ids:
+            return
+
+        started: float = time.perf_counter()
+        entries: Dict[int, List[TitleEntry]] = {guild_id: [] for guild_id in guild_ids}
+        with self.db_sessionmaker() as session:
+            for start in range(0, len(guild_ids), _GUILD_BATCH_SIZE):
+                batch: List[int] = guild_ids[start:start + _GUILD_BATCH_SIZE]
+                if game_ids is None:
+                    rows = session.execute(queries.guild_titles, {"guild_ids": batch})
+                else:
+                    rows = session.execute(queries.guild_game_titles, {"guild_ids": batch, "game_ids": list(game_ids)})
+
+                for guild_id, game_id, search_name, title in rows:
+                    entries[guild_id].append((search_name, game_id, title))
+
+        for guild_id, guild_entries in entries.items():
+            if game_ids is None or guild_id not in self.guilds:
+                self.guilds[guild_id] = Titles(guild_entries)
+            else:
+                self.guilds[guild_id].replace(game_ids, guild_entries)
+
+        self.logger.debug(
+            f"loaded {sum(len(guild_entries) for guild_entries in entries.values())} titles "
+            f"{'' if game_ids is None else 'patched '}for {len(guild_ids)} guilds "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def on_changes(self, changes: ChangeSet) -> None:
+        self.spelling.on_changes(changes)
+
+        if changes.everything:
+            # reloaded on next use
+            self.guilds.clear()
+            self.members.clear()
+            return
+
+        # a renamed game only logs its id
+        for member_id, titles in list(self.members.items()):
+            if member_id in changes.member_ids or any(game_id in titles for game_id in changes.game_ids):
+                del self.members[member_id]
+
+        for guild_id in changes.shared_guild_ids:
+            self.guilds.pop(guild_id, None)
+
+        if changes.game_ids and self.guilds:
+            self.load(list(self.guilds), changes.game_ids)
+
+    def _expire(self) -> None:
+        today: datetime.date = _today()
+        if today != self._loaded_on:
+            self.guilds.clear()
+            self._loaded_on = today
+
+
+def _today() -> datetime.date:
+    return datetime.datetime.now(datetime.UTC).date()
@@ -1,19 +1,64 @@
+import argparse
 import asyncio
+import importlib
 import logging
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
-from sqlalchemy.orm import sessionmaker
+if TYPE_CHECKING:
+    from sqlalchemy.orm import sessionmaker
 
-import discord_key_bot.bot
-import os
+# discord.py and the bot are imported inside start() so every phase of a cold start can be timed by --profile-startup.
+# SQLAlchemy, the database and the cogs are only loaded by the bot's setup_hook, once it has logged in.
+STARTUP_IMPORTS: List[str] = [
+    "dotenv",
+    "discord.ext.commands",
+    "discord_key_bot.bot",
+]
+
+
+class StartupProfile(object):
+    """Wall time of each startup phase, measured from process start"""
+
+    def __init__(self) -> None:
+        self.started: float = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._last: float = self.started
+
+    def mark(self, phase: str) -> None:
+        now: float = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def elapsed(self) -> float:
+        return self._last - self.started
+
+    def report(self) -> str:
+        lines: List[str] = [f"{'phase':40} {'seconds':>9} {'total':>9}"]
+        total: float = 0.0
+        for phase, duration in self.phases:
+            total += duration
+            lines.append(f"{phase:40} {duration:9.3f} {total:9.3f}")
+
+        return "\n".join(lines)
 
-from datetime import timedelta
-from dotenv import load_dotenv
 
-from discord_key_bot.common import defaults
-from discord_key_bot.db import connection
+async def start(profile_startup: bool = False, startup_target: Optional[float] = None) -> int:
+    profile: StartupProfile = StartupProfile()
+    for module in STARTUP_IMPORTS:
+        importlib.import_module(module)
+        profile.mark(f"import {module}")
 
+    from dotenv import load_dotenv
+
+    import discord_key_bot.bot
+    from discord_key_bot.common import defaults, metrics, ratelimit
+    from discord_key_bot.db.slow_queries import SlowQueryLog
 
-async def start():
     load_dotenv()
 
     loglevel_str: str = os.environ.get("LOGLEVEL", defaults.LOG_LEVEL)
@@ -41,17 +86,89 @@ async def start():
     echo_sql_statements: bool = bool(os.environ.get("ECHO_SQL_STATEMENTS", False))
     logger.debug(f"Echo SQL statements: {echo_sql_statements}")
 
-    token: str = os.environ["TOKEN"]
+    metrics_port: int = int(os.environ.get("METRICS_PORT", defaults.METRICS_PORT))
+    metrics_host: str = os.environ.get("METRICS_HOST", defaults.METRICS_HOST)
+    logger.debug(f"Metrics endpoint: {metrics_host}:{metrics_port}" if metrics_port else "Metrics endpoint disabled")
 
     expiration_waiver_period: timedelta = timedelta(
         seconds=int(os.environ.get("EXPIRATION_WAIVER_PERIOD", defaults.EXPIRATION_WAIVER_PERIOD)))
     logger.debug(f"Expiring key cooldown waiver period: {expiration_waiver_period}")
 
-    db_sessionmaker: sessionmaker = connection.new(sqlalchemy_uri, echo=echo_sql_statements)
-    logger.info("Successfully initialized database connection")
+    message_queue_size: int = int(os.environ.get("MESSAGE_QUEUE_SIZE", defaults.MESSAGE_QUEUE_SIZE))
+    logger.debug(f"Outbound message queue size: {message_queue_size}")
+
+    announcement_window: float = float(os.environ.get("ANNOUNCEMENT_WINDOW", defaults.ANNOUNCEMENT_WINDOW))
+    logger.debug(f"Announcement coalescing window: {announcement_window}s")
+
+    slow_query_threshold_ms: int = int(os.environ.get("SLOW_QUERY_THRESHOLD_MS", defaults.SLOW_QUERY_THRESHOLD_MS))
+    logger.debug(f"Slow query threshold: {slow_query_threshold_ms} ms")
+
+    shard_count: int = int(os.environ.get("SHARD_COUNT", defaults.SHARD_COUNT))
+    shard_ids: Optional[List[int]] = [
+        int(shard_id) for shard_id in os.environ.get("SHARD_IDS", defaults.SHARD_IDS).split(",") if shard_id.strip()
+    ] or None
+    if shard_ids and not shard_count:
+        logger.critical("SHARD_IDS is set without SHARD_COUNT, set SHARD_COUNT to the total number of shards")
+        return 1
+    logger.debug(f"Shards: {shard_ids or 'all'} of {shard_count}" if shard_count else "Sharding disabled")
+
+    cache_sync_interval: float = float(os.environ.get("CACHE_SYNC_INTERVAL", defaults.CACHE_SYNC_INTERVAL))
+    logger.debug(f"Cache sync interval: {cache_sync_interval}s")
+
+    snapshot_guilds: str = os.environ.get("SNAPSHOT_GUILDS", defaults.SNAPSHOT_GUILDS).strip()
+    snapshot_all_guilds: bool = snapshot_guilds.lower() == "all"
+    snapshot_guild_ids: List[int] = [] if snapshot_all_guilds else [
+        int(guild_id) for guild_id in snapshot_guilds.split(",") if guild_id.strip()
+    ]
+    logger.debug(
+        f"Inventory snapshot: {'all guilds' if snapshot_all_guilds else snapshot_guild_ids or 'disabled'}"
+    )
+
+    page_timeout: float = float(os.environ.get("PAGE_TIMEOUT", defaults.PAGE_TIMEOUT))
+    logger.debug(f"Page buttons timeout: {page_timeout}s")
+
+    rate_limit_capacity: float = float(os.environ.get("RATE_LIMIT_CAPACITY", defaults.RATE_LIMIT_CAPACITY))
+    rate_limit_refill_rate: float = float(os.environ.get("RATE_LIMIT_REFILL_RATE", defaults.RATE_LIMIT_REFILL_RATE))
+    rate_limit_costs: Dict[str, float] = ratelimit.parse_costs(
+        os.environ.get("RATE_LIMIT_COSTS", defaults.RATE_LIMIT_COSTS)
+    )
+    logger.debug(
+        f"Rate limit: {rate_limit_capacity} tokens refilled at {rate_limit_refill_rate}/s, costs {rate_limit_costs}"
+        if rate_limit_capacity > 0 else "Rate limit disabled"
+    )
+
+    expiry_announcements: bool = bool(int(os.environ.get("EXPIRY_ANNOUNCEMENTS", int(defaults.EXPIRY_ANNOUNCEMENTS))))
+    logger.debug(f"Expiring key announcements: {'enabled' if expiry_announcements else 'disabled'}")
+
+    archive_after: timedelta = timedelta(days=int(os.environ.get("ARCHIVE_AFTER_DAYS", defaults.ARCHIVE_AFTER_DAYS)))
+    logger.debug(f"Archive keys older than: {archive_after}" if archive_after else "Only unshared keys are archived")
+
+    archive_unshared_after: timedelta = timedelta(
+        days=int(os.environ.get("ARCHIVE_UNSHARED_AFTER_DAYS", defaults.ARCHIVE_UNSHARED_AFTER_DAYS)))
+    logger.debug(f"Archive unshared keys older than: {archive_unshared_after}")
+
+    slow_query_log: Optional[SlowQueryLog] = (
+        SlowQueryLog(threshold=slow_query_threshold_ms / 1000) if slow_query_threshold_ms > 0 else None
+    )
+
+    profile.mark("configuration")
+
+    def connect_database() -> "sessionmaker":
+        # called by setup_hook once it has imported the cogs, and SQLAlchemy with them
+        profile.mark("import cogs")
+        from discord_key_bot.db import connection
+
+        db_sessionmaker: sessionmaker = connection.new(
+            sqlalchemy_uri, echo=echo_sql_statements, slow_query_log=slow_query_log
+        )
+        profile.mark("database")
+        metrics.STARTUP_DURATION.set(profile.elapsed, phase="database")
+        logger.info(f"Successfully initialized database connection in {profile.elapsed:.2f}s")
+
+        return db_sessionmaker
 
     bot = await discord_key_bot.bot.new(
-        db_sessionmaker=db_sessionmaker,
+        connect_database=connect_database,
         bot_channel_id=bot_channel_id,
         wait_time=wait_time,
         command_prefix=command_prefix,
@@ -59,9 +176,77 @@ async def start():
         expiration_waiver_period=expiration_waiver_period,
         log_level=log_level,
         log_handler=logging.StreamHandler(),
+        message_queue_size=message_queue_size,
+        announcement_window=announcement_window,
+        slow_query_log=slow_query_log,
+        startup_started=profile.started,
+        shard_count=shard_count,
+        shard_ids=shard_ids,
+        cache_sync_interval=cache_sync_interval,
+        snapshot_guild_ids=snapshot_guild_ids,
+        snapshot_all_guilds=snapshot_all_guilds,
+        page_timeout=page_timeout,
+        rate_limit_capacity=rate_limit_capacity,
+        rate_limit_refill_rate=rate_limit_refill_rate,
+        rate_limit_costs=rate_limit_costs,
+        expiry_announcements=expiry_announcements,
+        archive_after=archive_after,
+        archive_unshared_after=archive_unshared_after,
     )
+    profile.mark("bot")
+
+    if profile_startup:
+        # what logging in would run, without logging in
+        await bot.setup_hook()
+        profile.mark("caches and cogs")
+
+        bot.db_sessionmaker.kw["bind"].dispose()
+        print(profile.report())
+        if startup_target is not None and profile.elapsed > startup_target:
+            print(f"Cold start took {profile.elapsed:.3f}s, over the {startup_target:.3f}s target", file=sys.stderr)
+            return 1
+
+        return 0
+
+    # the event loop only keeps weak references to tasks, these run for as long as the bot does
+    background_tasks: Set[asyncio.Task] = set()
+
+    if metrics_port:
+        await metrics.serve(metrics_host, metrics_port)
+        background_tasks.add(asyncio.create_task(metrics.monitor_event_loop()))
+
+    # bot.start() in two steps: logging in runs setup_hook, which builds what the tasks below run
+    await bot.login(os.environ["TOKEN"])
+
+    if cache_sync_interval > 0:
+        background_tasks.add(asyncio.create_task(bot.change_watcher.run()))
+
+    if bot.expiration_schedule:
+        background_tasks.add(asyncio.create_task(bot.expiration_schedule.run()))
+
+    background_tasks.add(asyncio.create_task(bot.claim_outbox.run()))
+
+    await bot.connect()
+
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Run the discord key bot")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="print an import and initialisation time breakdown, then exit without connecting to discord",
+    )
+    parser.add_argument(
+        "--startup-target",
+        type=float,
+        help="with --profile-startup, exit with an error if cold start took longer than this many seconds",
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    return asyncio.run(start(profile_startup=args.profile_startup, startup_target=args.startup_target))
 
-    await bot.start(token)
 
 if __name__ == "__main__":
-    asyncio.run(start())
+    sys.exit(main())